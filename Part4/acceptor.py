@@ -0,0 +1,192 @@
+import argparse
+import socket
+import threading
+from collections import Counter
+
+from framing import (
+    DECISION,
+    PAXOS_ACCEPT,
+    PAXOS_ACCEPTED,
+    PAXOS_PREPARE,
+    PAXOS_PROMISE,
+    REGISTER,
+    FrameReader,
+    Opcode,
+    encode_frame,
+)
+from paxos import ACCEPTOR_PORT, NOTHING_ACCEPTED
+from transport import ReplySender
+from wal import TransactionStore
+
+
+class Acceptor:
+    """One of the 2F+1 acceptors that choose the votes under Paxos Commit.
+
+    The state of each participant's instance of a transaction, the highest
+    ballot promised and the ballot and vote last accepted, is forced to the
+    acceptor's log before it is reported. The acceptances of ballot 0, in
+    which each participant proposes its own vote, go to the coordinators
+    connected; anything else is answered to the proposer that asked. A
+    transaction is forgotten once the coordinator reports that every
+    participant has its outcome.
+    """
+
+    def __init__(self, acceptor_index, transaction_store):
+        self.acceptor_index = acceptor_index
+        self.transaction_store = transaction_store
+        self.lock = threading.Lock()
+        self.leaders = []  # ReplySenders of the coordinator connections
+        self.frame_counts = Counter()
+
+    def instance(self, transaction_id, participant):
+        """The promised ballot, accepted ballot and accepted vote of an instance."""
+        transaction = self.transaction_store.get(transaction_id) or {}
+        return transaction.get(f"instance_{participant}", [0, *NOTHING_ACCEPTED])
+
+    def record(self, transaction_id, participant, state):
+        return self.transaction_store.write(
+            {
+                "transaction_id": transaction_id,
+                "status": "pending",
+                f"instance_{participant}": state,
+            }
+        )
+
+    def promise(self, frame):
+        """Phase 1b: promises to ignore lower ballots and reports the vote accepted."""
+        ballot = int(frame.payload)
+        with self.lock:
+            promised, accepted_ballot, vote = self.instance(
+                frame.transaction_id, frame.participant
+            )
+            if ballot <= promised:
+                self.frame_counts["rejected"] += 1
+                return None
+            ticket = self.record(
+                frame.transaction_id, frame.participant, [ballot, accepted_ballot, vote]
+            )
+        payload = f"{self.acceptor_index} {ballot} {accepted_ballot} {vote}"
+        return ticket, encode_frame(
+            PAXOS_PROMISE, frame.transaction_id, payload, frame.participant
+        )
+
+    def accept(self, frame):
+        """Phase 2b: accepts a vote unless a higher ballot was promised."""
+        ballot, vote = frame.payload.decode().split(" ", 1)
+        ballot = int(ballot)
+        with self.lock:
+            promised, _, _ = self.instance(frame.transaction_id, frame.participant)
+            if ballot < promised:
+                self.frame_counts["rejected"] += 1
+                return None
+            ticket = self.record(
+                frame.transaction_id, frame.participant, [ballot, ballot, vote]
+            )
+        payload = f"{self.acceptor_index} {ballot} {vote}"
+        return ticket, encode_frame(
+            PAXOS_ACCEPTED, frame.transaction_id, payload, frame.participant
+        )
+
+    def forget(self, transaction_id):
+        """Lets the next checkpoint drop a transaction every participant finished."""
+        if self.transaction_store.is_pending(transaction_id):
+            self.transaction_store.write(
+                {"transaction_id": transaction_id, "status": "done"}, force=False
+            )
+
+    def serve(self, sock):
+        """Answers the requests of one coordinator or participant connection."""
+        reader = FrameReader(sock)
+        replies = ReplySender(sock)
+        try:
+            while True:
+                frames = reader.read_frames()
+                if frames is None:
+                    break
+                # The replies to one read share the fsync of their records
+                outgoing = {}  # ReplySender -> (tickets, frames)
+                for frame in frames:
+                    try:
+                        self.frame_counts[Opcode(frame.frame_type).name] += 1
+                    except ValueError:
+                        continue
+                    if frame.frame_type == REGISTER and frame.participant == 0:
+                        with self.lock:
+                            self.leaders.append(replies)
+                        continue
+                    if frame.frame_type == DECISION:
+                        self.forget(frame.transaction_id)
+                        continue
+                    if frame.frame_type == PAXOS_PREPARE:
+                        reply = self.promise(frame)
+                        recipients = [replies]
+                    elif frame.frame_type == PAXOS_ACCEPT:
+                        reply = self.accept(frame)
+                        with self.lock:
+                            recipients = (
+                                list(self.leaders)
+                                if frame.payload.startswith(b"0 ")
+                                else [replies]
+                            )
+                    else:
+                        continue
+                    if reply is None:
+                        continue
+                    ticket, data = reply
+                    for recipient in recipients:
+                        tickets, replies_to = outgoing.setdefault(recipient, ([], []))
+                        tickets.append(ticket)
+                        replies_to.append(data)
+                for recipient, (tickets, replies_to) in outgoing.items():
+                    recipient.send_after(tickets, b"".join(replies_to))
+        except OSError as e:
+            print(f"Connection failed: {e}")
+        finally:
+            with self.lock:
+                if replies in self.leaders:
+                    self.leaders.remove(replies)
+            replies.close()
+            sock.close()
+
+    def stats(self):
+        """Frames received by type, and the requests ignored for a lower ballot."""
+        return dict(self.frame_counts)
+
+
+def start_acceptor(acceptor_index):
+    SERVER_IP = "127.0.0.1"
+    TRANSACTION_LOG = f"acceptor_{acceptor_index}_transactions.jsonl"
+    GROUP_COMMIT_MAX_DELAY = 0.002  # Seconds to wait for more records per fsync
+    GROUP_COMMIT_MAX_BATCH = 128
+    CHECKPOINT_RECORDS = 10000  # Compact the log after this many records
+    CHECKPOINT_BYTES = 4 * 1024 * 1024  # ... or once it grows past this size
+
+    transaction_store = TransactionStore(
+        TRANSACTION_LOG,
+        max_batch_delay=GROUP_COMMIT_MAX_DELAY,
+        max_batch_size=GROUP_COMMIT_MAX_BATCH,
+        checkpoint_records=CHECKPOINT_RECORDS,
+        checkpoint_bytes=CHECKPOINT_BYTES,
+    )
+    acceptor = Acceptor(acceptor_index, transaction_store)
+    port = ACCEPTOR_PORT + acceptor_index
+    listener = socket.create_server((SERVER_IP, port))
+    print(f"Acceptor {acceptor_index} listening on port {port}.")
+    try:
+        while True:
+            sock, _ = listener.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=acceptor.serve, args=(sock,), daemon=True).start()
+    except KeyboardInterrupt:
+        print(f"Acceptor {acceptor_index} shutting down.")
+    listener.close()
+    print(f"Log group commit stats: {transaction_store.stats()}")
+    print(f"Acceptor stats: {acceptor.stats()}")
+    transaction_store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paxos Commit acceptor")
+    parser.add_argument("acceptor_index", type=int, help="1 to 2F+1, e.g. 1, 2, 3")
+    args = parser.parse_args()
+    start_acceptor(args.acceptor_index)
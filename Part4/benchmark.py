@@ -0,0 +1,962 @@
+import argparse
+import ast
+import json
+import os
+import queue
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, redirect_stdout
+
+from coordinator import CoordinatorEngine, connect_to_server, wait_for_participants
+from framing import (
+    DECISION,
+    DONE,
+    EXIT,
+    HEARTBEAT,
+    HEARTBEAT_ACK,
+    PREPARE,
+    PROTOCOLS,
+    VOTE,
+    FrameBuffer,
+    encode_frame,
+    encode_operations,
+)
+from kvstore import KeyValueStore
+from paxos import AcceptorGroup, acceptor_addresses
+from transport import DirectTransport, RelayTransport
+from wal import TransactionStore
+
+SERVER_IP = "127.0.0.1"
+SERVER_PORT = 12346
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(function, count):
+    """Runs function(count) and returns the time per item in microseconds."""
+    started = time.perf_counter()
+    function(count)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+@contextmanager
+def cluster(
+    workdir, participants, server_args=(), participant_args=(), acceptors=0
+):
+    """Starts the server, participants and acceptors as subprocesses in workdir.
+
+    Yields the coordinator's server socket with every participant connected,
+    together with the handshake result of ``wait_for_participants``. The
+    output of participant i is left in ``participant_<i>.out``, that of
+    acceptor i in ``acceptor_<i>.out``, and whatever the coordinator side
+    prints while the cluster runs is discarded.
+    """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield from run_cluster(
+            workdir, participants, server_args, participant_args, acceptors
+        )
+
+
+def run_cluster(workdir, participants, server_args, participant_args, acceptors):
+    acceptor_processes = []
+    for index in range(1, acceptors + 1):
+        with open(os.path.join(workdir, f"acceptor_{index}.out"), "w") as out:
+            acceptor_processes.append(
+                subprocess.Popen(
+                    [sys.executable, os.path.join(HERE, "acceptor.py"), str(index)],
+                    cwd=workdir,
+                    stdout=out,
+                )
+            )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(HERE, "server.py"),
+            "--participants",
+            str(participants),
+            *server_args,
+        ],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+    )
+    processes = [server, *acceptor_processes]
+    coordinator_socket = None
+    try:
+        coordinator_socket = connect_to_server(SERVER_IP, SERVER_PORT, retry_for=10)
+        for index in range(1, participants + 1):
+            with open(os.path.join(workdir, f"participant_{index}.out"), "w") as out:
+                processes.append(
+                    subprocess.Popen(
+                        [
+                            sys.executable,
+                            os.path.join(HERE, "participant.py"),
+                            str(index),
+                            *participant_args,
+                        ],
+                        cwd=workdir,
+                        stdout=out,
+                    )
+                )
+        yield coordinator_socket, wait_for_participants(coordinator_socket)
+    finally:
+        if coordinator_socket is not None:
+            try:
+                coordinator_socket.sendall(encode_frame(EXIT))
+            except OSError:
+                pass
+            coordinator_socket.close()
+        # Acceptors serve until interrupted, then print their statistics
+        for process in acceptor_processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def participant_log_stats(
+    workdir, participants, label="Log group commit stats", role="participant"
+):
+    """Statistics each participant, or acceptor, printed under a label on exit."""
+    stats = []
+    for index in range(1, participants + 1):
+        with open(os.path.join(workdir, f"{role}_{index}.out")) as out:
+            lines = [line for line in out if line.startswith(f"{label}: ")]
+        if lines:
+            stats.append(ast.literal_eval(lines[-1].split(": ", 1)[1]))
+    return stats
+
+
+def run_phases(transport, num_participants, count):
+    """Runs transactions one at a time and times both phases of each."""
+    replies = queue.Queue()
+    transport.start(replies.put)
+
+    def wait_for(frame_type, transaction_id):
+        received = set()
+        while len(received) < num_participants:
+            frame = replies.get(timeout=30)
+            if (frame.frame_type, frame.transaction_id) == (frame_type, transaction_id):
+                received.add(frame.participant)
+
+    prepare_times, decision_times = [], []
+    for _ in range(count):
+        transaction_id = uuid.uuid4().hex
+        started = time.perf_counter()
+        payload = encode_operations([], {transaction_id: "benchmark"})
+        transport.send(encode_frame(PREPARE, transaction_id, payload))
+        wait_for(VOTE, transaction_id)
+        voted = time.perf_counter()
+        transport.send(encode_frame(DECISION, transaction_id, b"Commit"))
+        wait_for(DONE, transaction_id)
+        prepare_times.append((voted - started) * 1000)
+        decision_times.append((time.perf_counter() - voted) * 1000)
+    return sorted(prepare_times), sorted(decision_times)
+
+
+def benchmark_transport(args):
+    """Compares phase round trips through the relay server and over direct links."""
+    print(
+        f"{args.transactions} sequential transactions, {args.participants} "
+        f"participants, server mode {args.server_mode}, latencies in ms"
+    )
+    print(f"{'topology':<10}{'phase':<10}{'p50':>8}{'p99':>8}{'mean':>8}")
+    for topology in ("relayed", "direct"):
+        participant_args = ["--direct"] if topology == "direct" else []
+        with tempfile.TemporaryDirectory() as workdir, cluster(
+            workdir, args.participants, ["--mode", args.server_mode], participant_args
+        ) as (coordinator_socket, handshake):
+            frame_reader, num_participants, members = handshake
+            if topology == "direct":
+                transport = DirectTransport(members)
+            else:
+                transport = RelayTransport(coordinator_socket, frame_reader)
+            phases = run_phases(transport, num_participants, args.transactions)
+            transport.close()
+
+        for phase, times in zip(("prepare", "decision"), phases):
+            print(
+                f"{topology:<10}{phase:<10}{percentile(times, 0.5):>8.2f}"
+                f"{percentile(times, 0.99):>8.2f}{sum(times) / len(times):>8.2f}"
+            )
+
+
+def run_engine(
+    workdir,
+    protocol,
+    args,
+    one_phase=True,
+    targets=None,
+    messages=None,
+    acceptors=3,
+):
+    """Runs a workload through a coordinator engine against a live cluster.
+
+    ``targets(i)`` gives the participants transaction i touches, all of them
+    by default, and ``messages(i)`` its message. Under Paxos Commit the
+    cluster has that many ``acceptors``. Returns the log statistics of the
+    coordinator and the acceptors, the participants' log and lock
+    statistics, the number of transaction frames each way, counting those
+    the acceptors receive, and the transaction latencies.
+    """
+    if protocol != "paxos-commit":
+        acceptors = 0
+    participant_args = [
+        "--protocol",
+        protocol,
+        "--abort-rate",
+        str(args.abort_rate),
+        "--read-only-rate",
+        str(args.read_only_rate),
+        "--acceptors",
+        str(acceptors),
+    ]
+    with cluster(workdir, args.participants, (), participant_args, acceptors) as (
+        coordinator_socket,
+        handshake,
+    ):
+        frame_reader, num_participants, _ = handshake
+        transport = RelayTransport(coordinator_socket, frame_reader)
+        log_path = os.path.join(workdir, "coordinator_transactions.jsonl")
+        store = TransactionStore(log_path)
+        acceptor_group = None
+        if acceptors:
+            acceptor_group = AcceptorGroup(acceptor_addresses(acceptors), 0)
+        engine = CoordinatorEngine(
+            transport,
+            num_participants,
+            store,
+            max_in_flight=args.max_in_flight,
+            protocol=protocol,
+            one_phase=one_phase,
+            acceptors=acceptor_group,
+        )
+
+        # Count transaction frames, not heartbeats, on their way in and out
+        frames_sent = Counter()
+        frames_received = Counter()
+        send, handle_reply = engine.send, engine.handle_reply
+        handle_accepted = engine.handle_accepted
+
+        def counting_send(frame_type, transaction_id, payload=b"", participant=0):
+            frames_sent[frame_type] += 1 if participant else num_participants
+            send(frame_type, transaction_id, payload, participant)
+
+        def counting_handle_reply(frame):
+            if frame.frame_type != HEARTBEAT_ACK:
+                frames_received[frame.frame_type] += 1
+            handle_reply(frame)
+
+        def counting_handle_accepted(frame):
+            frames_received[frame.frame_type] += 1
+            handle_accepted(frame)
+
+        engine.send = counting_send
+        engine.handle_reply = counting_handle_reply
+        engine.handle_accepted = counting_handle_accepted
+
+        latencies = []
+        abort_latencies = []
+        outcomes = Counter()
+
+        def finished(transaction, started):
+            latency = (time.perf_counter() - started) * 1000
+            latencies.append(latency)
+            if transaction.decision == "Abort":
+                abort_latencies.append(latency)
+            outcomes[transaction.decision] += 1
+
+        engine.start()
+        for i in range(args.transactions):
+            started = time.perf_counter()
+            engine.submit(
+                messages(i) if messages is not None else f"message {i}",
+                lambda transaction, started=started: finished(transaction, started),
+                targets(i) if targets is not None else None,
+            )
+        engine.drain()
+        engine.stop()
+        if acceptor_group is not None:
+            acceptor_group.close()
+        coordinator_stats = store.stats()
+        store.close()
+
+    acceptor_frames = participant_log_stats(
+        workdir, acceptors, "Acceptor stats", "acceptor"
+    )
+    return {
+        "outcomes": outcomes,
+        "coordinator": coordinator_stats,
+        "participants": participant_log_stats(workdir, args.participants),
+        "locks": participant_log_stats(
+            workdir, args.participants, "Lock manager stats"
+        ),
+        "acceptors": participant_log_stats(
+            workdir, acceptors, role="acceptor"
+        ),
+        "frames_sent": sum(frames_sent.values()),
+        "frames_received": sum(frames_received.values())
+        + sum(
+            count
+            for stats in acceptor_frames
+            for frame_type, count in stats.items()
+            if frame_type not in ("REGISTER", "rejected")
+        ),
+        "latencies": sorted(latencies),
+        "abort_latencies": sorted(abort_latencies),
+    }
+
+
+def decided_transactions(workdir, participant):
+    """IDs of the transactions with an outcome in a participant's log."""
+    path = os.path.join(workdir, f"participant_{participant}_transactions.jsonl")
+    decided = set()
+    with open(path) as log:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A record still being written
+            if "decision" in record:
+                decided.add(record["transaction_id"])
+    return decided
+
+
+def run_outage(workdir, protocol, args):
+    """Silences the coordinator once every participant voted on a few transactions.
+
+    Prepares ``args.in_doubt`` transactions at every participant and waits
+    for the votes, then sends nothing, heartbeats included, for
+    ``args.outage_ms``, after which the coordinator comes back and aborts
+    what is still undecided. Returns how long after the silence began each
+    transaction had an outcome at every participant, in ms.
+    """
+    participant_args = [
+        "--protocol",
+        protocol,
+        "--termination-timeout-ms",
+        str(args.termination_timeout_ms),
+    ]
+    if protocol != "three-phase":
+        participant_args.append("--cooperative")
+    with cluster(workdir, args.participants, (), participant_args) as (
+        coordinator_socket,
+        handshake,
+    ):
+        frame_reader, num_participants, _ = handshake
+        participants = list(range(1, num_participants + 1))
+
+        def exchange(frames, seconds):
+            """Sends frames and heartbeats for a while, discarding the replies."""
+            coordinator_socket.sendall(frames)
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                coordinator_socket.sendall(
+                    encode_frame(HEARTBEAT, payload=str(time.time()))
+                )
+                try:
+                    frame_reader.read_frames(0.05)
+                except OSError:
+                    pass
+
+        # Participants learn the heartbeat rhythm before the outage
+        exchange(b"", 1.0)
+        transaction_ids = [uuid.uuid4().hex for _ in range(args.in_doubt)]
+        exchange(
+            b"".join(
+                encode_frame(
+                    PREPARE,
+                    transaction_id,
+                    encode_operations(
+                        [], {f"k{i}": protocol}, time.time_ns(), participants
+                    ),
+                )
+                for i, transaction_id in enumerate(transaction_ids)
+            ),
+            0.2,
+        )
+
+        silent_since = time.perf_counter()
+        recovery = {}
+        came_back = False
+        while len(recovery) < len(transaction_ids):
+            elapsed = (time.perf_counter() - silent_since) * 1000
+            if not came_back and elapsed >= args.outage_ms:
+                came_back = True
+                coordinator_socket.sendall(
+                    b"".join(
+                        encode_frame(DECISION, transaction_id, b"Abort")
+                        for transaction_id in transaction_ids
+                        if transaction_id not in recovery
+                    )
+                )
+            decided = set.intersection(
+                *(decided_transactions(workdir, index) for index in participants)
+            )
+            for transaction_id in decided - recovery.keys():
+                recovery[transaction_id] = elapsed
+            try:
+                frame_reader.read_frames(0.01)
+            except OSError:
+                pass
+    return sorted(recovery.values())
+
+
+def benchmark_protocols(args):
+    """Compares log writes, fsyncs and messages of the commit protocol variants."""
+    print(
+        f"{args.transactions} transactions, {args.participants} participants, "
+        f"abort rate {args.abort_rate} and read-only rate {args.read_only_rate} "
+        "per participant vote"
+    )
+    print(
+        f"{'protocol':<16}{'commits':>8}{'aborts':>8}{'coord rec':>10}"
+        f"{'coord sync':>11}{'part rec':>9}{'part sync':>10}{'msgs':>7}"
+        f"{'msgs/commit':>12}{'syncs/commit':>13}{'p50 ms':>8}{'abort p50':>10}"
+    )
+    for protocol in args.protocols:
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_engine(workdir, protocol, args)
+        commits = result["outcomes"]["Commit"]
+        coordinator_syncs = result["coordinator"].get("syncs", 0)
+        participant_syncs = sum(
+            stats.get("syncs", 0) for stats in result["participants"]
+        )
+        participant_records = sum(
+            stats.get("records", 0) for stats in result["participants"]
+        )
+        acceptor_syncs = sum(stats.get("syncs", 0) for stats in result["acceptors"])
+        syncs = coordinator_syncs + participant_syncs + acceptor_syncs
+        messages = result["frames_sent"] + result["frames_received"]
+        print(
+            f"{protocol:<16}{commits:>8}{result['outcomes']['Abort']:>8}"
+            f"{result['coordinator'].get('records', 0):>10}{coordinator_syncs:>11}"
+            f"{participant_records:>9}{participant_syncs:>10}{messages:>7}"
+            f"{messages / max(commits, 1):>12.2f}"
+            f"{syncs / max(commits, 1):>13.2f}"
+            f"{percentile(result['latencies'], 0.5):>8.2f}"
+            f"{percentile(result['abort_latencies'], 0.5):>10.2f}"
+        )
+
+
+def benchmark_one_phase(args):
+    """Compares single-participant transactions with and without one-phase commit."""
+    print(
+        f"{args.transactions} transactions, each on one of {args.participants} "
+        f"participants, {args.max_in_flight} in flight"
+    )
+    print(
+        f"{'mode':<12}{'commits':>8}{'syncs':>7}{'msgs':>7}"
+        f"{'p50 ms':>8}{'p99 ms':>8}{'mean ms':>9}"
+    )
+    for mode, one_phase in (("two-phase", False), ("one-phase", True)):
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_engine(
+                workdir,
+                args.protocol,
+                args,
+                one_phase=one_phase,
+                targets=lambda i: [i % args.participants + 1],
+            )
+        syncs = result["coordinator"].get("syncs", 0) + sum(
+            stats.get("syncs", 0) for stats in result["participants"]
+        )
+        messages = result["frames_sent"] + result["frames_received"]
+        latencies = result["latencies"]
+        print(
+            f"{mode:<12}{result['outcomes']['Commit']:>8}"
+            f"{syncs / args.transactions:>7.2f}{messages / args.transactions:>7.2f}"
+            f"{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.99):>8.2f}"
+            f"{sum(latencies) / len(latencies):>9.2f}"
+        )
+
+
+def benchmark_locks(args):
+    """Measures lock waits and deadlock aborts as transactions contend for keys."""
+    print(
+        f"{args.transactions} transactions writing {args.writes} of the keys, "
+        f"{args.participants} participants, {args.max_in_flight} in flight"
+    )
+    print(
+        f"{'keys':>6}{'commits':>8}{'aborts':>8}{'waited':>8}{'died':>6}"
+        f"{'wounded':>8}{'dl abort %':>11}{'p50 ms':>8}{'p99 ms':>8}"
+    )
+    for keys in args.keys:
+
+        def messages(i, keys=keys):
+            written = random.sample(range(keys), min(args.writes, keys))
+            return " ".join(f"k{key}={i}" for key in written)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_engine(workdir, args.protocol, args, messages=messages)
+        locks = Counter()
+        for stats in result["locks"]:
+            locks.update(stats)
+        latencies = result["latencies"]
+        deadlock_aborts = locks["died"] + locks["wounded"]
+        print(
+            f"{keys:>6}{result['outcomes']['Commit']:>8}"
+            f"{result['outcomes']['Abort']:>8}{locks['waited']:>8}"
+            f"{locks['died']:>6}{locks['wounded']:>8}"
+            f"{deadlock_aborts / max(locks['requests'], 1) * 100:>11.2f}"
+            f"{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.99):>8.2f}"
+        )
+
+
+def benchmark_three_phase(args):
+    """Compares two- and three-phase commit in steady state and in an outage."""
+    print(
+        f"{args.transactions} transactions, {args.participants} participants, "
+        f"{args.max_in_flight} in flight; then {args.in_doubt} in-doubt "
+        f"transactions and a {args.outage_ms} ms coordinator outage, "
+        f"termination timeout {args.termination_timeout_ms} ms"
+    )
+    print(
+        f"{'protocol':<13}{'commits':>8}{'msgs/commit':>12}{'syncs/commit':>13}"
+        f"{'p50 ms':>8}{'p99 ms':>8}{'recovery p50':>13}{'recovery max':>13}"
+    )
+    for protocol in ("basic", "three-phase"):
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_engine(workdir, protocol, args)
+        with tempfile.TemporaryDirectory() as workdir:
+            recovery = run_outage(workdir, protocol, args)
+        commits = result["outcomes"]["Commit"]
+        syncs = result["coordinator"].get("syncs", 0) + sum(
+            stats.get("syncs", 0) for stats in result["participants"]
+        )
+        messages = result["frames_sent"] + result["frames_received"]
+        print(
+            f"{protocol:<13}{commits:>8}{messages / max(commits, 1):>12.2f}"
+            f"{syncs / max(commits, 1):>13.2f}"
+            f"{percentile(result['latencies'], 0.5):>8.2f}"
+            f"{percentile(result['latencies'], 0.99):>8.2f}"
+            f"{percentile(recovery, 0.5):>13.0f}{recovery[-1]:>13.0f}"
+        )
+
+
+def benchmark_paxos_commit(args):
+    """Compares the latency of Paxos Commit with that of two-phase commit."""
+    print(
+        f"{args.transactions} transactions, {args.participants} participants, "
+        f"{args.max_in_flight} in flight, on loopback; syncs include the acceptors'"
+    )
+    print(
+        f"{'protocol':<14}{'acceptors':>10}{'commits':>8}{'coord sync':>11}"
+        f"{'syncs/commit':>13}{'msgs/commit':>12}{'p50 ms':>8}{'p99 ms':>8}"
+        f"{'mean ms':>9}"
+    )
+    runs = [("basic", 0)]
+    runs.extend(("paxos-commit", acceptors) for acceptors in args.acceptors)
+    for protocol, acceptors in runs:
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_engine(workdir, protocol, args, acceptors=acceptors)
+        commits = result["outcomes"]["Commit"]
+        coordinator_syncs = result["coordinator"].get("syncs", 0)
+        syncs = coordinator_syncs + sum(
+            stats.get("syncs", 0)
+            for stats in result["participants"] + result["acceptors"]
+        )
+        messages = result["frames_sent"] + result["frames_received"]
+        latencies = result["latencies"]
+        print(
+            f"{protocol:<14}{acceptors:>10}{commits:>8}{coordinator_syncs:>11}"
+            f"{syncs / max(commits, 1):>13.2f}{messages / max(commits, 1):>12.2f}"
+            f"{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.99):>8.2f}"
+            f"{sum(latencies) / len(latencies):>9.2f}"
+        )
+
+
+def wait_for_output(path, text, process, timeout=10):
+    """Waits until a subprocess has printed text to its output file."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        with open(path) as out:
+            if text in out.read():
+                return
+        time.sleep(0.02)
+    raise RuntimeError(f"{os.path.basename(path)} never printed {text!r}")
+
+
+def run_load_test(workdir, args, rate):
+    """Runs the server, coordinator, participants and acceptors as subprocesses.
+
+    The coordinator runs ``args.transactions`` generated transactions at the
+    given rate, or in a closed loop, and exits. Returns the results it saved,
+    with the participants' log statistics added.
+    """
+    acceptors = args.acceptors if args.protocol == "paxos-commit" else 0
+    processes = []
+
+    def start(name, arguments):
+        out_path = os.path.join(workdir, f"{name}.out")
+        with open(out_path, "w") as out:
+            process = subprocess.Popen(
+                [sys.executable, *arguments],
+                cwd=workdir,
+                stdin=subprocess.DEVNULL,
+                stdout=out,
+            )
+        processes.append(process)
+        return process, out_path
+
+    try:
+        for index in range(1, acceptors + 1):
+            start(f"acceptor_{index}", [os.path.join(HERE, "acceptor.py"), str(index)])
+        server, server_out = start(
+            "server",
+            [
+                os.path.join(HERE, "server.py"),
+                "--mode",
+                args.server_mode,
+                "--participants",
+                str(args.participants),
+            ],
+        )
+        wait_for_output(server_out, "Server is listening", server)
+        coordinator, _ = start(
+            "coordinator",
+            [
+                os.path.join(HERE, "coordinator.py"),
+                "--protocol",
+                args.protocol,
+                "--max-in-flight",
+                str(args.max_in_flight),
+                "--acceptors",
+                str(acceptors),
+                "--load",
+                str(args.transactions),
+                "--rate",
+                str(rate),
+                "--load-keys",
+                str(args.keys),
+                "--results",
+                "results.json",
+            ],
+        )
+        # The server takes the first connection for the coordinator's
+        wait_for_output(server_out, "Coordinator connected", server)
+        for index in range(1, args.participants + 1):
+            start(
+                f"participant_{index}",
+                [
+                    os.path.join(HERE, "participant.py"),
+                    str(index),
+                    "--protocol",
+                    args.protocol,
+                    "--abort-rate",
+                    str(args.abort_rate),
+                    "--read-only-rate",
+                    str(args.read_only_rate),
+                    "--acceptors",
+                    str(acceptors),
+                ],
+            )
+        coordinator.wait()
+    finally:
+        for process in processes[:acceptors]:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    results_path = os.path.join(workdir, "results.json")
+    if not os.path.exists(results_path):
+        raise RuntimeError("The coordinator saved no results, see coordinator.out")
+    with open(results_path) as file:
+        results = json.load(file)
+    results["participant_logs"] = participant_log_stats(workdir, args.participants)
+    return results
+
+
+def benchmark_load(args):
+    """Drives a cluster of subprocesses with generated load, saves the results.
+
+    Each rate is a separate run on a fresh cluster, rate 0 being a closed
+    loop. Prints the throughput and the latency of the transactions and of
+    each of their phases, and writes every run to ``args.output`` as JSON.
+    """
+    print(
+        f"{args.transactions} transactions per run, {args.participants} "
+        f"participants, {args.protocol}, {args.max_in_flight} in flight"
+    )
+    print(
+        f"{'rate':>8}{'phase':>12}{'count':>8}{'TPS':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'p999 ms':>9}"
+    )
+    runs = []
+    for rate in args.rates:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_load_test(workdir, args, rate)
+        runs.append(results)
+        label = f"{rate:g}" if rate else "closed"
+        for phase, latency in results["latency_ms"].items():
+            tps = f"{results['tps']:.1f}" if phase == "total" else ""
+            print(
+                f"{label:>8}{phase:>12}{latency['count']:>8}{tps:>9}"
+                f"{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+                f"{latency['p99']:>9.2f}{latency['p999']:>9.2f}"
+            )
+            label = ""
+        if results["failed"]:
+            print(f"{'':>8}{'failed':>12}{results['failed']:>8}")
+    with open(args.output, "w") as file:
+        json.dump(
+            {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": runs},
+            file,
+            indent=2,
+        )
+    print(f"Saved the results to {args.output}.")
+
+
+def benchmark_store(args):
+    """Compares the participants' old text file with the key-value store."""
+    keys = [f"key{i}" for i in range(args.keys)]
+    lookups = [keys[(i * 7919) % len(keys)] for i in range(10000)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        text_path = os.path.join(workdir, "participant.txt")
+
+        def append_lines(count):
+            for i in range(count):
+                with open(text_path, "a") as file:
+                    file.write(f"{keys[i % len(keys)]}=value {i}\n")
+
+        def scan_lines(count):
+            for key in lookups[:count]:
+                prefix = f"{key}="
+                value = None
+                with open(text_path) as file:
+                    for line in file:
+                        if line.startswith(prefix):
+                            value = line
+                assert value is not None
+
+        store = KeyValueStore(os.path.join(workdir, "participant.db"))
+
+        def put_keys(count):
+            for i in range(count):
+                store.put_many({keys[i % len(keys)]: f"value {i}"})
+
+        def get_keys(count):
+            for key in lookups[:count]:
+                assert store.get(key) is not None
+
+        results = [
+            ("text file", measure(append_lines, args.writes), measure(scan_lines, 100)),
+            ("kv store", measure(put_keys, args.writes), measure(get_keys, 10000)),
+        ]
+        store.close()
+
+    print(f"{args.writes} writes to {args.keys} keys, point reads of the latest value")
+    print(f"{'store':<10}{'write us':>10}{'read us':>12}")
+    for name, write_us, read_us in results:
+        print(f"{name:<10}{write_us:>10.2f}{read_us:>12.2f}")
+
+
+def benchmark_codec(args):
+    """Compares the old string messages with the binary frames."""
+    uuids = [uuid.uuid4() for _ in range(1000)]
+    # The string messages carried the canonical form, frames carry 16 bytes
+    canonical_ids = [str(value) for value in uuids]
+    transaction_ids = [value.hex for value in uuids]
+
+    # The string formats used before the binary codec, with their parsing
+    def encode_strings(count):
+        for i in range(count):
+            transaction_id = canonical_ids[i % 1000]
+            f"{transaction_id};prepare".encode()
+            f"1:{transaction_id}:Yes\n".encode()
+            f"Decision:{transaction_id};Decision:Commit".encode()
+
+    prepare = f"{canonical_ids[0]};prepare".encode()
+    vote = f"1:{canonical_ids[0]}:Yes\n".encode()
+    decision = f"Decision:{canonical_ids[0]};Decision:Commit".encode()
+
+    def decode_strings(count):
+        for _ in range(count):
+            prepare.decode().strip().split(";", 1)
+            vote.decode().strip().split(":", 2)
+            parts = decision.decode().strip().split(";")
+            parts[0].split(":")[1], parts[1].split(":")[1]
+
+    def encode_frames(count):
+        for i in range(count):
+            transaction_id = transaction_ids[i % 1000]
+            encode_frame(PREPARE, transaction_id, b"prepare")
+            encode_frame(VOTE, transaction_id, b"Yes", 1)
+            encode_frame(DECISION, transaction_id, b"Commit")
+
+    # A realistic read hands the decoder many frames at once
+    batch = b"".join(
+        encode_frame(PREPARE, transaction_id, b"prepare")
+        + encode_frame(VOTE, transaction_id, b"Yes", 1)
+        + encode_frame(DECISION, transaction_id, b"Commit")
+        for transaction_id in transaction_ids[:100]
+    )
+
+    def decode_frames(count):
+        frame_buffer = FrameBuffer()
+        for _ in range(count // 100):
+            frame_buffer.feed(batch)
+
+    count = args.count
+    string_bytes = (len(prepare) + len(vote) + len(decision)) / 3
+    frame_bytes = len(batch) / 300
+    results = [
+        (
+            "string",
+            string_bytes,
+            measure(encode_strings, count),
+            measure(decode_strings, count),
+        ),
+        (
+            "binary",
+            frame_bytes,
+            measure(encode_frames, count),
+            measure(decode_frames, count),
+        ),
+    ]
+
+    print(f"{count} x (prepare, vote, decision), times per 3 messages")
+    print(f"{'format':<8}{'bytes/msg':>10}{'encode us':>12}{'decode us':>12}")
+    for name, size, encode_us, decode_us in results:
+        print(f"{name:<8}{size:>10.1f}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2PC benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    codec = subparsers.add_parser("codec", help="string messages vs binary frames")
+    codec.add_argument("--count", type=int, default=100000)
+    codec.set_defaults(run=benchmark_codec)
+
+    transport = subparsers.add_parser(
+        "transport", help="relayed vs direct coordinator-participant links"
+    )
+    transport.add_argument("--participants", type=int, default=2)
+    transport.add_argument("--transactions", type=int, default=200)
+    transport.add_argument(
+        "--server-mode", choices=["process", "asyncio"], default="process"
+    )
+    transport.set_defaults(run=benchmark_transport)
+
+    protocols = subparsers.add_parser(
+        "protocols", help="log writes and messages per commit protocol variant"
+    )
+    protocols.add_argument(
+        "--protocols", nargs="+", choices=PROTOCOLS, default=list(PROTOCOLS)
+    )
+    protocols.add_argument("--participants", type=int, default=2)
+    protocols.add_argument("--transactions", type=int, default=500)
+    protocols.add_argument("--abort-rate", type=float, default=0.5)
+    protocols.add_argument("--read-only-rate", type=float, default=0.0)
+    protocols.add_argument("--max-in-flight", type=int, default=16)
+    protocols.set_defaults(run=benchmark_protocols)
+
+    one_phase = subparsers.add_parser(
+        "one-phase", help="single-participant transactions with and without 1PC"
+    )
+    one_phase.add_argument("--protocol", choices=PROTOCOLS, default="basic")
+    one_phase.add_argument("--participants", type=int, default=2)
+    one_phase.add_argument("--transactions", type=int, default=500)
+    one_phase.add_argument("--abort-rate", type=float, default=0.0)
+    one_phase.add_argument("--read-only-rate", type=float, default=0.0)
+    one_phase.add_argument("--max-in-flight", type=int, default=1)
+    one_phase.set_defaults(run=benchmark_one_phase)
+
+    locks = subparsers.add_parser(
+        "locks", help="lock waits and deadlock aborts under key contention"
+    )
+    locks.add_argument("--protocol", choices=PROTOCOLS, default="basic")
+    locks.add_argument("--participants", type=int, default=2)
+    locks.add_argument("--transactions", type=int, default=500)
+    locks.add_argument("--keys", type=int, nargs="+", default=[4, 16, 64, 1024])
+    locks.add_argument("--writes", type=int, default=2, help="keys per transaction")
+    locks.add_argument("--abort-rate", type=float, default=0.0)
+    locks.add_argument("--read-only-rate", type=float, default=0.0)
+    locks.add_argument("--max-in-flight", type=int, default=16)
+    locks.set_defaults(run=benchmark_locks)
+
+    three_phase = subparsers.add_parser(
+        "three-phase", help="2PC vs 3PC latency and coordinator outage recovery"
+    )
+    three_phase.add_argument("--participants", type=int, default=3)
+    three_phase.add_argument("--transactions", type=int, default=500)
+    three_phase.add_argument("--max-in-flight", type=int, default=16)
+    three_phase.add_argument("--in-doubt", type=int, default=8)
+    three_phase.add_argument("--outage-ms", type=int, default=5000)
+    three_phase.add_argument("--termination-timeout-ms", type=int, default=1000)
+    three_phase.add_argument("--abort-rate", type=float, default=0.0)
+    three_phase.add_argument("--read-only-rate", type=float, default=0.0)
+    three_phase.set_defaults(run=benchmark_three_phase)
+
+    paxos_commit = subparsers.add_parser(
+        "paxos-commit", help="Paxos Commit vs 2PC latency on loopback"
+    )
+    paxos_commit.add_argument("--participants", type=int, default=3)
+    paxos_commit.add_argument("--transactions", type=int, default=500)
+    paxos_commit.add_argument("--max-in-flight", type=int, default=1)
+    paxos_commit.add_argument(
+        "--acceptors", type=int, nargs="+", default=[3, 5], help="2F+1 per run"
+    )
+    paxos_commit.add_argument("--abort-rate", type=float, default=0.0)
+    paxos_commit.add_argument("--read-only-rate", type=float, default=0.0)
+    paxos_commit.set_defaults(run=benchmark_paxos_commit)
+
+    load = subparsers.add_parser(
+        "load", help="throughput and latency of a cluster of subprocesses"
+    )
+    load.add_argument("--participants", type=int, default=3)
+    load.add_argument("--transactions", type=int, default=2000)
+    load.add_argument(
+        "--rates",
+        type=float,
+        nargs="+",
+        default=[0],
+        help="transactions per second of each run, 0 for a closed loop",
+    )
+    load.add_argument("--max-in-flight", type=int, default=16)
+    load.add_argument("--protocol", choices=PROTOCOLS, default="basic")
+    load.add_argument("--acceptors", type=int, default=3)
+    load.add_argument(
+        "--keys", type=int, default=0, help="keys the transactions write, 0 for none"
+    )
+    load.add_argument("--abort-rate", type=float, default=0.0)
+    load.add_argument("--read-only-rate", type=float, default=0.0)
+    load.add_argument(
+        "--server-mode", choices=["process", "asyncio"], default="process"
+    )
+    load.add_argument("--output", default="load_results.json")
+    load.set_defaults(run=benchmark_load)
+
+    store = subparsers.add_parser(
+        "store", help="participant text file vs key-value store"
+    )
+    store.add_argument("--keys", type=int, default=10000)
+    store.add_argument("--writes", type=int, default=50000)
+    store.set_defaults(run=benchmark_store)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,182 +1,1141 @@
+import argparse
+import json
 import socket
+import threading
 import time
 import uuid
-import json
-import os
 
+from framing import (
+    BATCH_OPCODES,
+    COMMIT_ONE_PHASE,
+    DECISION,
+    DONE,
+    EXIT,
+    HEARTBEAT,
+    HEARTBEAT_ACK,
+    MEMBERSHIP,
+    PARTICIPANT_COUNT,
+    PREPARE,
+    PRESUMED_OUTCOMES,
+    PRE_COMMIT,
+    PRE_COMMIT_ACK,
+    PROTOCOLS,
+    READY,
+    REQUEST_DECISION,
+    STANDBY,
+    TAKE_OVER,
+    VOTE,
+    FrameBatcher,
+    FrameReader,
+    describe_frame,
+    encode_frame,
+    encode_operations,
+    expand_frame,
+    parse_membership,
+)
+from failure_detector import FailureDetector
+from loadgen import run_load
+from paxos import AcceptorGroup, acceptor_addresses, parse_accepted, paxos_outcome
+from replication import ReplicatedTransactionStore, StandbyReplica
+from transport import DirectTransport, RelayTransport
+from wal import TransactionStore
 
-def load_transactions(file_path):
-    """Loads transactions from a JSON file."""
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError:
-                return []
-    return []
 
+def update_transaction_status(
+    transaction_id, key, value, transaction_store, force=True
+):
+    """Records a status change for a specific transaction, returns its commit ticket."""
+    return transaction_store.write(
+        {"transaction_id": transaction_id, key: value}, force
+    )
 
-def save_transactions(transactions, file_path):
-    """Saves transactions to a JSON file."""
-    with open(file_path, "w") as file:
-        json.dump(transactions, file, indent=2)
 
+def message_operations(message, transaction_id):
+    """The keys a transaction message reads and the key/value writes it asks for.
 
-def update_transaction_status(transaction_id, key, value, file_path):
-    """Updates the status of a specific transaction."""
-    transactions = load_transactions(file_path)
-    for transaction in transactions:
-        if transaction["transaction_id"] == transaction_id:
-            transaction[key] = value
-            break
-    save_transactions(transactions, file_path)
+    A message of "?key" reads and "key=value" writes does just that. Any
+    other message is stored under the transaction ID.
+    """
+    operations = message.split()
+    if operations and all(
+        operation.find("=") > 0 or (operation[0] == "?" and len(operation) > 1)
+        for operation in operations
+    ):
+        reads = [operation[1:] for operation in operations if operation[0] == "?"]
+        writes = dict(
+            operation.split("=", 1) for operation in operations if operation[0] != "?"
+        )
+        return reads, writes
+    return [], {transaction_id: message}
 
 
-def is_transaction_pending(transaction_id, file_path):
+def encode_transaction(transaction):
+    """The payload that tells a participant what the transaction does."""
+    reads, writes = message_operations(transaction.message, transaction.transaction_id)
+    return encode_operations(
+        reads, writes, transaction.timestamp, transaction.participants
+    )
+
+
+def is_transaction_pending(transaction_id, transaction_store):
     """Checks if a transaction is still pending."""
-    transactions = load_transactions(file_path)
-    for transaction in transactions:
-        if transaction["transaction_id"] == transaction_id:
-            return transaction["status"] == "pending"
-    return False
+    return transaction_store.is_pending(transaction_id)
 
 
-def main():
-    SERVER_IP = "127.0.0.1"
-    SERVER_PORT = 12346
-    TRANSACTION_LOG = "coordinator_transactions.json"
+class CoordinatorTransaction:
+    """State of one in-flight transaction: preparing -> decided -> done.
 
-    coordinator_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    coordinator_socket.connect((SERVER_IP, SERVER_PORT))
-    print("Connected to the server.")
+    A transaction with a single participant goes one-phase -> done instead,
+    and under three-phase commit a commit goes through pre-committing first.
+    Under Paxos Commit a transaction whose votes are not all chosen in time
+    goes to done without a decision if the acceptors cannot settle them.
+    """
 
-    # Expect to receive the number of participants first
-    num_participants_message = coordinator_socket.recv(1024).decode()
-    try:
-        num_participants = int(num_participants_message)
-        print(f"Number of participants: {num_participants}")
-    except ValueError:
+    def __init__(self, transaction_id, message, lock, participants, timestamp=0):
+        self.transaction_id = transaction_id
+        self.message = message
+        # Orders the transaction against all others when locks conflict
+        self.timestamp = timestamp
+        self.participants = participants  # Indexes of the participants it touches
+        self.state = "preparing"
+        self.votes = {}  # participant index -> "Yes" / "Abort" / "ReadOnly"
+        self.acks = set()  # participant indexes that sent "done"
+        self.pre_committed = set()  # participant indexes that acked the pre-commit
+        self.accepted = {}  # participant index -> acceptors that accepted its vote
+        self.decision = None
+        self.error = None  # What the transaction failed with, if it did
+        self.phase_started = None  # When the current phase's frames went out
+        self.phase_times = {}  # phase -> seconds it took, e.g. "prepare"
+        self.marked = time.monotonic()  # When the last phase ended
+        self.changed = threading.Condition(lock)
+
+    def mark(self, phase):
+        """Records how long the phase that has just ended took."""
+        now = time.monotonic()
+        self.phase_times[phase] = now - self.marked
+        self.marked = now
+
+
+class CoordinatorEngine:
+    """Runs many transactions at once over the shared server connection.
+
+    Every submitted transaction gets its own state machine, keyed by
+    ``transaction_id``, and a worker that drives it through both phases. The
+    transport's reader demultiplexes the vote and done frames of all
+    transactions, which carry the transaction ID and the index of the
+    participant that sent them. At most ``max_in_flight`` transactions run at
+    the same time; ``submit`` blocks while the window is full.
+
+    With a ``batch_delay`` (in seconds) the prepares and decisions of all
+    transactions that become ready within that window are sent as a single
+    batch frame, which each participant receives in one piece.
+
+    With the "presumed-abort" ``protocol`` nothing is logged for a
+    transaction until it commits: aborts are neither logged nor acknowledged,
+    and a transaction the log does not know about is answered with Abort.
+    "presumed-commit" is the mirror image for commit-heavy workloads: a
+    forced collecting record lists the participants before the prepare, so
+    a crash before the decision is still aborted, and commits are then
+    forced once, need no acknowledgement and are forgotten straight away.
+
+    "three-phase" commit does not block the participants when the
+    coordinator fails. After every Yes vote it sends a PRE-COMMIT, and only
+    logs and sends the commit once every participant has acknowledged it.
+    The participants can then terminate a transaction among themselves: if
+    any of them is pre-committed the coordinator may have committed, and
+    otherwise it cannot have. So the coordinator never decides a transaction
+    it has left to them. That covers a pre-commit that is not acknowledged
+    in time, and an undecided transaction found in the log after a restart.
+
+    Under "paxos-commit" the coordinator logs nothing. Each participant
+    sends its vote to the ``acceptors`` instead, 2F+1 processes that each
+    force it to their own log, and the coordinator learns the vote once a
+    majority has accepted it. The decision follows from the votes, so a
+    restarted coordinator, or a participant, can always get it from the
+    acceptors as long as F+1 of them are up. Votes still missing when the
+    prepare phase ends cannot just be taken as Abort, as a majority may
+    accept them later; a higher ballot at the acceptors settles them, as
+    Abort if the participant's vote was not accepted. The acceptors forget a
+    transaction once every participant has acknowledged the decision.
+
+    A participant that votes "ReadOnly" has nothing to commit and has
+    already forgotten the transaction, so it takes no part in the second
+    phase. If every vote is read-only the transaction commits without a
+    decision record or any further message.
+
+    A transaction that touches a single participant, which is every
+    transaction if there is only one, skips the protocol altogether: with
+    ``one_phase`` the participant gets one COMMIT_ONE_PHASE message, decides
+    and logs the outcome itself and replies once, and the coordinator logs
+    nothing.
+
+    Every ``heartbeat_interval`` seconds a heartbeat goes to all participants.
+    The failure detector learns each participant's heartbeat, vote and ack
+    latency, and a phase waits only as long as those latencies warrant, but
+    at least ``min_phase_timeout`` seconds, or until a participant it still
+    waits for is suspected.
+    """
+
+    def __init__(
+        self,
+        transport,
+        num_participants,
+        transaction_store,
+        max_in_flight=16,
+        batch_delay=0,
+        max_batch_size=256,
+        heartbeat_interval=0.05,
+        min_phase_timeout=0.2,
+        protocol="basic",
+        one_phase=True,
+        acceptors=None,
+    ):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown commit protocol: {protocol}")
+        if (protocol == "paxos-commit") != (acceptors is not None):
+            raise ValueError("Acceptors are needed for, and only for, paxos-commit")
+        self.protocol = protocol
+        self.acceptors = acceptors
+        self.presumed_outcome = PRESUMED_OUTCOMES.get(protocol)
+        self.one_phase = one_phase
+        self.transport = transport
+        self.num_participants = num_participants
+        self.participant_indexes = range(1, num_participants + 1)
+        self.transaction_store = transaction_store
+        self.heartbeat_interval = heartbeat_interval
+        self.detector = FailureDetector(
+            heartbeat_interval, min_phase_timeout=min_phase_timeout
+        )
+        self.stopped = threading.Event()
+        self.window = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.transactions = {}
+        self.idle = threading.Condition(self.lock)
+        self.batcher = None
+        if batch_delay > 0:
+            self.batcher = FrameBatcher(self.send_bytes, batch_delay, max_batch_size)
+
+    def start(self):
+        self.transport.start(self.receive_reply)
+        if self.acceptors is not None:
+            self.acceptors.start(self.handle_accepted)
+        threading.Thread(target=self.send_heartbeats, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def send_heartbeats(self):
+        """Pings every participant and wakes transactions waiting on a suspect."""
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                self.send_bytes(
+                    encode_frame(HEARTBEAT, payload=self.detector.next_heartbeat())
+                )
+            except OSError:
+                return
+
+            suspected = self.detector.check(self.participant_indexes)
+            if suspected:
+                for participant_index in suspected:
+                    timeout = self.detector.suspicion_timeout(participant_index)
+                    print(
+                        f"Participant {participant_index} suspected after "
+                        f"{timeout * 1000:.0f} ms without a reply."
+                    )
+                with self.lock:
+                    for transaction in self.transactions.values():
+                        transaction.changed.notify_all()
+
+    def waiting_on_suspect(self, replied, participants=None):
+        """True if a participant that has not replied yet is suspected."""
+        if participants is None:
+            participants = self.participant_indexes
+        return any(
+            self.detector.is_suspected(participant_index)
+            for participant_index in participants
+            if participant_index not in replied
+        )
+
+    def stop_reason(self, phase, replied, participants=None):
+        """Why a phase ended without every reply; backs its timeout off if expired."""
+        if participants is None:
+            participants = self.participant_indexes
+        if self.waiting_on_suspect(replied, participants):
+            return "suspected a failed participant while"
+        for participant_index in participants:
+            if participant_index not in replied:
+                self.detector.expired(participant_index, phase)
+        return "timed out"
+
+    def second_phase_participants(self, transaction):
+        """The participants that take part in the decision phase.
+
+        Read-only voters have released the transaction and are left out.
+        """
+        with self.lock:
+            return [
+                participant_index
+                for participant_index in transaction.participants
+                if transaction.votes.get(participant_index) != "ReadOnly"
+            ]
+
+    def send(self, frame_type, transaction_id, payload=b"", participant=0):
+        """Sends a frame to one participant, or to all of them if participant is 0."""
+        if self.batcher is not None and not participant and frame_type in BATCH_OPCODES:
+            self.batcher.add(frame_type, transaction_id, payload)
+            return
+        self.send_bytes(
+            encode_frame(frame_type, transaction_id, payload, participant), participant
+        )
+
+    def send_to(self, frame_type, transaction_id, payload, participants):
+        """Sends a frame to the given participants, as a broadcast if that is all."""
+        if len(participants) < self.num_participants:
+            for participant_index in participants:
+                self.send(frame_type, transaction_id, payload, participant_index)
+        else:
+            self.send(frame_type, transaction_id, payload)
+
+    def send_bytes(self, data, participant=0):
+        self.transport.send(data, participant)
+
+    def submit(self, message, on_complete=None, participants=None):
+        """Starts a new transaction once there is room in the window.
+
+        The transaction touches the given participant indexes, or all of them.
+        """
+        if participants is None:
+            participants = list(self.participant_indexes)
+        submitted = time.monotonic()
+        self.window.acquire()
+        transaction_id = uuid.uuid4().hex
+        # Wall-clock time, so that the transactions of different coordinators
+        # can be ordered against each other
+        transaction = CoordinatorTransaction(
+            transaction_id, message, self.lock, participants, time.time_ns()
+        )
+        transaction.marked = submitted
+        transaction.mark("queue")  # Waiting for room in the window
+        with self.lock:
+            self.transactions[transaction_id] = transaction
+
+        worker = threading.Thread(
+            target=self.run_transaction, args=(transaction, on_complete), daemon=True
+        )
+        worker.start()
+        return transaction_id
+
+    def drain(self):
+        """Blocks until every in-flight transaction has finished."""
+        with self.lock:
+            self.idle.wait_for(lambda: not self.transactions)
+
+    def recover(self):
+        """Finishes the transactions that were interrupted by a coordinator restart.
+
+        Transactions whose decision is in the log are resent that decision;
+        those that never reached one are aborted. Either goes only to the
+        participants the log names for the transaction. Both then wait for the acks
+        like any other transaction, and run alongside new ones.
+        """
+        recovered = 0
+        left = 0
+        for transaction_id in self.transaction_store.pending_ids():
+            record = self.transaction_store.get(transaction_id)
+            if self.protocol == "three-phase" and "decision" not in record:
+                # The participants may have pre-committed it and committed it
+                # since, so only they can terminate it
+                update_transaction_status(
+                    transaction_id, "status", "done", self.transaction_store, False
+                )
+                left += 1
+                continue
+            self.window.acquire()
+            transaction = CoordinatorTransaction(
+                transaction_id,
+                record.get("message", ""),
+                self.lock,
+                record.get(
+                    "participants",
+                    record.get("collecting", list(self.participant_indexes)),
+                ),
+            )
+            if "decision" in record:
+                transaction.decision = record["decision"]
+                transaction.state = "decided"
+            else:
+                transaction.decision = "Abort"
+            with self.lock:
+                self.transactions[transaction_id] = transaction
+            threading.Thread(
+                target=self.run_transaction, args=(transaction, None), daemon=True
+            ).start()
+            recovered += 1
+        if recovered:
+            print(f"Recovering {recovered} unfinished transactions from the log.")
+        if left:
+            print(f"Left {left} undecided transactions to the participants.")
+        return recovered
+
+    def run_transaction(self, transaction, on_complete):
+        try:
+            if (
+                self.one_phase
+                and transaction.decision is None
+                and len(transaction.participants) == 1
+            ):
+                self.commit_one_phase(transaction)
+            else:
+                self.commit_two_phase(transaction)
+        except Exception as e:
+            transaction.error = e
+            print(f"Transaction {transaction.transaction_id} failed: {e!r}")
+        finally:
+            with self.lock:
+                del self.transactions[transaction.transaction_id]
+                if not self.transactions:
+                    self.idle.notify_all()
+            self.window.release()
+            # Whoever waits for it must hear of it, however it ended
+            if on_complete is not None:
+                on_complete(transaction)
+
+    def commit_two_phase(self, transaction):
+        if transaction.decision is None:
+            self.prepare(transaction)
+        if transaction.state == "done":
+            return  # Left to the participants
+        if transaction.state == "preparing":
+            if (
+                self.protocol == "three-phase"
+                and transaction.decision == "Commit"
+                and not self.pre_commit(transaction)
+            ):
+                return
+            self.decide(transaction)
+        else:
+            print(f"Resending decision: {transaction.transaction_id}")
+            transaction.phase_started = time.monotonic()
+            self.send_to(
+                DECISION,
+                transaction.transaction_id,
+                transaction.decision,
+                transaction.participants,
+            )
+        self.complete(transaction)
+
+    def commit_one_phase(self, transaction):
+        """Lets the only participant of a transaction decide it on its own.
+
+        There is nobody to agree with, so the coordinator logs nothing and
+        just waits for the outcome. If the reply does not arrive the outcome
+        stays unknown here; the participant has it in its log either way.
+        """
+        transaction_id = transaction.transaction_id
+        participants = transaction.participants
+        with self.lock:
+            transaction.state = "one-phase"
+        print(f"Sending one-phase commit: {transaction_id}")
+        transaction.phase_started = time.monotonic()
+        payload = encode_transaction(transaction)
+        self.send(COMMIT_ONE_PHASE, transaction_id, payload, participants[0])
+
+        timeout = self.detector.phase_timeout(participants, "one-phase")
+        with self.lock:
+            transaction.changed.wait_for(
+                lambda: transaction.decision is not None
+                or self.waiting_on_suspect(transaction.acks, participants),
+                timeout=timeout,
+            )
+            transaction.state = "done"
+            decision = transaction.decision
+        transaction.mark("one-phase")
+
+        if decision is None:
+            reason = self.stop_reason("one-phase", transaction.acks, participants)
+            print(f"Coordinator {reason} waiting for the outcome of {transaction_id}.")
+        elif decision == "Abort":
+            print(f"Transaction {transaction_id} aborted.")
+        else:
+            print(f"Transaction {transaction_id} committed.")
+
+    def prepare(self, transaction):
+        transaction_id = transaction.transaction_id
+        participants = transaction.participants
+        if self.protocol in ("basic", "three-phase"):
+            self.transaction_store.write(
+                {
+                    "transaction_id": transaction_id,
+                    "message": transaction.message,
+                    "status": "pending",
+                    "participants": participants,
+                },
+                force=False,
+            )
+        elif self.protocol == "presumed-commit":
+            self.transaction_store.write(
+                {
+                    "transaction_id": transaction_id,
+                    "message": transaction.message,
+                    "status": "pending",
+                    "collecting": participants,
+                }
+            ).wait()
+
+        print(f"Sending prepare message: {transaction_id}")
+        transaction.phase_started = time.monotonic()
+        payload = encode_transaction(transaction)
+        self.send_to(PREPARE, transaction_id, payload, participants)
+
+        # The first Abort vote decides the transaction, there is no need to
+        # wait for the slower participants
+        timeout = self.detector.phase_timeout(participants, "prepare")
+        with self.lock:
+            transaction.changed.wait_for(
+                lambda: len(transaction.votes) >= len(participants)
+                or any("Abort" in vote for vote in transaction.votes.values())
+                or self.waiting_on_suspect(transaction.votes, participants),
+                timeout=timeout,
+            )
+            votes = dict(transaction.votes)
+            voted_abort = any("Abort" in vote for vote in votes.values())
+            all_voted = len(votes) >= len(participants)
+            unsettled = self.protocol == "paxos-commit" and not (
+                all_voted or voted_abort
+            )
+            if not unsettled:
+                # Votes that arrive from now on are discarded
+                commit = all_voted and not voted_abort
+                transaction.decision = "Commit" if commit else "Abort"
+
+        if unsettled:
+            self.settle_votes(transaction, votes)
+        elif not all_voted and not voted_abort:
+            reason = self.stop_reason("prepare", votes, participants)
+            print(
+                f"Coordinator {reason} waiting for replies to {transaction_id}. "
+                "Aborting transaction."
+            )
+        transaction.mark("prepare")
+
+    def settle_votes(self, transaction, votes):
+        """Has the acceptors choose the votes still missing after the prepare.
+
+        Without a majority of the acceptors the transaction is left to the
+        participants, which settle it in the same way.
+        """
+        transaction_id = transaction.transaction_id
+        missing = [
+            participant_index
+            for participant_index in transaction.participants
+            if participant_index not in votes
+        ]
+        reason = self.stop_reason("prepare", votes, transaction.participants)
         print(
-            f"Unexpected message from server (expected number of participants): {num_participants_message}"
+            f"Coordinator {reason} waiting for the votes of {transaction_id}. "
+            "Settling them at the acceptors."
         )
-        return  # Exit if we don't receive the expected message
+        timeout = self.detector.phase_timeout(transaction.participants, "prepare")
+        chosen = self.acceptors.terminate(transaction_id, missing, timeout)
+        with self.lock:
+            if chosen is None:
+                transaction.state = "done"
+            else:
+                transaction.votes.update(chosen)
+                transaction.decision = paxos_outcome(transaction.votes.values())
+        if chosen is None:
+            print(
+                f"No majority of the acceptors answered for {transaction_id}. "
+                "Leaving it to the participants."
+            )
 
-    # Wait for the confirmation message
-    ready_message = coordinator_socket.recv(1024).decode()
-    if ready_message == "All participants connected":
-        print("All participants are connected.")
+    def pre_commit(self, transaction):
+        """Moves every participant of a transaction to commit into pre-committed.
 
-    while True:
-        user_message = input(
-            "Enter a message to send to the participants (type 'exit' to quit): "
+        Returns False if some did not acknowledge in time. The transaction is
+        then left to the participants' termination protocol, which may
+        already have aborted it, and closed here without a decision.
+        """
+        transaction_id = transaction.transaction_id
+        participants = self.second_phase_participants(transaction)
+        if not participants:
+            return True
+        with self.lock:
+            transaction.state = "pre-committing"
+        print(f"Sending pre-commit: {transaction_id}")
+        transaction.phase_started = time.monotonic()
+        self.send_to(PRE_COMMIT, transaction_id, b"", participants)
+
+        timeout = self.detector.phase_timeout(participants, "pre-commit")
+        with self.lock:
+            transaction.changed.wait_for(
+                lambda: transaction.pre_committed.issuperset(participants)
+                or self.waiting_on_suspect(transaction.pre_committed, participants),
+                timeout=timeout,
+            )
+            pre_committed = set(transaction.pre_committed)
+            if pre_committed.issuperset(participants):
+                transaction.mark("pre-commit")
+                return True
+            transaction.state = "done"
+            transaction.decision = None
+
+        reason = self.stop_reason("pre-commit", pre_committed, participants)
+        print(
+            f"Coordinator {reason} waiting for pre-commit acks to {transaction_id}. "
+            "Leaving it to the participants."
         )
+        update_transaction_status(
+            transaction_id, "status", "done", self.transaction_store, force=False
+        )
+        return False
 
-        if user_message.lower() == "exit":
-            coordinator_socket.sendall("exit".encode())
-            break
+    def decide(self, transaction):
+        transaction_id = transaction.transaction_id
+        decision = transaction.decision
+        print(f"Coordinator decision: {transaction_id} {decision}")
+
+        participants = self.second_phase_participants(transaction)
+        if not participants:
+            # Nobody has anything to commit, so nobody needs the decision and
+            # it never has to be recovered
+            with self.lock:
+                transaction.state = "decided"
+            return
+
+        # Every decision record names the transaction's participants, which
+        # may be only some of them, so that recovery resends it to those
+        # alone. A commit must be durable before any participant can act on
+        # it; an abort need not be, as after a crash a transaction without a
+        # logged decision is aborted again, or presumed aborted
+        if self.protocol in ("basic", "three-phase"):
+            ticket = self.transaction_store.write(
+                {
+                    "transaction_id": transaction_id,
+                    "decision": decision,
+                    "participants": transaction.participants,
+                },
+                force=decision == "Commit",
+            )
+            if decision == "Commit":
+                ticket.wait()
+        elif self.protocol == "presumed-abort" and decision == "Commit":
+            self.transaction_store.write(
+                {
+                    "transaction_id": transaction_id,
+                    "message": transaction.message,
+                    "status": "pending",
+                    "decision": decision,
+                    "participants": transaction.participants,
+                }
+            ).wait()
+        elif self.protocol == "presumed-commit":
+            # A commit is forgotten as soon as it is durable; an abort is
+            # redone from the collecting record after a crash, so it can wait
+            # for the next fsync
+            record = {
+                "transaction_id": transaction_id,
+                "decision": decision,
+                "participants": transaction.participants,
+            }
+            if decision == "Commit":
+                record["status"] = "done"
+            ticket = self.transaction_store.write(record, force=decision == "Commit")
+            if decision == "Commit":
+                ticket.wait()
+        transaction.mark("log")  # Making the decision durable
+        with self.lock:
+            transaction.state = "decided"
+            votes = dict(transaction.votes)
+        transaction.phase_started = time.monotonic()
+
+        # Under presumed abort a participant that voted Abort has already
+        # forgotten the transaction, so only the others need to hear of it
+        recipients = participants
+        if self.protocol == "presumed-abort" and decision == "Abort":
+            recipients = [
+                participant_index
+                for participant_index in participants
+                if votes.get(participant_index) != "Abort"
+            ]
+        self.send_to(DECISION, transaction_id, decision, recipients)
 
-        # Creating a unique transaction ID and preparing the message
-        transaction_id = str(uuid.uuid4())
+    def complete(self, transaction):
+        transaction_id = transaction.transaction_id
+        participants = self.second_phase_participants(transaction)
+        if transaction.decision == self.presumed_outcome or not participants:
+            # Only a read-only transaction or one left over from another
+            # protocol has a record, which needs no fsync to be closed
+            if is_transaction_pending(transaction_id, self.transaction_store):
+                update_transaction_status(
+                    transaction_id, "status", "done", self.transaction_store, False
+                )
+            self.release_acceptors(transaction)
+            with self.lock:
+                transaction.state = "done"
+            print(
+                f"Transaction {transaction_id} aborted."
+                if transaction.decision == "Abort"
+                else f"Transaction {transaction_id} committed."
+            )
+            return
 
-        prepare_message = f"{transaction_id};prepare"
-        print(f"Sending prepare message: {prepare_message}")
-        coordinator_socket.sendall(prepare_message.encode())
+        timeout = self.detector.phase_timeout(participants, "decision")
+        with self.lock:
+            transaction.changed.wait_for(
+                lambda: transaction.acks.issuperset(participants)
+                or self.waiting_on_suspect(transaction.acks, participants),
+                timeout=timeout,
+            )
+            acks = set(transaction.acks)
 
-        transaction = {
-            "transaction_id": transaction_id,
-            "message": user_message,
-            "status": "pending",
-        }
+        if not acks.issuperset(participants):
+            # Left pending in the log, the decision is resent on request or
+            # by recovery after the next restart
+            reason = self.stop_reason("decision", acks, participants)
+            print(
+                f"Coordinator {reason} waiting for 'done' replies to {transaction_id}."
+            )
+            return
+        transaction.mark("ack")
 
-        transactions = load_transactions(TRANSACTION_LOG)
-        transactions.append(transaction)
-        save_transactions(transactions, TRANSACTION_LOG)
+        if is_transaction_pending(transaction_id, self.transaction_store):
+            update_transaction_status(
+                transaction_id, "status", "done", self.transaction_store, force=False
+            )
+        self.release_acceptors(transaction)
+        with self.lock:
+            transaction.state = "done"
 
-        coordinator_socket.settimeout(30)
+        print(
+            f"Transaction {transaction_id} aborted."
+            if transaction.decision == "Abort"
+            else f"Transaction {transaction_id} committed."
+        )
 
-        replies = []  # Store replies for analysis
-        abort = False
-        replies_received = 0
-        while replies_received < num_participants:
-            try:
-                reply = coordinator_socket.recv(1024).decode()
-                if reply:
-                    replies.append(reply)  # Collect all replies before processing
-                    replies_received += reply.count("\n")
-
-            except socket.timeout:
-                abort = True
-                print(
-                    "Coordinator timed out waiting for replies. Aborting transaction."
+    def release_acceptors(self, transaction):
+        """Lets the acceptors forget a transaction every participant has finished."""
+        if self.acceptors is not None:
+            self.acceptors.sendall(
+                encode_frame(
+                    DECISION, transaction.transaction_id, transaction.decision
                 )
-                break
+            )
 
-        # Process each individual reply separately
-        for reply in replies:
-            for line in reply.strip().split(
-                "\n"
-            ):  # Split by newline for multiple replies
-                if not line.strip():
-                    continue
-
-                print(f"Coordinator received reply: {line}")
-                try:
-                    participant_index, response = line.split(":")
-                    print(f"Participant {participant_index} response: {response}")
-
-                    if "Abort" in response:
-                        abort = True
-                        break
-                except ValueError as ve:
-                    print(f"Malformed reply detected: {line}")
-
-        decision = "Abort" if abort else "Commit"
-        decision_message = f"Decision:{transaction_id};Decision:{decision}"
-        print(f"Coordinator decision: {decision_message}")
-        coordinator_socket.sendall(decision_message.encode())
-
-        update_transaction_status(transaction_id, "decision", decision, TRANSACTION_LOG)
-
-        # Handle potential coordinator failure and recovery
-        resend_decision = False
-        time.sleep(5)
-        print("Coordinator restarting...")
-        if is_transaction_pending(transaction_id, TRANSACTION_LOG):
-            print("Resending decision message.")
-            resend_decision_message = (
-                f"RequestDecision:{transaction_id};Decision:{decision}"
-            )
-            coordinator_socket.sendall(resend_decision_message.encode())
-            resend_decision = True
-
-        done_replies = 0
-        while done_replies < num_participants:
-            try:
-                reply = coordinator_socket.recv(1024).decode()
-                for line in reply.strip().split("\n"):  # Ensure multiline handling
-                    if not line.strip():
-                        continue
-
-                    print(f"Coordinator received done reply: {line}")
-                    try:
-                        participant_index, response = line.split(":")
-                        if response.strip() == "done":
-                            done_replies += 1
-                            print(
-                                f"Participant {participant_index} completed transaction."
-                            )
-                    except ValueError as ve:
-                        print(f"Malformed done reply detected: {line}")
-            except socket.timeout:
-                print("Coordinator timed out waiting for 'done' replies.")
-                break
+    def receive_reply(self, frame):
+        """Routes a reply, or each reply of a batch, to its transaction."""
+        for reply in expand_frame(frame):
+            self.handle_reply(reply)
+
+    def handle_reply(self, frame):
+        participant_index = frame.participant
+        if frame.frame_type == HEARTBEAT_ACK:
+            if self.detector.heartbeat_acked(participant_index, frame.payload):
+                print(f"Participant {participant_index} is reachable again.")
+            return
+        if self.detector.heard_from(participant_index):
+            print(f"Participant {participant_index} is reachable again.")
+
+        print(f"Coordinator received reply: {describe_frame(frame)}")
+        transaction_id = frame.transaction_id
+
+        if frame.frame_type == REQUEST_DECISION:
+            self.answer_decision_request(transaction_id, participant_index)
+            return
+
+        with self.lock:
+            transaction = self.transactions.get(transaction_id)
+            if transaction is None:
+                print(f"Reply for unknown or finished transaction: {transaction_id}")
+                return
+
+            # Replies are timed from when the frames of their phase went out
+            started = transaction.phase_started
+            if frame.frame_type == DONE and transaction.state == "one-phase":
+                # The only participant replies with the outcome it decided
+                self.detector.observe(
+                    participant_index, "one-phase", time.monotonic() - started
+                )
+                decision = frame.payload.decode()
+                transaction.decision = decision
+                transaction.acks.add(participant_index)
+                print(f"Participant {participant_index} decided {decision}.")
+            elif frame.frame_type == DONE:
+                if transaction.state == "decided" and started is not None:
+                    self.detector.observe(
+                        participant_index, "decision", time.monotonic() - started
+                    )
+                transaction.acks.add(participant_index)
+                print(f"Participant {participant_index} completed transaction.")
+            elif (
+                frame.frame_type == PRE_COMMIT_ACK
+                and transaction.state == "pre-committing"
+            ):
+                self.detector.observe(
+                    participant_index, "pre-commit", time.monotonic() - started
+                )
+                transaction.pre_committed.add(participant_index)
+                print(f"Participant {participant_index} pre-committed.")
+            elif frame.frame_type == VOTE and transaction.decision is not None:
+                print(f"Discarding late vote of participant {participant_index}.")
+            elif frame.frame_type == VOTE and transaction.state == "preparing":
+                if started is not None:
+                    self.detector.observe(
+                        participant_index, "prepare", time.monotonic() - started
+                    )
+                response = frame.payload.decode()
+                transaction.votes[participant_index] = response
+                print(f"Participant {participant_index} response: {response}")
+            transaction.changed.notify_all()
+
+    def handle_accepted(self, frame):
+        """Learns a participant's vote once a majority of the acceptors accepted it."""
+        acceptor, _, vote = parse_accepted(frame.payload)
+        participant_index = frame.participant
+        with self.lock:
+            transaction = self.transactions.get(frame.transaction_id)
+            if transaction is None or transaction.decision is not None:
+                return
+            accepted = transaction.accepted.setdefault(participant_index, set())
+            accepted.add(acceptor)
+            if (
+                len(accepted) < self.acceptors.majority
+                or participant_index in transaction.votes
+            ):
+                return
+            started = transaction.phase_started
+            if started is not None:
+                self.detector.observe(
+                    participant_index, "prepare", time.monotonic() - started
+                )
+            transaction.votes[participant_index] = vote
+            print(f"Participant {participant_index} response chosen: {vote}")
+            transaction.changed.notify_all()
+
+    def answer_decision_request(self, transaction_id, participant_index):
+        """Resends the logged decision to a participant recovering from a failure."""
+        with self.lock:
+            in_flight = self.transactions.get(transaction_id)
+            # The table has a decision as soon as it is written, but until the
+            # transaction is decided its record may not be durable yet, here
+            # or at the standbys, and must not be acted on
+            deciding = in_flight is not None and in_flight.state not in (
+                "decided",
+                "done",
+            )
+            sent = in_flight.decision if in_flight is not None else None
+        if deciding:
+            print(f"Decision for {transaction_id} is not durable yet.")
+            return
+        transaction = self.transaction_store.get(transaction_id)
+        if transaction is not None and "decision" in transaction:
+            decision = transaction["decision"]
+        elif sent is not None:
+            decision = sent  # Paxos Commit logs no decision
+        elif self.presumed_outcome and transaction is None:
+            decision = self.presumed_outcome  # The outcome that leaves no record
+        else:
+            print(f"No decision recorded yet for {transaction_id}.")
+            return
+        self.send(DECISION, transaction_id, decision, participant_index)
 
-        update_transaction_status(transaction_id, "status", "done", TRANSACTION_LOG)
 
-        time.sleep(2)
-        print("Transaction aborted." if abort else "Transaction committed.")
+def connect_to_server(server_ip, server_port, retry_for=0):
+    """Connects to the server, retrying for up to retry_for seconds while it starts."""
+    deadline = time.monotonic() + retry_for
+    while True:
+        try:
+            coordinator_socket = socket.create_connection((server_ip, server_port))
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+    coordinator_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    print("Connected to the server.")
+    return coordinator_socket
+
 
+def wait_for_participants(coordinator_socket):
+    """Waits until the server reports that all participants are connected.
+
+    Returns the frame reader of the server connection, the number of
+    participants and the listening address of each participant, or None if
+    the server does not follow the expected handshake.
+    """
+    # Expect to receive the number of participants first, then their
+    # addresses and the confirmation that all of them are connected
+    frame_reader = FrameReader(coordinator_socket)
+    handshake = []
+    while not handshake or handshake[-1].frame_type != READY:
+        frames = frame_reader.read_frames()
+        if frames is None:
+            print("Server closed the connection.")
+            return None
+        handshake.extend(frames)
+
+    count_frame = handshake[0]
+    if count_frame.frame_type != PARTICIPANT_COUNT:
+        print(
+            "Unexpected message from server (expected number of participants): "
+            f"{describe_frame(count_frame)}"
+        )
+        return None
+    num_participants = int(count_frame.payload)
+    print(f"Number of participants: {num_participants}")
+
+    members = {}
+    for frame in handshake:
+        if frame.frame_type == MEMBERSHIP:
+            members = parse_membership(frame.payload)
+    print("All participants are connected.")
+
+    return frame_reader, num_participants, members
+
+
+def parse_transaction(line, num_participants):
+    """Splits "@2,3 message" into the message and the participants it touches.
+
+    A line without the prefix touches every participant. Returns None if the
+    prefix does not name valid participant indexes.
+    """
+    if not line.startswith("@"):
+        return line, None
+    indexes, _, message = line[1:].partition(" ")
+    try:
+        participants = sorted({int(index) for index in indexes.split(",")})
+    except ValueError:
+        return None
+    if participants[0] < 1 or participants[-1] > num_participants:
+        return None
+    return message, participants
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2PC transaction coordinator")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=16,
+        help="maximum number of transactions running at the same time",
+    )
+    parser.add_argument(
+        "--batch-delay-ms",
+        type=float,
+        default=0,
+        help="pack prepares and decisions ready within this window into one frame",
+    )
+    parser.add_argument(
+        "--heartbeat-ms",
+        type=float,
+        default=50,
+        help="interval of the heartbeats that detect failed participants",
+    )
+    parser.add_argument(
+        "--min-phase-timeout-ms",
+        type=float,
+        default=200,
+        help="shortest time a phase waits for replies, however fast they were",
+    )
+    parser.add_argument(
+        "--protocol",
+        choices=PROTOCOLS,
+        default="basic",
+        help="commit protocol variant, participants must use the same",
+    )
+    parser.add_argument(
+        "--no-one-phase",
+        action="store_true",
+        help="run transactions with a single participant through both phases too",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="connect to the participants directly instead of through the server",
+    )
+    parser.add_argument(
+        "--acceptors",
+        type=int,
+        default=3,
+        help="paxos-commit: number of acceptors (2F+1) to connect to",
+    )
+    parser.add_argument(
+        "--replication-port",
+        type=int,
+        help="mirror the log to hot standbys that connect on this port",
+    )
+    parser.add_argument(
+        "--standby-of",
+        metavar="HOST:PORT",
+        help="run as a hot standby of the coordinator replicating on that address",
+    )
+    parser.add_argument(
+        "--lease-ms",
+        type=float,
+        default=500,
+        help="how long a standby goes without hearing from the coordinator "
+        "before it takes over",
+    )
+    parser.add_argument(
+        "--load",
+        type=int,
+        metavar="N",
+        help="run N generated transactions instead of reading messages, then exit",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="--load: transactions per second, or 0 for a closed loop that keeps "
+        "--max-in-flight transactions running",
+    )
+    parser.add_argument(
+        "--load-keys",
+        type=int,
+        default=0,
+        help="--load: write one of this many keys per transaction, "
+        "or only store a message with 0",
+    )
+    parser.add_argument(
+        "--results",
+        metavar="FILE",
+        help="--load: save the throughput and latencies to FILE as JSON",
+    )
+    args = parser.parse_args()
+    if args.standby_of and args.direct:
+        parser.error("a standby takes over through the server, not with --direct")
+    if args.standby_of and args.load:
+        parser.error("a standby reads its messages only once it takes over")
+
+    SERVER_IP = "127.0.0.1"
+    SERVER_PORT = 12346
+    # A standby keeps its own copy of the log
+    TRANSACTION_LOG = (
+        "coordinator_standby_transactions.jsonl"
+        if args.standby_of
+        else "coordinator_transactions.jsonl"
+    )
+    GROUP_COMMIT_MAX_DELAY = 0.002  # Seconds to wait for more records per fsync
+    GROUP_COMMIT_MAX_BATCH = 128
+    CHECKPOINT_RECORDS = 10000  # Compact the log after this many records
+    CHECKPOINT_BYTES = 4 * 1024 * 1024  # ... or once it grows past this size
+
+    store_options = {
+        "max_batch_delay": GROUP_COMMIT_MAX_DELAY,
+        "max_batch_size": GROUP_COMMIT_MAX_BATCH,
+        "checkpoint_records": CHECKPOINT_RECORDS,
+        "checkpoint_bytes": CHECKPOINT_BYTES,
+    }
+    if args.replication_port:
+        transaction_store = ReplicatedTransactionStore(
+            TRANSACTION_LOG,
+            args.replication_port,
+            lease=args.lease_ms / 1000,
+            **store_options,
+        )
+    else:
+        transaction_store = TransactionStore(TRANSACTION_LOG, **store_options)
+
+    replica = None
+    if args.standby_of:
+        host, port = args.standby_of.rsplit(":", 1)
+        replica = StandbyReplica(
+            transaction_store, (host, int(port)), args.lease_ms / 1000
+        )
+        replica.start()
+
+    coordinator_socket = connect_to_server(SERVER_IP, SERVER_PORT)
+    if replica is not None:
+        coordinator_socket.sendall(encode_frame(STANDBY))
+    connection = wait_for_participants(coordinator_socket)
+    if connection is None:
+        return  # Exit if we don't receive the expected messages
+    frame_reader, num_participants, members = connection
+
+    if replica is not None:
+        if not replica.wait():
+            print("Stood down by the coordinator.")
+            coordinator_socket.close()
+            print(f"Log group commit stats: {transaction_store.stats()}")
+            transaction_store.close()
+            return
+        silence = (time.monotonic() - replica.last_heard) * 1000
+        print(f"Taking over, the coordinator was last heard {silence:.0f} ms ago.")
+        coordinator_socket.sendall(encode_frame(TAKE_OVER))
+
+    if args.direct:
+        transport = DirectTransport(members)
+        print("Connected directly to all participants.")
+    else:
+        transport = RelayTransport(coordinator_socket, frame_reader)
+
+    acceptors = None
+    if args.protocol == "paxos-commit":
+        acceptors = AcceptorGroup(acceptor_addresses(args.acceptors), 0)
+        print(f"Connected to {len(acceptors.sockets)} of {args.acceptors} acceptors.")
+
+    engine = CoordinatorEngine(
+        transport,
+        num_participants,
+        transaction_store,
+        max_in_flight=args.max_in_flight,
+        batch_delay=args.batch_delay_ms / 1000,
+        heartbeat_interval=args.heartbeat_ms / 1000,
+        min_phase_timeout=args.min_phase_timeout_ms / 1000,
+        protocol=args.protocol,
+        one_phase=not args.no_one_phase,
+        acceptors=acceptors,
+    )
+    engine.start()
+    engine.recover()
+
+    results = None
+    if args.load:
+        results = run_load(engine, args.load, args.rate, args.load_keys)
+        total = results["latency_ms"]["total"]
+        print(
+            f"Ran {args.load} transactions in {results['elapsed_s']:.2f} s: "
+            f"{results['tps']:.1f} TPS, p50 {total['p50']:.2f} ms, "
+            f"p99 {total['p99']:.2f} ms, {results['failed']} failed"
+        )
+    else:
+        while True:
+            user_message = input(
+                "Enter a message to send to the participants, '@<i>,<j> <message>' "
+                "for only some of them (type 'exit' to quit): "
+            )
+            if user_message.lower() == "exit":
+                break
+
+            transaction = parse_transaction(user_message, num_participants)
+            if transaction is None:
+                print(f"Participants are numbered 1 to {num_participants}.")
+                continue
+            message, participants = transaction
+            engine.submit(message, participants=participants)
+
+    engine.drain()
+    engine.stop()
+    try:
+        coordinator_socket.sendall(encode_frame(EXIT))
+    except OSError:
+        pass  # A standby has taken over, the server let this one go
+    transport.close()
+    if acceptors is not None:
+        acceptors.close()
     coordinator_socket.close()
+    print(f"Log group commit stats: {transaction_store.stats()}")
+    print(f"Failure detector timeouts: {engine.detector.stats()}")
+    if results is not None and args.results:
+        results.update(
+            protocol=args.protocol,
+            participants=num_participants,
+            max_in_flight=args.max_in_flight,
+            log=transaction_store.stats(),
+        )
+        with open(args.results, "w") as file:
+            json.dump(results, file, indent=2)
+    transaction_store.close()
 
 
 if __name__ == "__main__":
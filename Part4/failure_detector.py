@@ -0,0 +1,224 @@
+import struct
+import threading
+import time
+
+HEARTBEAT_PAYLOAD = struct.Struct("!I")  # Heartbeat sequence number
+MAX_OUTSTANDING_HEARTBEATS = 1024
+
+
+class RoundTripEstimator:
+    """Smoothed latency and variance of one kind of exchange with one node.
+
+    Follows the retransmission timer of RFC 6298: the timeout is the smoothed
+    latency plus four times its mean deviation, so it tracks what the link
+    actually delivers. Each expiry without a reply doubles the timeout until
+    the next sample arrives.
+    """
+
+    def __init__(self, initial_timeout=1.0, min_timeout=0.01, max_timeout=30.0):
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.samples = 0
+
+    def observe(self, sample):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.samples += 1
+        self.backoff = 1
+
+    def expired(self):
+        if self.timeout() < self.max_timeout:
+            self.backoff *= 2
+
+    def timeout(self):
+        if self.srtt is None:
+            base = self.initial_timeout
+        else:
+            base = max(self.min_timeout, self.srtt + 4 * self.rttvar)
+        return min(self.max_timeout, base * self.backoff)
+
+
+class FailureDetector:
+    """Heartbeat failure detector with per-node, per-phase adaptive timeouts.
+
+    A node is suspected once nothing has been heard from it for
+    ``missed_heartbeats`` heartbeat periods, each the interval plus the
+    heartbeat timeout, so a single late heartbeat is not a failure. With a
+    ``heartbeat_interval`` the detector times the round trip of the
+    heartbeats it sends (``next_heartbeat`` and ``heartbeat_acked``); without
+    one it measures the gaps between the heartbeats it receives
+    (``heartbeat_received``). Other phases, such as "prepare" or "decision",
+    are timed by the caller through ``observe``.
+
+    Until a phase has been timed it waits ``initial_phase_timeout``. Heartbeat
+    timeouts may go down to ``min_timeout``, but the phases wait at least
+    ``min_phase_timeout``: votes and acks under load have a longer tail
+    than the smoothed latency shows, and a participant that has failed is
+    found by its heartbeats well before that.
+
+    Round trips that overlap a suspicion are not sampled, as they measure
+    the outage rather than the link. A suspected node that turns out to be
+    alive backs its heartbeat timeout off, so a link that became slower is
+    learned instead of being suspected over and over.
+    """
+
+    def __init__(
+        self,
+        heartbeat_interval=0.0,
+        missed_heartbeats=2,
+        initial_timeout=1.0,
+        min_timeout=0.01,
+        min_phase_timeout=0.2,
+        max_timeout=30.0,
+        initial_phase_timeout=1.0,
+    ):
+        self.heartbeat_interval = heartbeat_interval
+        self.missed_heartbeats = missed_heartbeats
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.min_phase_timeout = min_phase_timeout
+        self.max_timeout = max_timeout
+        self.initial_phase_timeout = initial_phase_timeout
+        self.lock = threading.Lock()
+        self.estimators = {}  # (node, phase) -> RoundTripEstimator
+        self.last_heard = {}  # node -> time anything was last received
+        self.last_heartbeat = {}  # node -> time the last heartbeat was received
+        self.suspected = set()
+        self.barrier = {}  # node -> first heartbeat whose round trip is sampled
+        self.sequence = 0
+        self.sent = {}  # heartbeat sequence -> time it was sent
+
+    def estimator(self, node, phase):
+        estimator = self.estimators.get((node, phase))
+        if estimator is None:
+            if phase == "heartbeat":
+                initial_timeout, min_timeout = self.initial_timeout, self.min_timeout
+            else:
+                initial_timeout = self.initial_phase_timeout
+                min_timeout = self.min_phase_timeout
+            estimator = RoundTripEstimator(
+                initial_timeout, min_timeout, self.max_timeout
+            )
+            self.estimators[(node, phase)] = estimator
+        return estimator
+
+    def observe(self, node, phase, seconds):
+        with self.lock:
+            self.estimator(node, phase).observe(seconds)
+
+    def expired(self, node, phase):
+        """Backs off a phase's timeout after it ran out without a reply."""
+        with self.lock:
+            self.estimator(node, phase).expired()
+
+    def phase_timeout(self, nodes, phase):
+        """How long to wait for a phase that needs a reply from every node."""
+        with self.lock:
+            return max(self.estimator(node, phase).timeout() for node in nodes)
+
+    def suspicion_timeout(self, node):
+        with self.lock:
+            return self.silence_limit(node)
+
+    def silence_limit(self, node):
+        timeout = self.estimator(node, "heartbeat").timeout()
+        return self.missed_heartbeats * (self.heartbeat_interval + timeout)
+
+    def heard_from(self, node):
+        """Records that a node is alive; returns True if it was suspected."""
+        with self.lock:
+            return self.mark_alive(node, time.monotonic())
+
+    def mark_alive(self, node, now):
+        self.last_heard[node] = now
+        if node not in self.suspected:
+            return False
+        self.suspected.discard(node)
+        self.estimator(node, "heartbeat").expired()
+        self.barrier[node] = self.sequence + 1
+        return True
+
+    def next_heartbeat(self):
+        """Returns the payload of the next heartbeat and notes when it was sent."""
+        with self.lock:
+            self.sequence += 1
+            self.sent[self.sequence] = time.monotonic()
+            self.sent.pop(self.sequence - MAX_OUTSTANDING_HEARTBEATS, None)
+            return HEARTBEAT_PAYLOAD.pack(self.sequence)
+
+    def heartbeat_acked(self, node, payload):
+        """Samples the round trip of an echoed heartbeat; True if node revived."""
+        (sequence,) = HEARTBEAT_PAYLOAD.unpack(payload)
+        now = time.monotonic()
+        with self.lock:
+            sent_at = self.sent.get(sequence)
+            if (
+                sent_at is not None
+                and node not in self.suspected
+                and sequence >= self.barrier.get(node, 0)
+            ):
+                self.estimator(node, "heartbeat").observe(now - sent_at)
+            return self.mark_alive(node, now)
+
+    def heartbeat_received(self, node):
+        """Samples the gap since the node's previous heartbeat; True if revived.
+
+        Call it once per read: heartbeats that queued up while the reader was
+        busy arrive together and say nothing about the sender's rhythm.
+        """
+        now = time.monotonic()
+        with self.lock:
+            previous = self.last_heartbeat.get(node)
+            self.last_heartbeat[node] = now
+            if (
+                previous is not None
+                and node not in self.suspected
+                and now - previous <= self.silence_limit(node)
+            ):
+                self.estimator(node, "heartbeat").observe(now - previous)
+            return self.mark_alive(node, now)
+
+    def check(self, nodes):
+        """Suspects the nodes that have been silent too long, returns the new ones."""
+        now = time.monotonic()
+        newly_suspected = []
+        with self.lock:
+            for node in nodes:
+                last_heard = self.last_heard.setdefault(node, now)
+                if node in self.suspected:
+                    continue
+                if now - last_heard > self.silence_limit(node):
+                    self.suspected.add(node)
+                    self.barrier[node] = self.sequence + 1
+                    newly_suspected.append(node)
+        return newly_suspected
+
+    def heartbeat_seen(self, node):
+        with self.lock:
+            return node in self.last_heartbeat
+
+    def is_suspected(self, node):
+        with self.lock:
+            return node in self.suspected
+
+    def stats(self):
+        """Observed latency and current timeout of every node and phase, in ms."""
+        with self.lock:
+            stats = {}
+            for (node, phase), estimator in sorted(self.estimators.items()):
+                stats.setdefault(node, {})[phase] = {
+                    "srtt_ms": round((estimator.srtt or 0) * 1000, 3),
+                    "timeout_ms": round(estimator.timeout() * 1000, 3),
+                    "samples": estimator.samples,
+                }
+            for node in self.suspected:
+                stats.setdefault(node, {})["suspected"] = True
+            return stats
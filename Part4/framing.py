@@ -0,0 +1,356 @@
+import json
+import select
+import socket
+import struct
+import threading
+import time
+from binascii import a2b_hex
+from collections import namedtuple
+from enum import IntEnum
+
+
+class Opcode(IntEnum):
+    PREPARE = 1
+    VOTE = 2
+    DECISION = 3
+    DONE = 4
+    REQUEST_DECISION = 5
+    PARTICIPANT_COUNT = 6
+    READY = 7
+    EXIT = 8
+    PREPARE_BATCH = 9
+    VOTE_BATCH = 10
+    DECISION_BATCH = 11
+    DONE_BATCH = 12
+    REGISTER = 13
+    MEMBERSHIP = 14
+    HEARTBEAT = 15
+    HEARTBEAT_ACK = 16
+    COMMIT_ONE_PHASE = 17
+    QUERY_OUTCOME = 18
+    OUTCOME = 19
+    PRE_COMMIT = 20
+    PRE_COMMIT_ACK = 21
+    REPLICATE = 22
+    REPLICATE_ACK = 23
+    STANDBY = 24
+    TAKE_OVER = 25
+    PAXOS_PREPARE = 26
+    PAXOS_PROMISE = 27
+    PAXOS_ACCEPT = 28
+    PAXOS_ACCEPTED = 29
+
+
+PREPARE = Opcode.PREPARE
+VOTE = Opcode.VOTE
+DECISION = Opcode.DECISION
+DONE = Opcode.DONE
+REQUEST_DECISION = Opcode.REQUEST_DECISION
+PARTICIPANT_COUNT = Opcode.PARTICIPANT_COUNT
+READY = Opcode.READY
+EXIT = Opcode.EXIT
+PREPARE_BATCH = Opcode.PREPARE_BATCH
+VOTE_BATCH = Opcode.VOTE_BATCH
+DECISION_BATCH = Opcode.DECISION_BATCH
+DONE_BATCH = Opcode.DONE_BATCH
+REGISTER = Opcode.REGISTER
+MEMBERSHIP = Opcode.MEMBERSHIP
+HEARTBEAT = Opcode.HEARTBEAT
+HEARTBEAT_ACK = Opcode.HEARTBEAT_ACK
+COMMIT_ONE_PHASE = Opcode.COMMIT_ONE_PHASE
+QUERY_OUTCOME = Opcode.QUERY_OUTCOME
+OUTCOME = Opcode.OUTCOME
+PRE_COMMIT = Opcode.PRE_COMMIT
+PRE_COMMIT_ACK = Opcode.PRE_COMMIT_ACK
+REPLICATE = Opcode.REPLICATE
+REPLICATE_ACK = Opcode.REPLICATE_ACK
+STANDBY = Opcode.STANDBY
+TAKE_OVER = Opcode.TAKE_OVER
+PAXOS_PREPARE = Opcode.PAXOS_PREPARE
+PAXOS_PROMISE = Opcode.PAXOS_PROMISE
+PAXOS_ACCEPT = Opcode.PAXOS_ACCEPT
+PAXOS_ACCEPTED = Opcode.PAXOS_ACCEPTED
+
+# Frames a participant sends to another participant of the same transaction,
+# whose index they carry; the server relays them tagged with the sender's
+# index instead
+PEER_FRAMES = {QUERY_OUTCOME, OUTCOME}
+
+# Commit protocol variants; the coordinator and participants must run the same.
+# Under a presumption the coordinator keeps no record of that outcome, so it
+# is neither forced to the log nor acknowledged. "three-phase" adds a
+# pre-commit phase, so that the participants can finish a transaction
+# without the coordinator. Under "paxos-commit" the votes are chosen by a group
+# of acceptors, and the coordinator logs nothing
+PROTOCOLS = (
+    "basic",
+    "presumed-abort",
+    "presumed-commit",
+    "three-phase",
+    "paxos-commit",
+)
+PRESUMED_OUTCOMES = {"presumed-abort": "Abort", "presumed-commit": "Commit"}
+
+# Batch frames carry many transactions, each as its UUID, payload length and
+# payload, and expand into the single-transaction opcode
+BATCH_OPCODES = {
+    PREPARE: PREPARE_BATCH,
+    VOTE: VOTE_BATCH,
+    DECISION: DECISION_BATCH,
+    DONE: DONE_BATCH,
+}
+UNBATCHED_OPCODES = {batch: single for single, batch in BATCH_OPCODES.items()}
+BATCH_ENTRY = struct.Struct("!16sH")
+
+# Length of everything after the prefix, opcode, participant index (0 for the
+# coordinator or a broadcast) and the transaction UUID as 16 raw bytes
+HEADER = struct.Struct("!IBH16s")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+NO_TRANSACTION = bytes(16)
+
+Frame = namedtuple("Frame", ["frame_type", "transaction_id", "payload", "participant"])
+Operations = namedtuple(
+    "Operations", ["reads", "writes", "timestamp", "participants"]
+)
+
+
+class ProtocolError(Exception):
+    """Raised when the byte stream does not contain a valid frame."""
+
+
+# Transaction IDs are UUIDs written as 32 hex digits (``uuid4().hex``), so
+# converting them to and from the 16 bytes on the wire is one C call each way
+def bytes_to_uuid(data):
+    """Unpacks 16 bytes into a transaction ID, "" if it is all zeros."""
+    return data.hex() if data != NO_TRANSACTION else ""
+
+
+def encode_frame(frame_type, transaction_id="", payload=b"", participant=0):
+    """Encodes a frame with its length prefix, opcode and transaction UUID."""
+    if payload.__class__ is str:
+        payload = payload.encode()
+    return (
+        HEADER.pack(
+            HEADER.size - 4 + len(payload),
+            frame_type,
+            participant,
+            a2b_hex(transaction_id),  # "" is padded to NO_TRANSACTION
+        )
+        + payload
+    )
+
+
+def encode_batch(frame_type, entries, participant=0):
+    """Encodes (transaction_id, payload) pairs as one batch frame of frame_type."""
+    parts = []
+    for transaction_id, payload in entries:
+        if payload.__class__ is str:
+            payload = payload.encode()
+        parts.append(BATCH_ENTRY.pack(a2b_hex(transaction_id), len(payload)))
+        parts.append(payload)
+    return encode_frame(BATCH_OPCODES[frame_type], "", b"".join(parts), participant)
+
+
+def expand_frame(frame):
+    """Splits a batch frame into single-transaction frames, others pass through."""
+    single_type = UNBATCHED_OPCODES.get(frame.frame_type)
+    if single_type is None:
+        return [frame]
+
+    frames = []
+    payload = frame.payload
+    offset = 0
+    while offset < len(payload):
+        transaction_id, length = BATCH_ENTRY.unpack_from(payload, offset)
+        start = offset + BATCH_ENTRY.size
+        offset = start + length
+        if offset > len(payload):
+            raise ProtocolError("Truncated batch frame.")
+        frames.append(
+            Frame(
+                single_type,
+                bytes_to_uuid(transaction_id),
+                payload[start:offset],
+                frame.participant,
+            )
+        )
+    return frames
+
+
+def encode_membership(members):
+    """Encodes the listening address of each participant, keyed by index."""
+    return json.dumps(
+        {str(index): [host, port] for index, (host, port) in members.items()}
+    ).encode()
+
+
+def parse_membership(payload):
+    """Decodes a membership payload into {participant index: (host, port)}."""
+    return {
+        int(index): (host, port) for index, (host, port) in json.loads(payload).items()
+    }
+
+
+def encode_operations(reads, writes, timestamp=0, participants=()):
+    """Encodes what a transaction reads and writes, its age and its participants."""
+    return json.dumps(
+        {
+            "reads": list(reads),
+            "writes": writes,
+            "timestamp": timestamp,
+            "participants": list(participants),
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+def parse_operations(payload):
+    """Decodes a prepare payload into ``Operations``; ValueError if invalid."""
+    operations = json.loads(payload)
+    if not isinstance(operations, dict):
+        raise ValueError("Operations must be a JSON object.")
+    reads = operations.get("reads", [])
+    writes = operations.get("writes", {})
+    timestamp = operations.get("timestamp", 0)
+    participants = operations.get("participants", [])
+    if not isinstance(reads, list) or not isinstance(writes, dict):
+        raise ValueError("Reads must be a list and writes an object.")
+    if not isinstance(timestamp, int) or not isinstance(participants, list):
+        raise ValueError("The timestamp must be an integer and participants a list.")
+    return Operations(reads, writes, timestamp, participants)
+
+
+def describe_frame(frame):
+    """Human readable form of a frame for log output."""
+    try:
+        name = Opcode(frame.frame_type).name
+    except ValueError:
+        name = str(frame.frame_type)
+    if frame.frame_type in UNBATCHED_OPCODES:
+        return f"{name}({frame.participant}, {len(expand_frame(frame))} transactions)"
+    payload = frame.payload.decode(errors="replace")
+    return f"{name}({frame.participant}, {frame.transaction_id}, {payload})"
+
+
+class FrameBuffer:
+    """Collects bytes from a stream and splits them into complete frames.
+
+    Any number of frames can arrive in one read, and a frame can be split
+    across reads, so the unparsed tail is kept until the rest arrives.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data):
+        """Adds received bytes and returns every frame that is now complete."""
+        buffer = self.buffer + data if self.buffer else bytes(data)
+        frames = []
+        offset = 0
+        end = len(buffer)
+        unpack_from = HEADER.unpack_from
+        header_size = HEADER.size
+        new_frame = tuple.__new__
+        append = frames.append
+        while end - offset >= header_size:
+            length, frame_type, participant, transaction_id = unpack_from(
+                buffer, offset
+            )
+            if length > MAX_FRAME_SIZE or length < header_size - 4:
+                raise ProtocolError(f"Invalid frame length {length}.")
+            frame_end = offset + 4 + length
+            if frame_end > end:
+                break
+
+            append(
+                new_frame(
+                    Frame,
+                    (
+                        frame_type,
+                        transaction_id.hex()
+                        if transaction_id != NO_TRANSACTION
+                        else "",
+                        buffer[offset + header_size : frame_end],
+                        participant,
+                    ),
+                )
+            )
+            offset = frame_end
+
+        self.buffer = buffer[offset:]
+        return frames
+
+
+class FrameReader:
+    """Reads frames from a socket, parsing as many as possible per ``recv``."""
+
+    def __init__(self, sock, buffer_size=65536):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.frames = FrameBuffer()
+
+    def read_frames(self, timeout=None):
+        """Reads once from the socket and returns the complete frames received.
+
+        Returns None once the peer has closed the connection. With a timeout,
+        raises ``socket.timeout`` if nothing arrives in time; the socket itself
+        stays blocking, so sends on it are not affected.
+        """
+        if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+            raise socket.timeout("timed out")
+        data = self.sock.recv(self.buffer_size)
+        if not data:
+            return None
+        return self.frames.feed(data)
+
+
+class FrameBatcher:
+    """Packs broadcast frames of concurrent transactions into batch frames.
+
+    Frames handed to ``add`` are held for at most ``batch_delay`` seconds, or
+    until ``max_batch_size`` have accumulated, and then go out as one batch
+    frame per opcode through ``send_bytes``.
+    """
+
+    def __init__(self, send_bytes, batch_delay=0.001, max_batch_size=256):
+        self.send_bytes = send_bytes
+        self.batch_delay = batch_delay
+        self.max_batch_size = max_batch_size
+        self.pending = {}
+        self.pending_count = 0
+        self.condition = threading.Condition()
+        self.batch_count = 0
+        self.frame_count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, frame_type, transaction_id, payload):
+        with self.condition:
+            self.pending.setdefault(frame_type, []).append((transaction_id, payload))
+            self.pending_count += 1
+            if self.pending_count == 1 or self.pending_count >= self.max_batch_size:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending_count > 0)
+                deadline = time.monotonic() + self.batch_delay
+                while self.pending_count < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                pending, self.pending = self.pending, {}
+                self.batch_count += 1
+                self.frame_count += self.pending_count
+                self.pending_count = 0
+
+            data = b"".join(
+                encode_batch(frame_type, entries)
+                for frame_type, entries in pending.items()
+            )
+            try:
+                self.send_bytes(data)
+            except OSError as e:
+                print(f"Error sending batch: {e}")
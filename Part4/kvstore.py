@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import threading
+
+from wal import sync_directory, truncate_torn_tail
+
+
+def encode_entry(key, value):
+    """Encodes a key and its value as a single line of compact JSON."""
+    return (json.dumps([key, value], separators=(",", ":")) + "\n").encode()
+
+
+class KeyValueStore:
+    """Committed data of a participant, in an append-only file with a hash index.
+
+    Every put appends the key and its new value to the data file, and an
+    in-memory dict maps each key to the offset and length of its latest
+    entry, so a point read is one dict lookup and one ``pread`` however large
+    the file is. The file handle stays open for the life of the store. The
+    index is rebuilt by scanning the file once at start-up.
+
+    The store is not synced on every write: the participant's transaction
+    log has the writes of every committed transaction, redoes them after a
+    crash and calls ``sync`` before it drops them at a checkpoint. Once
+    overwritten entries take up more than half of a file of at least
+    ``compact_bytes``, the file is rewritten with only the latest entries.
+    """
+
+    def __init__(self, file_path, compact_bytes=4 * 1024 * 1024):
+        self.file_path = file_path
+        self.compact_bytes = compact_bytes
+        created = not os.path.exists(file_path)
+        truncate_torn_tail(file_path)
+        self.file = open(file_path, "ab+")
+        if created:
+            sync_directory(file_path)
+        self.lock = threading.Lock()
+        self.index = {}  # key -> (offset, length) of its latest entry
+        self.live_bytes = 0
+        self.size = 0
+        self.compaction_count = 0
+        self.load_index()
+
+    def load_index(self):
+        offset = 0
+        with open(self.file_path, "rb") as file:
+            for line in file:
+                key, _ = json.loads(line)
+                self.index_entry(key, offset, len(line))
+                offset += len(line)
+        self.size = offset
+
+    def index_entry(self, key, offset, length):
+        previous = self.index.get(key)
+        if previous is not None:
+            self.live_bytes -= previous[1]
+        self.index[key] = (offset, length)
+        self.live_bytes += length
+
+    def get(self, key, default=None):
+        """Returns the latest committed value of a key."""
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return default
+            offset, length = entry
+            _, value = json.loads(os.pread(self.file.fileno(), length, offset))
+            return value
+
+    def put_many(self, writes):
+        """Appends the writes of a transaction, given as a dict, with one write."""
+        if not writes:
+            return
+        with self.lock:
+            entries = [(key, encode_entry(key, value)) for key, value in writes.items()]
+            self.file.write(b"".join(entry for _, entry in entries))
+            self.file.flush()
+            for key, entry in entries:
+                self.index_entry(key, self.size, len(entry))
+                self.size += len(entry)
+            if self.size >= self.compact_bytes and self.live_bytes * 2 < self.size:
+                self.compact()
+
+    def compact(self):
+        """Rewrites the file with only the latest entry of each key."""
+        temp_path = f"{self.file_path}.tmp"
+        index = {}
+        offset = 0
+        with open(temp_path, "wb") as file:
+            for key, (entry_offset, length) in self.index.items():
+                file.write(os.pread(self.file.fileno(), length, entry_offset))
+                index[key] = (offset, length)
+                offset += length
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.file.close()
+        os.replace(temp_path, self.file_path)
+        sync_directory(self.file_path)
+        self.file = open(self.file_path, "ab+")
+        self.index = index
+        self.size = self.live_bytes = offset
+        self.compaction_count += 1
+
+    def sync(self):
+        """Forces every write so far to stable storage."""
+        with self.lock:
+            os.fsync(self.file.fileno())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "keys": len(self.index),
+                "bytes": self.size,
+                "live_bytes": self.live_bytes,
+                "compactions": self.compaction_count,
+            }
+
+    def close(self):
+        with self.lock:
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a participant's data")
+    parser.add_argument("file", help="e.g. participant_1.db")
+    parser.add_argument("keys", nargs="*", help="keys to look up, all if none")
+    args = parser.parse_args()
+
+    store = KeyValueStore(args.file)
+    for key in args.keys or list(store.index):
+        print(f"{key}={store.get(key)}")
+    store.close()
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99, "p999": 0.999}
+
+
+def latency_summary(latencies):
+    """Count, mean, tail percentiles and maximum of latencies in seconds, in ms."""
+    values = sorted(latency * 1000 for latency in latencies)
+    summary = {"count": len(values)}
+    if values:
+        summary["mean"] = sum(values) / len(values)
+        for name, fraction in PERCENTILES.items():
+            summary[name] = values[min(len(values) - 1, int(len(values) * fraction))]
+        summary["max"] = values[-1]
+    return summary
+
+
+def run_load(engine, count, rate=0, keys=0):
+    """Runs count generated transactions through a coordinator engine.
+
+    With no ``rate`` the load is a closed loop: a transaction is submitted
+    as soon as there is room in the engine's window, so ``max_in_flight``
+    of them are always running. At a rate in transactions per second they
+    are submitted on a fixed schedule instead, however long earlier ones
+    take, and each latency counts from the time the transaction was due; a
+    backlog behind a full window then shows up in the latencies rather than
+    slowing the load down. Transaction i writes ``k<i % keys>`` if ``keys``
+    is given, which makes transactions contend for the same locks, and only
+    stores a message otherwise.
+
+    Returns the throughput, the outcomes, and the latency of the
+    transactions and of each phase they went through. Transactions that
+    failed with an error are counted apart and have no latency.
+    """
+    lock = threading.Condition()
+    latencies = []
+    phase_times = defaultdict(list)
+    outcomes = Counter()
+    failed = 0
+
+    def finished(transaction, due):
+        nonlocal failed
+        now = time.monotonic()
+        with lock:
+            if transaction.error is not None:
+                failed += 1
+                lock.notify_all()
+                return
+            latencies.append(now - due)
+            for phase, seconds in transaction.phase_times.items():
+                phase_times[phase].append(seconds)
+            # No decision if it was left to the participants
+            outcomes[transaction.decision or "Unknown"] += 1
+            lock.notify_all()
+
+    started = time.monotonic()
+    for i in range(count):
+        due = started + i / rate if rate else time.monotonic()
+        time.sleep(max(due - time.monotonic(), 0))
+        engine.submit(
+            f"k{i % keys}=v{i}" if keys else f"load {i}",
+            lambda transaction, due=due: finished(transaction, due),
+        )
+    with lock:
+        lock.wait_for(lambda: len(latencies) + failed == count)
+    elapsed = time.monotonic() - started
+
+    return {
+        "transactions": count,
+        "failed": failed,
+        "rate": rate,
+        "elapsed_s": elapsed,
+        "tps": len(latencies) / elapsed,
+        "commit_tps": outcomes["Commit"] / elapsed,
+        "outcomes": dict(outcomes),
+        "latency_ms": {
+            "total": latency_summary(latencies),
+            **{
+                phase: latency_summary(seconds)
+                for phase, seconds in phase_times.items()
+            },
+        },
+    }
@@ -0,0 +1,174 @@
+from collections import deque
+
+SHARED = "S"
+EXCLUSIVE = "X"
+
+# Results of LockManager.acquire
+GRANTED = "granted"
+WAITING = "waiting"
+DIED = "died"
+
+
+class LockRequest:
+    """The locks one transaction needs at a participant: key -> mode.
+
+    The timestamp the coordinator gave the transaction orders it against
+    every other transaction, the transaction ID breaking ties.
+    """
+
+    def __init__(self, transaction_id, reads=(), writes=(), timestamp=0):
+        self.transaction_id = transaction_id
+        self.timestamp = timestamp
+        self.modes = {key: SHARED for key in reads}
+        self.modes.update((key, EXCLUSIVE) for key in writes)
+
+    def is_older_than(self, other):
+        return (self.timestamp, self.transaction_id) < (
+            other.timestamp,
+            other.transaction_id,
+        )
+
+    def conflicts_with(self, other):
+        """True if the two requests lock a common key, exclusively on one side."""
+        smaller, larger = sorted((self.modes, other.modes), key=len)
+        return any(
+            key in larger and EXCLUSIVE in (mode, larger[key])
+            for key, mode in smaller.items()
+        )
+
+
+class LockManager:
+    """Shared and exclusive key locks, taken at prepare and held until the outcome.
+
+    A transaction asks for all its locks at once, as a participant knows
+    every key a transaction reads or writes when it is prepared. A request
+    that conflicts with a held lock, or with an earlier request that is
+    still waiting, waits in arrival order; ``release`` hands back the
+    requests it made grantable. Nothing here blocks: the caller defers the
+    waiting transactions and resumes them when they are granted.
+
+    Transactions that hold locks at one participant and wait at another can
+    still deadlock. That is prevented with wound-wait on the coordinator's
+    timestamps: a transaction only ever waits for older ones, so no cycle
+    of waits can form at any participant or across them. A waiting request
+    younger than a new one it blocks is wounded and must abort. A holder has
+    already voted Yes and cannot abort on its own, so a request that would
+    have to wait for a younger holder dies instead.
+    """
+
+    def __init__(self):
+        self.holders = {}  # key -> {transaction_id: mode}
+        self.held = {}  # transaction_id -> LockRequest
+        self.waiting = deque()  # LockRequests in arrival order
+        self.request_count = 0
+        self.granted_count = 0
+        self.waited_count = 0
+        self.died_count = 0
+        self.wounded_count = 0
+
+    def grantable(self, request):
+        for key, mode in request.modes.items():
+            holders = self.holders.get(key)
+            if holders and (mode == EXCLUSIVE or EXCLUSIVE in holders.values()):
+                return False
+        return True
+
+    def blocking_holders(self, request):
+        """The transactions holding locks that conflict with the request."""
+        blocking = {}
+        for key, mode in request.modes.items():
+            for transaction_id, held_mode in self.holders.get(key, {}).items():
+                if EXCLUSIVE in (mode, held_mode):
+                    blocking[transaction_id] = self.held[transaction_id]
+        return list(blocking.values())
+
+    def grant(self, request):
+        for key, mode in request.modes.items():
+            self.holders.setdefault(key, {})[request.transaction_id] = mode
+        self.held[request.transaction_id] = request
+        self.granted_count += 1
+
+    def acquire(self, request):
+        """Grants every lock of the request, queues it or lets it die.
+
+        Returns GRANTED, WAITING or DIED, and the IDs of the waiting
+        transactions the request wounded. The caller aborts those and
+        releases them, which may grant the request.
+        """
+        if request.transaction_id in self.held:
+            return GRANTED, []
+        self.request_count += 1
+        blocking = [
+            waiting for waiting in self.waiting if request.conflicts_with(waiting)
+        ]
+        if not blocking and self.grantable(request):
+            self.grant(request)
+            return GRANTED, []
+        if any(
+            request.is_older_than(holder) for holder in self.blocking_holders(request)
+        ):
+            self.died_count += 1
+            return DIED, []
+        wounded = [
+            waiting.transaction_id
+            for waiting in blocking
+            if request.is_older_than(waiting)
+        ]
+        self.wounded_count += len(wounded)
+        self.waiting.append(request)
+        self.waited_count += 1
+        return WAITING, wounded
+
+    def release(self, transaction_id):
+        """Releases a transaction's locks, or its place in the queue.
+
+        Returns the waiting requests that have been granted as a result, in
+        the order they arrived.
+        """
+        request = self.held.pop(transaction_id, None)
+        if request is None:
+            # Requests behind a cancelled one may no longer have to wait
+            self.cancel(transaction_id)
+            return self.grant_waiting()
+        for key in request.modes:
+            holders = self.holders[key]
+            del holders[transaction_id]
+            if not holders:
+                del self.holders[key]
+        return self.grant_waiting()
+
+    def cancel(self, transaction_id):
+        """Takes a request out of the queue before it was granted."""
+        for request in self.waiting:
+            if request.transaction_id == transaction_id:
+                self.waiting.remove(request)
+                return
+
+    def grant_waiting(self):
+        """Grants the waiting requests that conflict with nothing ahead of them."""
+        granted = []
+        blocked = []
+        for request in self.waiting:
+            if self.grantable(request) and not any(
+                request.conflicts_with(earlier) for earlier in blocked
+            ):
+                self.grant(request)
+                granted.append(request)
+            else:
+                blocked.append(request)
+        self.waiting = deque(blocked)
+        return granted
+
+    def stats(self):
+        """Lock counts, and the share of requests aborted to prevent deadlocks."""
+        aborted = self.died_count + self.wounded_count
+        return {
+            "held": len(self.held),
+            "waiting": len(self.waiting),
+            "requests": self.request_count,
+            "granted": self.granted_count,
+            "waited": self.waited_count,
+            "died": self.died_count,
+            "wounded": self.wounded_count,
+            "deadlock_abort_rate": round(aborted / max(self.request_count, 1), 4),
+        }
@@ -1,166 +1,1075 @@
+import argparse
+import queue
+import random
 import socket
-import sys
-import json
-import os
+import threading
 import time
+from collections import Counter
 
+from framing import (
+    COMMIT_ONE_PHASE,
+    DECISION,
+    DONE,
+    HEARTBEAT,
+    HEARTBEAT_ACK,
+    OUTCOME,
+    PEER_FRAMES,
+    PREPARE,
+    PRESUMED_OUTCOMES,
+    PRE_COMMIT,
+    PRE_COMMIT_ACK,
+    PROTOCOLS,
+    QUERY_OUTCOME,
+    REGISTER,
+    REQUEST_DECISION,
+    VOTE,
+    Frame,
+    FrameReader,
+    describe_frame,
+    encode_batch,
+    encode_frame,
+    expand_frame,
+    parse_operations,
+)
+from failure_detector import FailureDetector
+from kvstore import KeyValueStore
+from locks import DIED, GRANTED, LockManager, LockRequest
+from paxos import AcceptorGroup, acceptor_addresses, encode_accept, paxos_outcome
+from transport import ReplySender
+from wal import CommitTicket, TransactionStore
 
-def save_message_to_file(message, file_path):
-    """Saves a message to a text file."""
-    with open(file_path, "a") as file:
-        file.write(f"{message}\n")
+COORDINATOR = 0  # Failure detector node of the coordinator
 
 
-def find_transaction(transactions, transaction_id):
-    """Finds a transaction by its ID."""
-    for transaction in transactions:
-        if transaction.get("transaction_id") == transaction_id:
-            return transaction
-    return None
+def redo_commits(transaction_store, data_store):
+    """Reapplies the writes of the committed transactions still in the log.
 
+    The data store is only synced before the log drops them, so the latest
+    writes may have been lost in a crash. Writes are idempotent, and the log
+    keeps the transactions in the order they were prepared.
+    """
+    redone = 0
+    for transaction in transaction_store.transactions():
+        if transaction.get("decision") == "Commit" and transaction.get("writes"):
+            data_store.put_many(transaction["writes"])
+            redone += 1
+    if redone:
+        print(f"Redid the writes of {redone} committed transactions.")
 
-def load_transactions(file_path):
-    """Loads transactions from a JSON file."""
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError:
-                return []
-    return []
 
+def apply_decision(frame, data_store, transaction_store, protocol="basic"):
+    """Applies a decision, first or resent, to a pending transaction.
 
-def save_transactions(transactions, file_path):
-    """Saves transactions to a JSON file."""
-    with open(file_path, "w") as file:
-        json.dump(transactions, file, indent=2)
+    Returns the commit ticket of the outcome record, or None if there was
+    nothing to apply. The presumed outcome of the protocol is not forced to
+    the log: if it is lost, the coordinator answers a request for the
+    transaction it no longer knows with that outcome.
+    """
+    decision_transaction_id = frame.transaction_id
+    decision = frame.payload.decode()
+    if decision not in ("Commit", "Abort"):
+        print("Error: Received malformed decision message.")
+        return None
 
+    transaction_data = transaction_store.get(decision_transaction_id)
 
-def handle_incoming_messages(participant_index):
-    transaction_file = f"participant_{participant_index}_transactions.json"
-    transaction_completed = False
+    if transaction_data is None:
+        print("Transaction is already handled or does not exist.")
+        print(f"Transaction ID: {decision_transaction_id}")
+        return None
 
-    while True:
-        try:
-            message = participant_socket.recv(1024).decode().strip()
-            print(f"Participant {participant_index} received message: {message}")
+    if transaction_data["status"] == "done":
+        print("Transaction is already complete. Skipping.")
+        return None
+
+    if decision == "Commit":
+        data_store.put_many(transaction_data.get("writes", {}))
+        print("Writes applied to the data store.")
+    else:
+        print("Transaction aborted.")
+
+    return transaction_store.write(
+        {
+            "transaction_id": decision_transaction_id,
+            "decision": decision,
+            "status": "done",
+        },
+        force=decision != PRESUMED_OUTCOMES.get(protocol),
+    )
+
+
+def record_vote(frame, operations, transaction_store, vote="Yes", protocol="basic"):
+    """Records the transaction and returns the commit ticket of the vote.
+
+    Only a "Yes" has to be durable before it is sent. A participant that
+    votes "ReadOnly", or "Abort" under presumed abort, forgets the transaction
+    right away, as it will not be told the outcome.
+    """
+    transaction_id = frame.transaction_id
+    if not transaction_id:
+        print(f"Received malformed message from coordinator: {describe_frame(frame)}")
+        return None
+
+    if vote == "ReadOnly" or (vote == "Abort" and protocol == "presumed-abort"):
+        return CommitTicket.completed()
+    return transaction_store.write(
+        {
+            "transaction_id": transaction_id,
+            "reads": operations.reads,
+            "writes": operations.writes,
+            "timestamp": operations.timestamp,
+            "participants": operations.participants,
+            "response": vote,
+            "status": "pending",
+        },
+        force=vote == "Yes",
+    )
+
+
+def commit_one_phase(frame, writes, data_store, transaction_store, vote="Yes"):
+    """Decides a transaction this participant alone takes part in.
+
+    Returns the outcome and the commit ticket of its record. Only a commit is
+    logged: nobody else will ask about the transaction, and an abort leaves
+    nothing to undo.
+    """
+    transaction_id = frame.transaction_id
+    if vote != "Yes":
+        print("Transaction aborted." if vote == "Abort" else "Nothing to commit.")
+        return "Commit" if vote == "ReadOnly" else "Abort", CommitTicket.completed()
+
+    data_store.put_many(writes)
+    print("Writes applied to the data store.")
+    ticket = transaction_store.write(
+        {
+            "transaction_id": transaction_id,
+            "writes": writes,
+            "decision": "Commit",
+            "status": "done",
+        }
+    )
+    return "Commit", ticket
+
+
+def read_operations(frame):
+    """The ``Operations`` a prepare carries, or None if it is malformed."""
+    try:
+        return parse_operations(frame.payload)
+    except ValueError:
+        print(f"Received malformed message from coordinator: {describe_frame(frame)}")
+        return None
+
+
+def read_values(reads, data_store):
+    """Prints the committed values a transaction reads."""
+    for key in reads:
+        print(f"Read {key}={data_store.get(key)}")
+
+
+def peer_outcome(transaction):
+    """What this participant can tell a peer about a transaction it has a record of.
+
+    The outcome once it knows it, "Abort" if it voted so, as the transaction
+    can then never commit, and "PreCommitted" or "Uncertain" if it voted Yes
+    and is in doubt as well. Without a record it answers "Unknown": it may
+    never have seen the prepare, or it may have finished the transaction and
+    forgotten it.
+    """
+    if transaction is None:
+        return "Unknown"
+    if transaction.get("decision") in ("Commit", "Abort"):
+        return transaction["decision"]
+    if transaction.get("response") == "Abort":
+        return "Abort"
+    if transaction.get("pre_committed"):
+        return "PreCommitted"
+    return "Uncertain"
+
+
+def termination_decision(states):
+    """Outcome of a three-phase transaction, from what its participants report.
+
+    An outcome already reached stands. Otherwise the coordinator may have
+    committed only if some participant is pre-committed, as it commits once
+    all of them are; and if none is, it can no longer commit, as a
+    participant that reported its state refuses a later pre-commit.
+    """
+    if "Commit" in states:
+        return "Commit"
+    if "Abort" in states:
+        return "Abort"
+    if "PreCommitted" in states:
+        return "Commit"
+    return "Abort"
 
-            if message.startswith("Decision:") or message.startswith(
-                "RequestDecision:"
-            ):
-                # Handle decision or request decision messages
-                is_resend_decision = message.startswith("RequestDecision:")
-                if is_resend_decision:
-                    message = message.replace("RequestDecision:Decision:", "Decision:")
-
-                try:
-                    parts = message.split(";")
-                    decision_transaction_id = parts[0].split(":")[1]
-                    decision = parts[1].split(":")[1]
-                except IndexError:
-                    print("Error: Received malformed decision message.")
-                    continue
 
-                transactions = load_transactions(transaction_file)
-                transaction_data = find_transaction(
-                    transactions, decision_transaction_id
+def choose_vote(writes, abort_rate=0.0, read_only_rate=0.0):
+    """Votes "ReadOnly" without writes, and "Abort" or "ReadOnly" at the given rates.
+
+    The rates simulate transactions that fail or have nothing to commit here.
+    """
+    draw = random.random()
+    if draw < abort_rate:
+        return "Abort"
+    if not writes or draw < abort_rate + read_only_rate:
+        return "ReadOnly"
+    return "Yes"
+
+
+def encode_replies(frame_type, entries):
+    """One frame for a single (transaction_id, payload) reply, a batch for more."""
+    if len(entries) == 1:
+        return encode_frame(frame_type, *entries[0])
+    return encode_batch(frame_type, entries)
+
+
+class Participant:
+    """Votes on and applies the transactions the coordinator sends.
+
+    A prepared transaction holds shared locks on the keys it reads and
+    exclusive locks on the keys it writes until its outcome is applied, so
+    only transactions that touch the same keys are serialized. A prepare
+    whose locks are taken is deferred without holding up the connection:
+    frames of other transactions are handled in the meantime, and it is
+    voted on as soon as the transactions ahead of it release their locks.
+    A prepare that the lock manager lets die, or wounds while it waits, to
+    prevent a deadlock is voted "Abort" at once.
+
+    Locks are released as soon as the outcome is applied, before its
+    record is durable: a transaction that then takes them logs its own vote
+    behind that record, so it can never be durable first.
+
+    With ``cooperative`` termination, a participant that suspects the
+    coordinator also asks the other participants of its in-doubt
+    transactions for the outcome, through the server. Any of them that knows
+    it, voted Abort, or had not voted yet and aborts instead, lets it finish
+    and release its locks without waiting for the coordinator to return.
+
+    Under three-phase commit that is timeout-driven. A transaction still in
+    doubt a termination timeout after its last message from the coordinator
+    is terminated by its lowest-indexed participant; each participant after
+    it waits one timeout longer, so the next one takes over if that one has
+    failed. The timeout is the failure detector's estimate of how long the
+    coordinator takes to follow up on a vote or pre-commit, which includes
+    the time the other participants wait for their locks, and is
+    ``termination_timeout`` until the first of them has been timed. The
+    elected participant collects the states of the others, decides with
+    ``termination_decision`` and tells them the outcome.
+
+    Under Paxos Commit the votes go to the ``acceptors`` rather than the
+    coordinator, and a transaction still in doubt after the same staggered
+    timeouts is settled at the acceptors with a higher ballot, on a thread
+    of its own, whose outcome the reader applies once it is in. The
+    acceptors give every participant the same outcome, so each one settles
+    its own transactions without telling the others.
+    """
+
+    def __init__(
+        self,
+        participant_index,
+        data_store,
+        transaction_store,
+        replies,
+        simulate_failure=False,
+        protocol="basic",
+        abort_rate=0.0,
+        read_only_rate=0.0,
+        cooperative=False,
+        termination_timeout=1.0,
+        acceptors=None,
+    ):
+        self.participant_index = participant_index
+        self.data_store = data_store
+        self.transaction_store = transaction_store
+        self.replies = replies
+        self.simulate_failure = simulate_failure
+        self.protocol = protocol
+        self.abort_rate = abort_rate
+        self.read_only_rate = read_only_rate
+        self.cooperative = cooperative
+        # Learns the coordinator's heartbeat rhythm, so silence is noticed as
+        # soon as it is clearly longer than the usual gap, and how long it
+        # takes to answer a vote or pre-commit
+        self.detector = FailureDetector(initial_phase_timeout=termination_timeout)
+        self.awaiting = {}  # transaction_id -> when its answer was sent
+        self.locks = LockManager()
+        self.deferred = {}  # transaction_id -> (frame, operations, vote)
+        self.votes = Counter()
+        # Three-phase termination: when each in-doubt transaction is to be
+        # terminated here, those whose state a peer asked for, which refuse a
+        # pre-commit from then on, and those this participant terminates
+        self.deadlines = {}  # transaction_id -> time.monotonic() deadline
+        self.terminating = set()
+        self.leading = {}  # transaction_id -> {"states", "peers", "deadline"}
+        # Paxos Commit: votes go out once durable, like replies to the server
+        self.acceptors = acceptors
+        self.votes_out = ReplySender(acceptors) if acceptors is not None else None
+        self.settling = set()  # Transactions with a ballot running at the acceptors
+        self.settled = queue.Queue()  # (transaction_id, chosen votes or None)
+        self.relock_prepared()
+
+    def relock_prepared(self):
+        """Takes the locks of the transactions that voted Yes before a restart."""
+        for transaction_id in self.transaction_store.pending_ids():
+            transaction = self.transaction_store.get(transaction_id)
+            if transaction.get("response") == "Yes":
+                self.locks.acquire(
+                    LockRequest(
+                        transaction_id,
+                        transaction.get("reads", []),
+                        transaction.get("writes", {}),
+                        transaction.get("timestamp", 0),
+                    )
                 )
+                self.schedule_termination(
+                    transaction_id, transaction.get("participants", [])
+                )
+
+    def admit(self, frames):
+        """Runs the transactions whose locks are free and defers the others."""
+        ready = []
+        granted = []
+        for frame in frames:
+            operations = read_operations(frame)
+            if operations is None:
+                continue
+            vote = choose_vote(operations.writes, self.abort_rate, self.read_only_rate)
+            transaction_id = frame.transaction_id
+            # A transaction that aborts here needs no locks
+            if vote == "Abort":
+                ready.append((frame, operations, vote))
+                continue
+            result, wounded = self.locks.acquire(
+                LockRequest(
+                    transaction_id,
+                    operations.reads,
+                    operations.writes,
+                    operations.timestamp,
+                )
+            )
+            if result == GRANTED:
+                ready.append((frame, operations, vote))
+            elif result == DIED:
+                print(f"Transaction {transaction_id} aborted to avoid a deadlock.")
+                ready.append((frame, operations, "Abort"))
+            else:
+                print(f"Transaction {transaction_id} waits for locks.")
+                self.deferred[transaction_id] = (frame, operations, vote)
+            for victim in wounded:
+                print(f"Transaction {victim} wounded by {transaction_id}, aborting.")
+                ready.append(self.deferred.pop(victim)[:2] + ("Abort",))
+                granted.extend(self.locks.release(victim))
+        self.resume(granted + self.run_locked(ready))
 
-                if transaction_data is not None and (
-                    is_resend_decision or transaction_data["status"] == "pending"
-                ):
-                    if transaction_data["status"] != "done":
-                        transaction_data["decision"] = decision
-
-                        if decision == "Commit":
-                            if transaction_data["status"] == "pending":
-                                message_file = f"participant_{participant_index}.txt"
-                                save_message_to_file(
-                                    transaction_data["message"], message_file
-                                )
-                                print("Message saved to text file.")
-                            transaction_data["status"] = "done"
-                            save_transactions(transactions, transaction_file)
-                            time.sleep(1)
-                            participant_socket.sendall(
-                                f"{participant_index}:done\n".encode()
-                            )
-                            print(f"Sent {participant_index}:done to coordinator")
-                            transaction_completed = True
-                        elif decision == "Abort":
-                            print("Transaction aborted.")
-                            transaction_data["status"] = "done"
-                            save_transactions(transactions, transaction_file)
-
-                    else:
-                        print("Transaction is already complete. Skipping.")
+    def resume(self, granted):
+        """Runs deferred transactions that were granted their locks, and so on."""
+        while granted:
+            transactions = [
+                self.deferred.pop(request.transaction_id)
+                for request in granted
+                if request.transaction_id in self.deferred
+            ]
+            granted = self.run_locked(transactions)
 
-                else:
-                    print("Transaction is already handled or does not exist.")
-                    print(f"Transaction ID: {decision_transaction_id}")
+    def run_locked(self, transactions):
+        """Votes on or commits transactions that hold their locks.
+
+        Returns the deferred lock requests granted by locks released here.
+        """
+        prepares = []
+        one_phase = []
+        for transaction in transactions:
+            frame, operations, vote = transaction
+            self.votes[vote] += 1
+            if vote != "Abort":
+                read_values(operations.reads, self.data_store)
+            if frame.frame_type == COMMIT_ONE_PHASE:
+                one_phase.append(transaction)
+            else:
+                prepares.append(transaction)
+        granted = []
+        if prepares:
+            granted.extend(self.vote(prepares))
+        if one_phase:
+            granted.extend(self.commit_one_phase(one_phase))
+        return granted
+
+    def vote(self, transactions):
+        """Records the votes and sends them once they are durable."""
+        voted = []
+        granted = []
+        for frame, operations, vote in transactions:
+            ticket = record_vote(
+                frame, operations, self.transaction_store, vote, self.protocol
+            )
+            if ticket is None:
+                continue
+            voted.append((frame.transaction_id, vote, ticket))
+            # Only a Yes keeps its locks until the outcome
+            if vote == "ReadOnly":
+                granted.extend(self.locks.release(frame.transaction_id))
+            elif vote == "Yes":
+                self.awaiting[frame.transaction_id] = time.monotonic()
+                self.schedule_termination(
+                    frame.transaction_id, operations.participants
+                )
+        if not voted:
+            return granted
+
+        if self.acceptors is not None:
+            # Each participant proposes its own vote in ballot 0
+            self.votes_out.send_after(
+                [ticket for _, _, ticket in voted],
+                b"".join(
+                    encode_accept(transaction_id, self.participant_index, 0, vote)
+                    for transaction_id, vote, _ in voted
+                ),
+            )
+        else:
+            self.replies.send_after(
+                [ticket for _, _, ticket in voted],
+                encode_replies(
+                    VOTE, [(transaction_id, vote) for transaction_id, vote, _ in voted]
+                ),
+            )
+        print("Transaction information stored in the transaction log.")
+
+        yes_votes = [
+            transaction_id for transaction_id, vote, _ in voted if vote == "Yes"
+        ]
+        if self.simulate_failure and yes_votes:
+            self.simulate_failure_after_vote(yes_votes)
+        return granted
 
+    def commit_one_phase(self, transactions):
+        """Decides single-participant transactions and replies with their outcome."""
+        decided = []
+        granted = []
+        for frame, operations, vote in transactions:
+            outcome, ticket = commit_one_phase(
+                frame, operations.writes, self.data_store, self.transaction_store, vote
+            )
+            decided.append((frame.transaction_id, outcome, ticket))
+            granted.extend(self.locks.release(frame.transaction_id))
+
+        # The outcomes must be durable before they are reported
+        self.replies.send_after(
+            [ticket for _, _, ticket in decided],
+            b"".join(
+                encode_frame(DONE, transaction_id, outcome)
+                for transaction_id, outcome, _ in decided
+            ),
+        )
+        for transaction_id, outcome, _ in decided:
+            print(f"Sent {transaction_id}:{outcome} to coordinator")
+        return granted
+
+    def handle_decisions(self, frames):
+        """Applies decisions and acknowledges them, batched if they came batched."""
+        completed = []
+        tickets = []
+        granted = []
+        for frame in frames:
+            ticket = apply_decision(
+                frame, self.data_store, self.transaction_store, self.protocol
+            )
+            self.outcome_received(frame.transaction_id)
+            self.forget_termination(frame.transaction_id)
+            # An abort can also reach a transaction still waiting for its locks
+            self.deferred.pop(frame.transaction_id, None)
+            granted.extend(self.locks.release(frame.transaction_id))
+            if frame.payload not in (b"Commit", b"Abort"):
+                continue
+            # The coordinator forgets the presumed outcome as soon as it is sent
+            # and expects no acknowledgement
+            if frame.payload.decode() == PRESUMED_OUTCOMES.get(self.protocol):
+                continue
+            # Decisions resent for transactions that are already finished are
+            # acknowledged again, so a recovering coordinator can close them
+            completed.append(frame.transaction_id)
+            if ticket is not None:
+                tickets.append(ticket)
+
+        # All outcomes of the batch share the same fsync
+        if completed:
+            self.replies.send_after(
+                tickets,
+                encode_replies(
+                    DONE, [(transaction_id, b"") for transaction_id in completed]
+                ),
+            )
+            for transaction_id in completed:
+                print(f"Sent {transaction_id}:done to coordinator")
+        self.resume(granted)
+
+    def answer_queries(self, frames):
+        """Tells the peers that asked what this participant knows of a transaction.
+
+        A prepare still waiting for its locks has not been voted on, so it is
+        aborted, and the coordinator told so, rather than leave the peer in
+        doubt.
+        """
+        aborted = []
+        granted = []
+        answers = []
+        for frame in frames:
+            transaction_id = frame.transaction_id
+            if transaction_id in self.deferred:
+                aborted.append(self.deferred.pop(transaction_id)[:2] + ("Abort",))
+                granted.extend(self.locks.release(transaction_id))
+                outcome = "Abort"
             else:
-                # Handle initial prepare message
-                if ";" not in message:
-                    print(f"Received malformed message from coordinator: {message}")
+                outcome = peer_outcome(self.transaction_store.get(transaction_id))
+            if outcome in ("Uncertain", "PreCommitted"):
+                # The peer is terminating the transaction, so this participant
+                # no longer follows the coordinator and waits for the peer
+                self.terminating.add(transaction_id)
+                self.postpone_termination(transaction_id)
+            answers.append(
+                encode_frame(OUTCOME, transaction_id, outcome, frame.participant)
+            )
+            print(f"Told participant {frame.participant} {transaction_id}:{outcome}")
+        granted.extend(self.run_locked(aborted))
+        # Sent behind the abort votes, which the coordinator must see first
+        self.replies.send_after([], b"".join(answers))
+        self.resume(granted)
+
+    def learn_outcomes(self, frames):
+        """Applies the outcomes of in-doubt transactions that peers knew.
+
+        The other answers are the states of the peers of a transaction this
+        participant terminates, which it decides once all of them are in.
+        """
+        granted = []
+        for frame in frames:
+            transaction_id = frame.transaction_id
+            outcome = frame.payload.decode()
+            print(
+                f"Participant {frame.participant} answered {transaction_id}:{outcome}"
+            )
+            termination = self.leading.get(transaction_id)
+            if outcome in ("Commit", "Abort") and termination is not None:
+                granted.extend(self.finish_termination(transaction_id, outcome))
+            elif outcome in ("Commit", "Abort"):
+                if not self.transaction_store.is_pending(transaction_id):
                     continue
+                # The coordinator resends the decision when it is back, and
+                # gets its acknowledgement then
+                apply_decision(
+                    frame, self.data_store, self.transaction_store, self.protocol
+                )
+                self.forget_termination(transaction_id)
+                granted.extend(self.locks.release(transaction_id))
+            elif termination is not None:
+                termination["states"][frame.participant] = outcome
+                if len(termination["states"]) > len(termination["peers"]):
+                    granted.extend(self.finish_termination(transaction_id))
+        self.resume(granted)
 
-                transaction_id, received_message = message.split(";", 1)
+    def handle_pre_commits(self, frames):
+        """Records pre-commits and acknowledges them once they are durable.
 
-                transaction_data = {
-                    "transaction_id": transaction_id,
-                    "message": received_message,
-                    "response": "Yes",
-                    "status": "pending",
-                }
+        A transaction whose state a peer has asked for is being terminated
+        without the coordinator, which must then not be able to commit it.
+        """
+        tickets = []
+        acks = []
+        for frame in frames:
+            transaction_id = frame.transaction_id
+            transaction = self.transaction_store.get(transaction_id)
+            self.outcome_received(transaction_id)
+            if (
+                transaction_id in self.terminating
+                or peer_outcome(transaction) != "Uncertain"
+            ):
+                print(f"Ignoring pre-commit of {transaction_id}.")
+                continue
+            tickets.append(
+                self.transaction_store.write(
+                    {"transaction_id": transaction_id, "pre_committed": True}
+                )
+            )
+            acks.append(encode_frame(PRE_COMMIT_ACK, transaction_id))
+            self.awaiting[transaction_id] = time.monotonic()
+            self.schedule_termination(
+                transaction_id, transaction.get("participants", [])
+            )
+        if acks:
+            self.replies.send_after(tickets, b"".join(acks))
 
-                transactions = load_transactions(transaction_file)
-                transactions.append(transaction_data)
-                save_transactions(transactions, transaction_file)
+    def schedule_termination(self, transaction_id, participants):
+        """Sets when this participant terminates a three-phase or Paxos transaction.
 
-                reply_with_index = f"{participant_index}:Yes\n"
-                print("Transaction information stored in JSON file.")
-                participant_socket.sendall(reply_with_index.encode())
-                print("Simulating participant failure after responding 'Yes'.")
-                time.sleep(35)  # Simulate failure longer than coordinator timeout
+        The lowest-indexed participant goes first, and each one after it a
+        timeout later.
+        """
+        if (
+            self.protocol not in ("three-phase", "paxos-commit")
+            or self.participant_index not in participants
+        ):
+            return
+        rank = sorted(participants).index(self.participant_index)
+        delay = self.outcome_timeout() * (rank + 1)
+        self.deadlines[transaction_id] = time.monotonic() + delay
 
-                # Recovery process
-                print(
-                    "Participant recovering, requesting transaction status from coordinator..."
+    def outcome_timeout(self):
+        """How long the coordinator may take to follow up on a vote or pre-commit."""
+        return self.detector.phase_timeout([COORDINATOR], "outcome")
+
+    def outcome_received(self, transaction_id):
+        """Times the coordinator's answer to a vote or pre-commit."""
+        sent_at = self.awaiting.pop(transaction_id, None)
+        # Answers that come after a termination started measure the outage
+        if sent_at is not None and transaction_id not in self.leading:
+            self.detector.observe(
+                COORDINATOR, "outcome", time.monotonic() - sent_at
+            )
+
+    def postpone_termination(self, transaction_id):
+        """Gives a peer terminating a transaction the time to finish it."""
+        if transaction_id in self.deadlines:
+            transaction = self.transaction_store.get(transaction_id)
+            self.schedule_termination(transaction_id, transaction["participants"])
+
+    def forget_termination(self, transaction_id):
+        self.awaiting.pop(transaction_id, None)
+        self.deadlines.pop(transaction_id, None)
+        self.leading.pop(transaction_id, None)
+        self.terminating.discard(transaction_id)
+
+    def next_deadline(self, timeout):
+        """Shortens a read timeout to the next termination deadline, if sooner."""
+        deadlines = list(self.deadlines.values())
+        deadlines.extend(
+            termination["deadline"] for termination in self.leading.values()
+        )
+        if self.settling:
+            # The outcome of a ballot is handed over without waking the reader
+            deadlines.append(time.monotonic() + 0.01)
+        if not deadlines:
+            return timeout
+        return max(0.001, min(timeout, min(deadlines) - time.monotonic()))
+
+    def check_terminations(self):
+        """Starts and finishes the terminations whose deadline has passed."""
+        now = time.monotonic()
+        granted = []
+        expired = [
+            transaction_id
+            for transaction_id, deadline in self.deadlines.items()
+            if deadline <= now and transaction_id not in self.leading
+        ]
+        if expired:
+            # Backed off until the coordinator is timed again, so a coordinator
+            # that became slower is not bypassed over and over
+            self.detector.expired(COORDINATOR, "outcome")
+        for transaction_id in expired:
+            granted.extend(self.start_termination(transaction_id))
+        for transaction_id, termination in list(self.leading.items()):
+            if termination["deadline"] <= now:
+                granted.extend(self.finish_termination(transaction_id))
+        granted.extend(self.apply_settled())
+        self.resume(granted)
+
+    def start_termination(self, transaction_id):
+        """Asks the other participants of an in-doubt transaction for their state.
+
+        Under Paxos Commit the acceptors are asked to settle it instead.
+        """
+        transaction = self.transaction_store.get(transaction_id)
+        if transaction is None or not self.transaction_store.is_pending(
+            transaction_id
+        ):
+            self.forget_termination(transaction_id)
+            return []
+        participants = transaction.get("participants", [])
+        peers = [peer for peer in participants if peer != self.participant_index]
+        print(f"Terminating {transaction_id} without the coordinator.")
+        if self.acceptors is not None:
+            return self.settle(transaction_id, participants)
+        self.terminating.add(transaction_id)
+        self.leading[transaction_id] = {
+            "states": {self.participant_index: peer_outcome(transaction)},
+            "peers": peers,
+            "deadline": time.monotonic() + self.outcome_timeout(),
+        }
+        # Tried again, by then probably by another participant, if this one
+        # does not get to finish it
+        self.schedule_termination(transaction_id, participants)
+        if not peers:
+            return self.finish_termination(transaction_id)
+        self.replies.send(
+            b"".join(
+                encode_frame(QUERY_OUTCOME, transaction_id, participant=peer)
+                for peer in peers
+            )
+        )
+        return []
+
+    def finish_termination(self, transaction_id, decision=None):
+        """Decides a transaction this participant terminates and tells the others.
+
+        Returns the lock requests granted as the transaction releases its locks.
+        """
+        termination = self.leading[transaction_id]
+        if decision is None:
+            decision = termination_decision(termination["states"].values())
+        print(f"Terminated {transaction_id}: {decision} ({termination['states']})")
+        ticket = apply_decision(
+            Frame(DECISION, transaction_id, decision.encode(), 0),
+            self.data_store,
+            self.transaction_store,
+            self.protocol,
+        )
+        # The others hear of the outcome only once it is durable here
+        self.replies.send_after(
+            [ticket] if ticket is not None else [],
+            b"".join(
+                encode_frame(OUTCOME, transaction_id, decision, peer)
+                for peer in termination["peers"]
+            ),
+        )
+        self.forget_termination(transaction_id)
+        return self.locks.release(transaction_id)
+
+    def settle(self, transaction_id, participants):
+        """Starts a ballot at the acceptors, tried again later if it fails."""
+        self.schedule_termination(transaction_id, participants)
+        if transaction_id not in self.settling:
+            self.settling.add(transaction_id)
+            threading.Thread(
+                target=self.run_ballot,
+                args=(transaction_id, participants, self.outcome_timeout()),
+                daemon=True,
+            ).start()
+        return []
+
+    def run_ballot(self, transaction_id, participants, timeout):
+        chosen = self.acceptors.terminate(transaction_id, participants, timeout)
+        self.settled.put((transaction_id, chosen))
+
+    def apply_settled(self):
+        """Applies the outcomes of the ballots that have finished.
+
+        Returns the lock requests granted as the transactions release their locks.
+        """
+        granted = []
+        while not self.settled.empty():
+            transaction_id, chosen = self.settled.get()
+            self.settling.discard(transaction_id)
+            if chosen is None:
+                print(f"No majority of the acceptors answered for {transaction_id}.")
+                continue
+            decision = paxos_outcome(chosen.values())
+            print(f"Terminated {transaction_id}: {decision} ({chosen})")
+            apply_decision(
+                Frame(DECISION, transaction_id, decision.encode(), 0),
+                self.data_store,
+                self.transaction_store,
+                self.protocol,
+            )
+            self.forget_termination(transaction_id)
+            granted.extend(self.locks.release(transaction_id))
+        return granted
+
+    def vote_stats(self):
+        """Votes cast, and the share of them that were "Abort"."""
+        abort_rate = self.votes["Abort"] / max(sum(self.votes.values()), 1)
+        return {**self.votes, "abort_rate": round(abort_rate, 4)}
+
+    def simulate_failure_after_vote(self, transaction_ids):
+        print("Simulating participant failure after responding 'Yes'.")
+        time.sleep(35)  # Simulate failure longer than coordinator timeout
+
+        # Recovery process
+        print(
+            "Participant recovering, requesting transaction status from coordinator..."
+        )
+        self.resolve_in_doubt(transaction_ids)
+
+    def resolve_in_doubt(self, transaction_ids):
+        """Asks the coordinator, and with cooperative termination the peers."""
+        self.request_decisions(transaction_ids)
+        if self.cooperative:
+            self.query_peers(transaction_ids)
+
+    def request_decisions(self, transaction_ids):
+        self.replies.send(
+            b"".join(
+                encode_frame(REQUEST_DECISION, transaction_id)
+                for transaction_id in transaction_ids
+            )
+        )
+
+    def query_peers(self, transaction_ids):
+        """Asks the other participants of each transaction for its outcome."""
+        queries = []
+        for transaction_id in transaction_ids:
+            transaction = self.transaction_store.get(transaction_id) or {}
+            queries.extend(
+                encode_frame(QUERY_OUTCOME, transaction_id, participant=peer)
+                for peer in transaction.get("participants", [])
+                if peer != self.participant_index
+            )
+        if queries:
+            self.replies.send(b"".join(queries))
+
+    def handle_incoming_messages(self, sock):
+        reader = FrameReader(sock)
+        detector = self.detector
+        connected = False  # Whether the coordinator has been heard from yet
+
+        while True:
+            self.check_terminations()
+            try:
+                frames = reader.read_frames(
+                    self.next_deadline(detector.suspicion_timeout(COORDINATOR))
                 )
-                participant_socket.sendall(f"RequestDecision:{transaction_id}".encode())
+                if frames is None:
+                    print("Server closed the connection.")
+                    break
 
-        except socket.timeout:
-            if transaction_completed:
-                print("Transaction completed, no further actions needed.")
+                # Only the latest heartbeat of a read is answered, older ones
+                # queued up while this participant was busy
+                heartbeats = [
+                    frame for frame in frames if frame.frame_type == HEARTBEAT
+                ]
+                from_coordinator = True
+                if heartbeats:
+                    self.replies.send(
+                        encode_frame(HEARTBEAT_ACK, payload=heartbeats[-1].payload)
+                    )
+                    revived = detector.heartbeat_received(COORDINATOR)
+                elif any(frame.frame_type not in PEER_FRAMES for frame in frames):
+                    revived = detector.heard_from(COORDINATOR)
+                else:
+                    # Only other participants spoke
+                    revived = from_coordinator = False
+                if revived:
+                    print("Coordinator is reachable again.")
+                if revived or (from_coordinator and not connected):
+                    connected = True
+                    # After a restart, the outcome of a transaction this
+                    # participant voted on may be lost with its lazy record,
+                    # and the coordinator, which presumes it, will not resend
+                    # it. A revived coordinator may be a standby that took
+                    # over, and never saw the requests sent while it was down
+                    in_doubt = self.transaction_store.in_doubt_ids()
+                    if in_doubt:
+                        self.request_decisions(in_doubt)
+
+                # An abort that arrives together with its prepare, because
+                # another participant voted first, makes the vote pointless
+                aborted = {
+                    transaction.transaction_id
+                    for frame in frames
+                    for transaction in expand_frame(frame)
+                    if transaction.frame_type == DECISION
+                    and transaction.payload == b"Abort"
+                }
+
+                for frame in frames:
+                    if frame.frame_type == HEARTBEAT:
+                        continue
+                    print(
+                        f"Participant {self.participant_index} received message: "
+                        f"{describe_frame(frame)}"
+                    )
+
+                    # A batch frame is answered with a single batched reply
+                    transactions = expand_frame(frame)
+                    if not transactions:
+                        continue
+                    if transactions[0].frame_type == DECISION:
+                        self.handle_decisions(transactions)
+                    elif transactions[0].frame_type == PREPARE:
+                        transactions = [
+                            transaction
+                            for transaction in transactions
+                            if transaction.transaction_id not in aborted
+                        ]
+                        self.admit(transactions)
+                    elif transactions[0].frame_type == COMMIT_ONE_PHASE:
+                        self.admit(transactions)
+                    elif transactions[0].frame_type == PRE_COMMIT:
+                        self.handle_pre_commits(transactions)
+                    elif transactions[0].frame_type == QUERY_OUTCOME:
+                        self.answer_queries(transactions)
+                    elif transactions[0].frame_type == OUTCOME:
+                        self.learn_outcomes(transactions)
+
+            except ConnectionResetError:
+                # Heartbeat acks still in flight make a closing peer reset
+                print("Connection reset by peer.")
                 break
-            else:
-                print("Coordinator timed out. Aborting transaction.")
-                time.sleep(5)
+            except socket.timeout:
+                if not detector.check([COORDINATOR]):
+                    continue
+                timeout = detector.suspicion_timeout(COORDINATOR)
+                print(
+                    f"Coordinator suspected after {timeout * 1000:.0f} ms of silence."
+                )
+                in_doubt = self.transaction_store.in_doubt_ids()
+                if in_doubt:
+                    print(f"Requesting the decision of {len(in_doubt)} transactions.")
+                    self.resolve_in_doubt(in_doubt)
 
 
-def start_participant(participant_index):
+def start_participant(
+    participant_index,
+    simulate_failure=False,
+    direct=False,
+    protocol="basic",
+    abort_rate=0.0,
+    read_only_rate=0.0,
+    cooperative=False,
+    termination_timeout=1.0,
+    acceptor_count=3,
+):
     SERVER_IP = "127.0.0.1"
     SERVER_PORT = 12346
+    TRANSACTION_LOG = f"participant_{participant_index}_transactions.jsonl"
+    DATA_FILE = f"participant_{participant_index}.db"
+    COMPACT_BYTES = 4 * 1024 * 1024  # Rewrite the data file once it is half stale
+    GROUP_COMMIT_MAX_DELAY = 0.002  # Seconds to wait for more records per fsync
+    GROUP_COMMIT_MAX_BATCH = 128
+    CHECKPOINT_RECORDS = 10000  # Compact the log after this many records
+    CHECKPOINT_BYTES = 4 * 1024 * 1024  # ... or once it grows past this size
 
-    global participant_socket
-    participant_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    participant_socket.connect((SERVER_IP, SERVER_PORT))
+    data_store = KeyValueStore(DATA_FILE, compact_bytes=COMPACT_BYTES)
+    transaction_store = TransactionStore(
+        TRANSACTION_LOG,
+        max_batch_delay=GROUP_COMMIT_MAX_DELAY,
+        max_batch_size=GROUP_COMMIT_MAX_BATCH,
+        checkpoint_records=CHECKPOINT_RECORDS,
+        checkpoint_bytes=CHECKPOINT_BYTES,
+        before_checkpoint=data_store.sync,
+    )
+    redo_commits(transaction_store, data_store)
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.connect((SERVER_IP, SERVER_PORT))
+    # Frames are small and each waits for a reply, Nagle would hold them back
+    server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     print(f"Participant {participant_index} connected to the server.")
 
-    participant_socket.settimeout(30)
+    if direct:
+        # Register our own address so the coordinator can connect to us and
+        # bypass the server, which then only keeps track of membership
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.bind((SERVER_IP, 0))
+        listen_socket.listen(1)
+        host, port = listen_socket.getsockname()
+        server_socket.sendall(encode_frame(REGISTER, payload=f"{host}:{port}"))
+        participant_socket, _ = listen_socket.accept()
+        participant_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        listen_socket.close()
+        print(f"Participant {participant_index} connected to the coordinator.")
+    else:
+        server_socket.sendall(encode_frame(REGISTER))
+        participant_socket = server_socket
+
+    acceptors = None
+    if protocol == "paxos-commit":
+        acceptors = AcceptorGroup(
+            acceptor_addresses(acceptor_count), participant_index
+        )
+        acceptors.start()
 
-    handle_incoming_messages(participant_index)
+    replies = ReplySender(participant_socket)
+    participant = Participant(
+        participant_index,
+        data_store,
+        transaction_store,
+        replies,
+        simulate_failure,
+        protocol,
+        abort_rate,
+        read_only_rate,
+        cooperative,
+        termination_timeout,
+        acceptors,
+    )
+    participant.handle_incoming_messages(participant_socket)
 
+    replies.close()
+    if acceptors is not None:
+        participant.votes_out.close()
+        acceptors.close()
     participant_socket.close()
+    server_socket.close()
+    print(f"Log group commit stats: {transaction_store.stats()}")
+    print(f"Data store stats: {data_store.stats()}")
+    print(f"Lock manager stats: {participant.locks.stats()}")
+    print(f"Vote stats: {participant.vote_stats()}")
+    transaction_store.close()
+    data_store.close()
     print(f"Participant {participant_index} socket closed.")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Error: Missing participant index as a command-line argument.")
-        print("Usage: python3 participant.py <participant_index>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="2PC participant")
+    parser.add_argument("participant_index", type=int, help="e.g. 1, 2")
+    parser.add_argument(
+        "--simulate-failure",
+        action="store_true",
+        help="stop for 35 s after replying 'Yes', as if the participant had failed",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="accept a direct connection from the coordinator",
+    )
+    parser.add_argument(
+        "--protocol",
+        choices=PROTOCOLS,
+        default="basic",
+        help="commit protocol variant, must match the coordinator",
+    )
+    parser.add_argument(
+        "--abort-rate",
+        type=float,
+        default=0.0,
+        help="fraction of prepares to vote 'Abort' on, for abort-heavy workloads",
+    )
+    parser.add_argument(
+        "--read-only-rate",
+        type=float,
+        default=0.0,
+        help="fraction of prepares with nothing to commit, answered 'ReadOnly'",
+    )
+    parser.add_argument(
+        "--cooperative",
+        action="store_true",
+        help="ask the other participants for the outcome when in doubt",
+    )
+    parser.add_argument(
+        "--termination-timeout-ms",
+        type=float,
+        default=1000,
+        help="three-phase and paxos-commit: time in doubt before participants "
+        "terminate a transaction, until the coordinator's pace has been learned",
+    )
+    parser.add_argument(
+        "--acceptors",
+        type=int,
+        default=3,
+        help="paxos-commit: number of acceptors (2F+1) to send the votes to",
+    )
+    args = parser.parse_args()
+    if args.direct and (args.cooperative or args.protocol == "three-phase"):
+        parser.error(
+            "--cooperative and three-phase reach the other participants via the relay"
+        )
 
-    participant_index = int(sys.argv[1])
-    start_participant(participant_index)
+    start_participant(
+        args.participant_index,
+        simulate_failure=args.simulate_failure,
+        direct=args.direct,
+        protocol=args.protocol,
+        abort_rate=args.abort_rate,
+        read_only_rate=args.read_only_rate,
+        cooperative=args.cooperative,
+        termination_timeout=args.termination_timeout_ms / 1000,
+        acceptor_count=args.acceptors,
+    )
@@ -0,0 +1,209 @@
+import socket
+import threading
+import time
+
+from framing import (
+    PAXOS_ACCEPT,
+    PAXOS_ACCEPTED,
+    PAXOS_PREPARE,
+    PAXOS_PROMISE,
+    REGISTER,
+    FrameReader,
+    encode_frame,
+)
+
+ACCEPTOR_PORT = 12350  # Acceptor i listens on ACCEPTOR_PORT + i
+NOTHING_ACCEPTED = (-1, "-")  # Accepted ballot and value of a fresh instance
+
+
+def acceptor_addresses(count, host="127.0.0.1"):
+    """The addresses of acceptors 1 to count."""
+    return [(host, ACCEPTOR_PORT + index) for index in range(1, count + 1)]
+
+
+def encode_accept(transaction_id, participant, ballot, vote):
+    """Phase 2a: asks the acceptors to accept a vote for a participant's instance."""
+    return encode_frame(PAXOS_ACCEPT, transaction_id, f"{ballot} {vote}", participant)
+
+
+def parse_accepted(payload):
+    """Decodes a phase 2b payload into the acceptor index, ballot and vote."""
+    acceptor, ballot, vote = payload.decode().split(" ", 2)
+    return int(acceptor), int(ballot), vote
+
+
+def parse_promise(payload):
+    """Decodes a phase 1b payload: acceptor, ballot, accepted ballot and value."""
+    acceptor, ballot, accepted_ballot, value = payload.decode().split(" ", 3)
+    return int(acceptor), int(ballot), int(accepted_ballot), value
+
+
+def paxos_outcome(votes):
+    """Commit if every participant's chosen vote lets the transaction commit."""
+    return "Commit" if all(vote in ("Yes", "ReadOnly") for vote in votes) else "Abort"
+
+
+class AcceptorGroup:
+    """The connections of a coordinator or participant to the 2F+1 acceptors.
+
+    Paxos Commit runs one instance of Paxos per participant of a
+    transaction, whose value is that participant's vote. A participant
+    proposes its own vote in ballot 0 without a first phase, and the
+    acceptors report what they accepted in ballot 0 to the coordinator, which
+    learns a vote once a majority of them has accepted it. F acceptors can
+    fail without holding anything up.
+
+    Anyone with a group can ``terminate`` a transaction whose votes have not
+    all been learned with a higher ballot. It chooses the vote an acceptor
+    of the majority accepted in the highest ballot, which is the vote
+    chosen if one was, and Abort for an instance that nothing was accepted
+    for. Ballots are numbered from the clock and the node index, so every
+    proposer's are distinct and a later one is higher. An acceptor ignores a
+    ballot below one it promised, and the proposer tries again later.
+    """
+
+    def __init__(self, addresses, node_index, retry_for=10):
+        self.node_index = node_index  # 0 for the coordinator
+        self.majority = len(addresses) // 2 + 1
+        self.sockets = []
+        self.send_lock = threading.Lock()
+        self.changed = threading.Condition()
+        self.ballots = {}  # (transaction_id, ballot) -> {"promises", "accepted"}
+        self.last_ballot = 0
+        deadline = time.monotonic() + retry_for
+        for host, port in addresses:
+            while True:
+                try:
+                    sock = socket.create_connection((host, port))
+                    break
+                except ConnectionRefusedError as e:
+                    if time.monotonic() >= deadline:
+                        print(f"Acceptor at {host}:{port} is unreachable: {e}")
+                        sock = None
+                        break
+                    time.sleep(0.05)
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(encode_frame(REGISTER, participant=node_index))
+                self.sockets.append(sock)
+        if len(self.sockets) < self.majority:
+            raise ConnectionError("Fewer than a majority of the acceptors are up.")
+
+    def start(self, on_accepted=None):
+        """Starts a reader per acceptor; ballot 0 acceptances go to on_accepted."""
+        for sock in self.sockets:
+            threading.Thread(
+                target=self.receive, args=(sock, on_accepted), daemon=True
+            ).start()
+
+    def sendall(self, data):
+        """Sends encoded frames to every acceptor that is still connected."""
+        with self.send_lock:
+            for sock in list(self.sockets):
+                try:
+                    sock.sendall(data)
+                except OSError as e:
+                    print(f"Lost an acceptor: {e}")
+                    self.sockets.remove(sock)
+
+    def receive(self, sock, on_accepted):
+        reader = FrameReader(sock)
+        while True:
+            try:
+                frames = reader.read_frames()
+            except OSError:
+                return
+            if frames is None:
+                print("An acceptor closed the connection.")
+                return
+            for frame in frames:
+                if frame.frame_type == PAXOS_ACCEPTED:
+                    acceptor, ballot, vote = parse_accepted(frame.payload)
+                    if ballot == 0:
+                        if on_accepted is not None:
+                            on_accepted(frame)
+                        continue
+                    with self.changed:
+                        state = self.ballots.get((frame.transaction_id, ballot))
+                        if state is not None:
+                            state["accepted"][frame.participant].add(acceptor)
+                            self.changed.notify_all()
+                elif frame.frame_type == PAXOS_PROMISE:
+                    acceptor, ballot, accepted_ballot, value = parse_promise(
+                        frame.payload
+                    )
+                    with self.changed:
+                        state = self.ballots.get((frame.transaction_id, ballot))
+                        if state is not None:
+                            promises = state["promises"][frame.participant]
+                            promises[acceptor] = (accepted_ballot, value)
+                            self.changed.notify_all()
+
+    def next_ballot(self):
+        with self.changed:
+            self.last_ballot = max(self.last_ballot + 1, time.time_ns() // 1000)
+            return self.last_ballot * 65536 + self.node_index
+
+    def terminate(self, transaction_id, participants, timeout):
+        """Has the acceptors choose a vote for each of the given participants.
+
+        Returns {participant index: chosen vote}, or None if a majority of
+        the acceptors did not answer both phases within ``timeout`` seconds.
+        """
+        ballot = self.next_ballot()
+        key = (transaction_id, ballot)
+        state = {
+            "promises": {participant: {} for participant in participants},
+            "accepted": {participant: set() for participant in participants},
+        }
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            self.ballots[key] = state
+        try:
+            self.sendall(
+                b"".join(
+                    encode_frame(
+                        PAXOS_PREPARE, transaction_id, str(ballot), participant
+                    )
+                    for participant in participants
+                )
+            )
+            with self.changed:
+                if not self.changed.wait_for(
+                    lambda: all(
+                        len(promises) >= self.majority
+                        for promises in state["promises"].values()
+                    ),
+                    deadline - time.monotonic(),
+                ):
+                    return None
+                # The vote accepted in the highest ballot may have been chosen
+                votes = {}
+                for participant, promises in state["promises"].items():
+                    accepted_ballot, vote = max(promises.values())
+                    votes[participant] = vote if accepted_ballot >= 0 else "Abort"
+
+            self.sendall(
+                b"".join(
+                    encode_accept(transaction_id, participant, ballot, vote)
+                    for participant, vote in votes.items()
+                )
+            )
+            with self.changed:
+                if not self.changed.wait_for(
+                    lambda: all(
+                        len(accepted) >= self.majority
+                        for accepted in state["accepted"].values()
+                    ),
+                    deadline - time.monotonic(),
+                ):
+                    return None
+            return votes
+        finally:
+            with self.changed:
+                del self.ballots[key]
+
+    def close(self):
+        with self.send_lock:
+            for sock in self.sockets:
+                sock.close()
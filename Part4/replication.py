@@ -0,0 +1,284 @@
+import json
+import socket
+import threading
+import time
+
+from framing import (
+    EXIT,
+    HEARTBEAT,
+    REPLICATE,
+    REPLICATE_ACK,
+    FrameReader,
+    encode_frame,
+)
+from wal import TransactionStore, encode_record
+
+
+def encode_replicated(record):
+    return encode_frame(REPLICATE, record["transaction_id"], encode_record(record))
+
+
+class StandbyLink:
+    """The coordinator's connection to one hot standby."""
+
+    def __init__(self, sock, address, joined_at, snapshot_size):
+        self.sock = sock
+        self.name = f"{address[0]}:{address[1]}"
+        self.send_lock = threading.Lock()
+        # The standby acknowledges the number of records it has made durable,
+        # starting with the snapshot of the transactions logged before it joined
+        self.joined_at = joined_at
+        self.snapshot_size = snapshot_size
+        self.acked = 0
+        self.last_heard = time.monotonic()
+        self.closed = threading.Event()
+
+    def replicated(self):
+        """Number of the coordinator's records the standby has made durable."""
+        return self.joined_at + self.acked - self.snapshot_size
+
+    def send(self, data):
+        with self.send_lock:
+            self.sock.sendall(data)
+
+
+class ReplicatedTicket:
+    """Commit ticket of a record that must be durable at the standbys as well."""
+
+    def __init__(self, transaction_store, sequence, local_ticket):
+        self.transaction_store = transaction_store
+        self.sequence = sequence
+        self.local_ticket = local_ticket
+
+    def wait(self, timeout=None):
+        self.local_ticket.wait(timeout)
+        self.transaction_store.wait_for_standbys(self.sequence, timeout)
+
+
+class ReplicatedTransactionStore(TransactionStore):
+    """A coordinator's transaction store, mirrored to hot standbys.
+
+    Standbys connect to ``port``, get a snapshot of the table and then every
+    record in the order it is written. The ticket of a forced record is only
+    released once every standby has made the record durable too, so anything
+    the coordinator acts on survives a failover. Other records are shipped
+    without waiting, as they are written locally without an fsync. A record
+    is in the transaction table before the standbys have it, so nothing may
+    be sent on the strength of a forced record until its ticket is released.
+
+    Four heartbeats per ``lease`` renew the coordinator's lease at each
+    standby, which takes over once it has not heard from the coordinator for
+    a whole lease. A standby that has acknowledged nothing for two leases is
+    told to stand down and dropped, so that a hung standby cannot hold up the
+    coordinator; had it been cut off instead, it would have taken over by
+    then and the server would no longer relay this coordinator's messages.
+    """
+
+    def __init__(self, file_path, port, lease=0.5, host="127.0.0.1", **options):
+        super().__init__(file_path, **options)
+        self.lease = lease
+        self.sequence = 0  # Records written so far
+        self.links = []
+        self.changed = threading.Condition()
+        self.stopped = threading.Event()
+        self.listener = socket.create_server((host, port))
+        self.listener.settimeout(lease)
+        threading.Thread(target=self.accept_standbys, daemon=True).start()
+        threading.Thread(target=self.renew_leases, daemon=True).start()
+        print(f"Replicating the log to standbys connecting on port {port}.")
+
+    def write(self, record, force=True):
+        """Records a change and ships it to the standbys, returns its ticket."""
+        with self.changed:
+            ticket = super().write(record, force)
+            self.sequence += 1
+            data = encode_replicated(record)
+            for link in list(self.links):
+                try:
+                    link.send(data)
+                except OSError as e:
+                    self.drop(link, f"failed ({e})")
+            if force and self.links:
+                return ReplicatedTicket(self, self.sequence, ticket)
+            return ticket
+
+    def wait_for_standbys(self, sequence, timeout=None):
+        """Blocks until every standby has the first ``sequence`` records on disk."""
+        with self.changed:
+            if not self.changed.wait_for(
+                lambda: all(link.replicated() >= sequence for link in self.links),
+                timeout,
+            ):
+                raise TimeoutError("Timed out waiting for the standbys.")
+
+    def accept_standbys(self):
+        while not self.stopped.is_set():
+            try:
+                sock, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # A standby that stops reading must not block the writes for good
+            sock.settimeout(2 * self.lease)
+            with self.changed:
+                snapshot = self.transactions()
+                link = StandbyLink(sock, address, self.sequence, len(snapshot))
+                try:
+                    link.send(b"".join(map(encode_replicated, snapshot)))
+                except OSError:
+                    sock.close()
+                    continue
+                self.links.append(link)
+            print(f"Standby {link.name} connected, sent {len(snapshot)} transactions.")
+            threading.Thread(
+                target=self.receive_acks, args=(link,), daemon=True
+            ).start()
+
+    def receive_acks(self, link):
+        reader = FrameReader(link.sock)
+        try:
+            while True:
+                try:
+                    frames = reader.read_frames(self.lease)
+                except socket.timeout:
+                    if link in self.links:
+                        continue
+                    return  # Dropped, and it has not hung up within a lease
+                except OSError as e:
+                    with self.changed:
+                        self.drop(link, f"failed ({e})")
+                    return
+                with self.changed:
+                    if frames is None:
+                        self.drop(link, "closed the connection")
+                        return
+                    if link not in self.links:
+                        continue  # Dropped, reading on until it hangs up
+                    for frame in frames:
+                        if frame.frame_type == REPLICATE_ACK:
+                            link.acked = int(frame.payload)
+                    link.last_heard = time.monotonic()
+                    self.changed.notify_all()
+        finally:
+            link.sock.close()
+            link.closed.set()
+
+    def renew_leases(self):
+        """Heartbeats every standby, and drops those that stopped acknowledging."""
+        while not self.stopped.wait(self.lease / 4):
+            with self.changed:
+                now = time.monotonic()
+                for link in list(self.links):
+                    if now - link.last_heard > 2 * self.lease:
+                        silence = (now - link.last_heard) * 1000
+                        self.drop(link, f"acknowledged nothing for {silence:.0f} ms")
+                        continue
+                    try:
+                        link.send(encode_frame(HEARTBEAT, payload=str(self.sequence)))
+                    except OSError as e:
+                        self.drop(link, f"failed ({e})")
+
+    def drop(self, link, reason):
+        """Stands a standby down and stops replicating to it; holds ``changed``."""
+        if link not in self.links:
+            return
+        self.links.remove(link)
+        # Closing the socket with acknowledgements still unread would reset the
+        # connection, and the standby could lose the EXIT and take over. The
+        # socket is closed by ``receive_acks`` once the standby has hung up.
+        try:
+            link.send(encode_frame(EXIT))
+            link.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass  # It is gone already
+        print(f"Standby {link.name} {reason}, no longer replicating to it.")
+        self.changed.notify_all()
+
+    def close(self):
+        """Stands every standby down, then closes the log."""
+        self.stopped.set()
+        self.listener.close()
+        with self.changed:
+            links = list(self.links)
+            for link in links:
+                self.drop(link, "stood down")
+        for link in links:
+            link.closed.wait(self.lease)
+        super().close()
+
+
+class StandbyReplica:
+    """A hot standby's copy of the coordinator's log.
+
+    Every record the coordinator ships is written to the standby's own
+    transaction store, and each read is acknowledged once it is durable.
+    Anything the coordinator sends renews its lease. The standby takes over
+    when the lease runs out, or at once when the connection closes without
+    the coordinator standing it down first, as its process is then gone.
+    """
+
+    def __init__(self, transaction_store, address, lease=0.5, retry_for=10):
+        self.transaction_store = transaction_store
+        self.lease = lease
+        deadline = time.monotonic() + retry_for
+        while True:
+            try:
+                self.sock = socket.create_connection(address)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.applied = 0
+        self.last_heard = time.monotonic()
+        self.take_over = False
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+        print(f"Standing by for the coordinator at {address[0]}:{address[1]}.")
+
+    def start(self):
+        self.thread.start()
+
+    def wait(self):
+        """Blocks until the standby is stood down, or is to take over (True)."""
+        self.thread.join()
+        return self.take_over
+
+    def follow(self):
+        reader = FrameReader(self.sock)
+        try:
+            while True:
+                remaining = self.last_heard + self.lease - time.monotonic()
+                try:
+                    frames = reader.read_frames(max(remaining, 0))
+                except socket.timeout:
+                    print(f"Coordinator lease of {self.lease * 1000:.0f} ms expired.")
+                    break
+                if frames is None:
+                    print("Coordinator closed the replication connection.")
+                    break
+                self.last_heard = time.monotonic()
+
+                ticket = None
+                for frame in frames:
+                    if frame.frame_type == EXIT:
+                        return
+                    if frame.frame_type == REPLICATE:
+                        ticket = self.transaction_store.write(json.loads(frame.payload))
+                        self.applied += 1
+                if ticket is not None:
+                    try:
+                        ticket.wait()  # Earlier records are durable by then too
+                    except Exception as e:
+                        print(f"Standby cannot write its log, giving up: {e}")
+                        return
+                self.sock.sendall(
+                    encode_frame(REPLICATE_ACK, payload=str(self.applied))
+                )
+        except OSError as e:
+            print(f"Replication connection to the coordinator failed: {e}")
+        finally:
+            self.sock.close()
+        self.take_over = True
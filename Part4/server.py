@@ -1,14 +1,140 @@
+import argparse
+import asyncio
 import socket
-from multiprocessing import Process, Queue
+import threading
+from multiprocessing import Lock, Process, Queue, Value
+
+from framing import (
+    COMMIT_ONE_PHASE,
+    DECISION,
+    DECISION_BATCH,
+    EXIT,
+    HEARTBEAT,
+    HEARTBEAT_ACK,
+    MEMBERSHIP,
+    PARTICIPANT_COUNT,
+    PEER_FRAMES,
+    PREPARE,
+    PREPARE_BATCH,
+    PRE_COMMIT,
+    READY,
+    REGISTER,
+    REQUEST_DECISION,
+    STANDBY,
+    TAKE_OVER,
+    FrameBuffer,
+    FrameReader,
+    describe_frame,
+    encode_frame,
+    encode_membership,
+)
+from failure_detector import FailureDetector
+
+# Frames the coordinator sends that are relayed to participants
+RELAYED_FRAMES = {
+    PREPARE,
+    DECISION,
+    REQUEST_DECISION,
+    PREPARE_BATCH,
+    DECISION_BATCH,
+    COMMIT_ONE_PHASE,
+    PRE_COMMIT,
+    HEARTBEAT,
+}
+COORDINATOR = 0  # Failure detector node of the coordinator
+
+
+def recipients(frame, participant_count):
+    """Queue indexes a coordinator frame goes to: one participant, or all if 0."""
+    if frame.participant:
+        if frame.participant <= participant_count:
+            return [frame.participant - 1]
+        return []
+    return range(participant_count)
+
+
+def peer_index(frame, participant_count):
+    """Queue index of the participant a peer frame is for, or None if unknown."""
+    if 0 < frame.participant <= participant_count:
+        return frame.participant - 1
+    return None
+
+
+def observe_frames(detector, node, frames, name):
+    """Tells the failure detector that the frames of one read came from node."""
+    if any(frame.frame_type in (HEARTBEAT, HEARTBEAT_ACK) for frame in frames):
+        revived = detector.heartbeat_received(node)
+    else:
+        revived = detector.heard_from(node)
+    if revived:
+        print(f"{name} is reachable again.")
+
+
+def report_silence(detector, node, name):
+    """Suspects a node whose heartbeats stopped for longer than it usually takes.
+
+    Nodes that never sent a heartbeat through the server, such as those
+    connected directly, are not watched.
+    """
+    if detector.heartbeat_seen(node) and detector.check([node]):
+        timeout = detector.suspicion_timeout(node)
+        print(f"{name} suspected after {timeout * 1000:.0f} ms of silence.")
+
+
+def coordinator_name(coordinator):
+    return "Coordinator" if coordinator == 0 else f"Standby coordinator {coordinator}"
+
+
+def shut_down(sock):
+    """Ends a connection for every process that shares the socket."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed by the other side
+
+
+def parse_registration(frame):
+    """Listening address a participant registered, or None if it uses the relay."""
+    if frame.frame_type != REGISTER or not frame.payload:
+        return None
+    host, port = frame.payload.decode().rsplit(":", 1)
+    return host, int(port)
 
 
 class DistributedServer:
-    def __init__(self, server_ip="127.0.0.1", server_port=12346):
+    """Relays between the coordinator and the participants, a process per connection.
+
+    Standby coordinators, ``standby_count`` of them, connect along with the
+    participants. The server relays for one coordinator at a time: the one
+    that connected first, until a standby sends TAKE_OVER. From then on the
+    participants' replies go to that standby, and the connection of the
+    coordinator it replaced is shut down, so a coordinator that was only
+    slow cannot interfere. A coordinator that fails does not shut the
+    participants down while a standby can still take over.
+    """
+
+    def __init__(
+        self,
+        server_ip="127.0.0.1",
+        server_port=12346,
+        standby_count=0,
+        participant_count=None,
+    ):
         self.server_ip = server_ip
         self.server_port = server_port
+        self.standby_count = standby_count
+        self.participant_count = participant_count  # Asked for once if None
         self.server_socket = None
-        self.coordinator_socket = None
+        self.coordinator_sockets = []  # The first coordinator, then the standbys
+        self.coordinator_readers = []
+        self.active = Value("i", 0, lock=False)  # Index of the coordinator relayed
+        self.open_coordinators = Value("i", 0)
+        # The participant processes all write to the coordinator's socket, and
+        # a sendall that blocks can be interleaved with another one
+        self.coordinator_write_lock = Lock()
         self.participants = []
+        self.participant_readers = []
+        self.members = {}  # participant index -> address for direct connections
         self.participant_message_queues = []
 
     def start_server(self):
@@ -21,141 +147,531 @@ class DistributedServer:
         print("Server is listening for connections...")
 
         # Accept coordinator connection
-        self.coordinator_socket, _ = self.server_socket.accept()
+        coordinator_socket, _ = self.server_socket.accept()
+        # Every relayed frame is small and waits for a reply, so Nagle's
+        # algorithm would hold it back for the peer's delayed ACK
+        coordinator_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.coordinator_sockets.append(coordinator_socket)
+        self.coordinator_readers.append(FrameReader(coordinator_socket))
         print("Coordinator connected.")
 
         # Prompt for number of participants after coordinator connects
-        participant_count = int(input("Enter the number of participants: "))
+        participant_count = self.participant_count
+        if participant_count is None:
+            participant_count = int(input("Enter the number of participants: "))
         print(f"Waiting for {participant_count} participant(s) to connect...")
 
         # Send the number of participants to the coordinator first
-        self.coordinator_socket.sendall(str(participant_count).encode())
+        coordinator_socket.sendall(
+            encode_frame(PARTICIPANT_COUNT, payload=str(participant_count))
+        )
 
-        # Accept participant connections
-        for i in range(participant_count):
-            participant_socket, _ = self.server_socket.accept()
-            print(f"Participant {i + 1} connected.")
-            self.participants.append(participant_socket)
+        # Accept participant connections, each registers before anything else,
+        # and the standby coordinators, which announce themselves instead
+        while (
+            len(self.participants) < participant_count
+            or len(self.coordinator_sockets) <= self.standby_count
+        ):
+            connection, _ = self.server_socket.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = FrameReader(connection)
+            frames = []
+            while not frames:
+                frames = reader.read_frames()
+                if frames is None:
+                    break
+            if frames and frames[0].frame_type == STANDBY:
+                print(f"{coordinator_name(len(self.coordinator_sockets))} connected.")
+                self.coordinator_sockets.append(connection)
+                self.coordinator_readers.append(reader)
+                continue
+            index = len(self.participants) + 1
+            address = parse_registration(frames[0]) if frames else None
+            if address is not None:
+                self.members[index] = address
+            print(f"Participant {index} connected.")
+            self.participants.append(connection)
+            self.participant_readers.append(reader)
 
-        # Send confirmation that all participants are connected
-        self.coordinator_socket.sendall(b"All participants connected")
+        # Send the participant addresses and confirmation that all are connected
+        handshake = encode_frame(
+            MEMBERSHIP, payload=encode_membership(self.members)
+        ) + encode_frame(READY)
+        coordinator_socket.sendall(handshake)
+        for standby_socket in self.coordinator_sockets[1:]:
+            standby_socket.sendall(
+                encode_frame(PARTICIPANT_COUNT, payload=str(participant_count))
+                + handshake
+            )
 
         # Create message queues for each participant
         self.participant_message_queues = [Queue() for _ in range(participant_count)]
 
-        # Start a process for the coordinator
-        coordinator_process = Process(target=self.handle_coordinator)
-        coordinator_process.start()
+        # Start a process for the coordinator and each standby
+        self.open_coordinators.value = len(self.coordinator_sockets)
+        coordinator_processes = []
+        for coordinator in range(len(self.coordinator_sockets)):
+            process = Process(target=self.handle_coordinator, args=(coordinator,))
+            process.start()
+            coordinator_processes.append(process)
 
         # Start processes for each participant
         participant_processes = []
         for i, participant_socket in enumerate(self.participants):
             process = Process(
                 target=self.handle_participant,
-                args=(participant_socket, i + 1, self.participant_message_queues[i]),
+                args=(
+                    participant_socket,
+                    self.participant_readers[i],
+                    i + 1,
+                    self.participant_message_queues[i],
+                ),
             )
             process.start()
             participant_processes.append(process)
 
         # Wait for all processes to complete
-        for process in participant_processes:
+        for process in participant_processes + coordinator_processes:
             process.join()
 
-        coordinator_process.join()
-
         # Close all participant sockets
         for participant_socket in self.participants:
             participant_socket.close()
 
         self.server_socket.close()
 
-    def handle_participant(self, participant_socket, participant_index, message_queue):
+    def handle_participant(
+        self, participant_socket, reader, participant_index, message_queue
+    ):
         """Handles communication with a single participant."""
-        participant_socket.settimeout(30)  # Set timeout for participant responses
+        # Replies are relayed by their own thread, so the next message can go
+        # out before the previous transaction is done
+        receiver = threading.Thread(
+            target=self.relay_participant_replies,
+            args=(reader, participant_index),
+            daemon=True,
+        )
+        receiver.start()
 
         while True:
-            try:
-                # Retrieve message from the queue
-                message = message_queue.get()
-                if message is None:
-                    print(f"Participant {participant_index} shutting down.")
-                    break  # Exit if None is received (shutdown signal)
+            # Retrieve message from the queue, along with any others waiting
+            frames = [message_queue.get()]
+            while frames[-1] is not None and not message_queue.empty():
+                frames.append(message_queue.get())
 
-                participant_socket.sendall(
-                    message.encode()
-                )  # Send message to participant
-                done_received = False
-
-                while not done_received:
-                    try:
-                        response = participant_socket.recv(1024).decode()
-
-                        # If we get an empty response, it indicates the socket is closed
-                        if not response:
-                            print(
-                                f"Participant {participant_index} closed the connection."
-                            )
-                            return
-
-                        if response.startswith("RequestDecision:"):
-                            decision_message = response.replace("RequestDecision:", "")
-                            message_queue.put(decision_message)
-                        else:
-                            reply = f"{participant_index}:{response}"
-                            print(
-                                f"Sending reply from participant {participant_index} to coordinator: {reply}"
-                            )
-                            # Correctly use the class member `self.coordinator_socket`
-                            self.coordinator_socket.sendall(reply.encode())
-
-                            if response.endswith(":done"):
-                                done_received = True
-                    except socket.timeout:
-                        print(
-                            f"Participant {participant_index} timed out waiting for responses."
-                        )
-                        break
-                    except ConnectionResetError:
-                        print(
-                            f"Participant {participant_index} connection reset by peer."
-                        )
-                        return
-                    except Exception as e:
-                        print(
-                            f"Error receiving response from participant {participant_index}: {e}"
-                        )
-                        return
+            shutdown = frames[-1] is None
+            if shutdown:
+                frames.pop()
 
+            try:
+                participant_socket.sendall(
+                    b"".join(frames)
+                )  # Send messages to participant
             except Exception as e:
                 print(f"Error processing participant {participant_index}: {e}")
                 break
 
+            if shutdown:
+                print(f"Participant {participant_index} shutting down.")
+                break  # Exit if None is received (shutdown signal)
+
         participant_socket.close()
 
-    def handle_coordinator(self):
-        """Handles communication with the coordinator."""
+    def relay_participant_replies(self, reader, participant_index):
+        """Relays a participant's replies to the coordinator, tagged with its index.
+
+        Frames for another participant go to that participant's queue instead.
+        """
+        name = f"Participant {participant_index}"
+        detector = FailureDetector()
+
+        while True:
+            try:
+                timeout = detector.suspicion_timeout(participant_index)
+                frames = reader.read_frames(timeout)
+            except socket.timeout:
+                report_silence(detector, participant_index, name)
+                continue  # Keep listening, the participant may come back
+            except ConnectionResetError:
+                print(f"Participant {participant_index} connection reset by peer.")
+                return
+            except Exception as e:
+                print(
+                    f"Error receiving response from participant {participant_index}: {e}"
+                )
+                return
+
+            # None indicates the socket is closed
+            if frames is None:
+                print(f"Participant {participant_index} closed the connection.")
+                return
+
+            observe_frames(detector, participant_index, frames, name)
+            queues = self.participant_message_queues
+            replies = []
+            for frame in frames:
+                reply = frame._replace(participant=participant_index)
+                if frame.frame_type in PEER_FRAMES:
+                    index = peer_index(frame, len(queues))
+                    if index is not None:
+                        print(
+                            f"Relaying from participant {participant_index} "
+                            f"to participant {index + 1}: {describe_frame(reply)}"
+                        )
+                        queues[index].put(encode_frame(*reply))
+                    continue
+                replies.append(encode_frame(*reply))
+                if frame.frame_type == HEARTBEAT_ACK:
+                    continue
+                print(
+                    f"Sending reply from participant {participant_index} "
+                    f"to coordinator: {describe_frame(reply)}"
+                )
+            if not replies:
+                continue
+            try:
+                with self.coordinator_write_lock:
+                    coordinator_socket = self.coordinator_sockets[self.active.value]
+                    coordinator_socket.sendall(b"".join(replies))
+            except OSError as e:
+                # The coordinator failed; a standby that takes over resends the
+                # decisions, and is asked again for the missing ones
+                print(f"Dropped replies of participant {participant_index}: {e}")
+
+    def handle_coordinator(self, coordinator):
+        """Handles communication with the coordinator, or with a standby."""
+        coordinator_socket = self.coordinator_sockets[coordinator]
+        reader = self.coordinator_readers[coordinator]
+        name = coordinator_name(coordinator)
+        detector = FailureDetector()
+        exited = False
         try:
             while True:
-                message = self.coordinator_socket.recv(1024).decode()
-                if not message:
-                    print("Coordinator closed the connection.")
+                try:
+                    frames = reader.read_frames(detector.suspicion_timeout(COORDINATOR))
+                except socket.timeout:
+                    if self.active.value == coordinator:
+                        report_silence(detector, COORDINATOR, name)
+                    continue
+                if frames is None:
+                    print(f"{name} closed the connection.")
                     break  # Break on empty message (shutdown signal)
+                if any(frame.frame_type == TAKE_OVER for frame in frames):
+                    self.take_over(coordinator)
+                if self.active.value != coordinator:
+                    continue  # Nothing is relayed for a standby
+                observe_frames(detector, COORDINATOR, frames, name)
 
-                # Forward only transaction messages to participants
-                if (
-                    message.startswith("Decision:")
-                    or message.startswith("RequestDecision:")
-                    or ";" in message
-                ):
-                    for queue in self.participant_message_queues:
-                        queue.put(message)  # Send decision to all participants
+                # Forward only transaction messages to participants, and those
+                # read together with an exit before stopping: a presumed
+                # outcome is not acknowledged, so its coordinator may not wait
+                for frame in frames:
+                    if frame.frame_type == EXIT:
+                        exited = True
+                        break
+                    if frame.frame_type not in RELAYED_FRAMES:
+                        continue
+                    data = encode_frame(*frame)
+                    queues = self.participant_message_queues
+                    for index in recipients(frame, len(queues)):
+                        queues[index].put(data)
+                if exited:
+                    print(f"{name} exited.")
+                    break
 
         except Exception as e:
-            print(f"Error receiving message from coordinator: {e}")
+            print(f"Error receiving message from {name.lower()}: {e}")
         finally:
-            self.coordinator_socket.close()
+            with self.open_coordinators.get_lock():
+                self.open_coordinators.value -= 1
+                remaining = self.open_coordinators.value
+            if exited:
+                # Let the standbys go as well
+                for other in self.coordinator_sockets:
+                    if other is not coordinator_socket:
+                        shut_down(other)
+            coordinator_socket.close()
+            if exited or not remaining:
+                for queue in self.participant_message_queues:
+                    queue.put(None)
+            elif self.active.value == coordinator:
+                print("Waiting for a standby to take over.")
+
+    def take_over(self, coordinator):
+        """Relays for a standby from now on and cuts off the coordinator it replaces."""
+        replaced = self.active.value
+        self.active.value = coordinator
+        print(
+            f"{coordinator_name(coordinator)} took over, cutting off "
+            f"{coordinator_name(replaced).lower()}."
+        )
+        shut_down(self.coordinator_sockets[replaced])
+
+
+class AsyncDistributedServer:
+    """Event-loop version of ``DistributedServer``.
+
+    All connections are served by one asyncio loop instead of a process per
+    role, and messages go straight from one socket to another without passing
+    through a ``multiprocessing.Queue``. The relay semantics are the same:
+    transaction messages from the coordinator are broadcast to every
+    participant, and participant replies are tagged with the participant's
+    index and forwarded to the coordinator, or to the participant they are
+    for, and standbys take over in the same way. Only connection events are
+    logged, so that relaying for thousands of participants is not bound by
+    printing.
+    """
+
+    def __init__(
+        self,
+        server_ip="127.0.0.1",
+        server_port=12346,
+        standby_count=0,
+        participant_count=None,
+    ):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.standby_count = standby_count
+        self.participant_count = participant_count  # Asked for once if None
+        self.coordinator_writers = []  # The first coordinator, then the standbys
+        self.active = 0  # Index of the coordinator relayed
+        self.open_coordinators = 0
+        self.finished = None
+        self.participant_writers = []
+        self.members = {}  # participant index -> address for direct connections
+        self.detector = FailureDetector()
+
+    def start_server(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        connections = asyncio.Queue()
+
+        async def accept(reader, writer):
+            await connections.put((reader, writer))
+
+        server = await asyncio.start_server(
+            accept, self.server_ip, self.server_port, reuse_address=True, backlog=4096
+        )
+        print("Server is listening for connections...")
+
+        # Accept coordinator connection
+        coordinator_reader, coordinator_writer = await connections.get()
+        coordinator_readers = [coordinator_reader]
+        self.coordinator_writers.append(coordinator_writer)
+        print("Coordinator connected.")
+
+        # Prompt for number of participants after coordinator connects
+        participant_count = self.participant_count
+        if participant_count is None:
+            loop = asyncio.get_running_loop()
+            participant_count = int(
+                await loop.run_in_executor(
+                    None, input, "Enter the number of participants: "
+                )
+            )
+        print(f"Waiting for {participant_count} participant(s) to connect...")
+
+        # Send the number of participants to the coordinator first
+        count_frame = encode_frame(PARTICIPANT_COUNT, payload=str(participant_count))
+        coordinator_writer.write(count_frame)
+        await coordinator_writer.drain()
+
+        # Accept participant connections, each registers before anything else,
+        # and the standby coordinators, which announce themselves instead
+        participant_tasks = []
+        while (
+            len(self.participant_writers) < participant_count
+            or len(self.coordinator_writers) <= self.standby_count
+        ):
+            reader, writer = await connections.get()
+            frame_buffer = FrameBuffer()
+            frames = []
+            while not frames:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                frames = frame_buffer.feed(data)
+            if frames and frames[0].frame_type == STANDBY:
+                print(f"{coordinator_name(len(self.coordinator_writers))} connected.")
+                coordinator_readers.append(reader)
+                self.coordinator_writers.append(writer)
+                continue
+            index = len(self.participant_writers) + 1
+            address = parse_registration(frames[0]) if frames else None
+            if address is not None:
+                self.members[index] = address
+            print(f"Participant {index} connected.")
+            self.participant_writers.append(writer)
+            participant_tasks.append(
+                asyncio.create_task(
+                    self.relay_participant_replies(reader, frame_buffer, index)
+                )
+            )
+
+        # Send the participant addresses and confirmation that all are connected
+        handshake = encode_frame(
+            MEMBERSHIP, payload=encode_membership(self.members)
+        ) + encode_frame(READY)
+        for index, writer in enumerate(self.coordinator_writers):
+            writer.write(handshake if index == 0 else count_frame + handshake)
+            await writer.drain()
+
+        self.finished = asyncio.Event()
+        self.open_coordinators = len(coordinator_readers)
+        coordinator_tasks = [
+            asyncio.create_task(self.relay_coordinator_messages(coordinator, reader))
+            for coordinator, reader in enumerate(coordinator_readers)
+        ]
+        await self.finished.wait()
+
+        # Coordinator is gone, close every participant and standby connection
+        for writer in self.participant_writers + self.coordinator_writers:
+            writer.close()
+        await asyncio.gather(
+            *participant_tasks, *coordinator_tasks, return_exceptions=True
+        )
+        server.close()
+        await server.wait_closed()
+
+    async def relay_coordinator_messages(self, coordinator, coordinator_reader):
+        """Relays every transaction frame of a coordinator while it is active."""
+        name = coordinator_name(coordinator)
+        frame_buffer = FrameBuffer()
+        participant_count = len(self.participant_writers)
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    coordinator_reader.read(65536),
+                    self.detector.suspicion_timeout(COORDINATOR),
+                )
+            except asyncio.TimeoutError:
+                if self.active == coordinator:
+                    report_silence(self.detector, COORDINATOR, name)
+                continue
+            except ConnectionError as e:
+                print(f"Error receiving message from {name.lower()}: {e}")
+                break
+            if not data:
+                print(f"{name} closed the connection.")
+                break
+
+            frames = frame_buffer.feed(data)
+            if any(frame.frame_type == TAKE_OVER for frame in frames):
+                replaced = self.active
+                self.active = coordinator
+                print(
+                    f"{name} took over, cutting off "
+                    f"{coordinator_name(replaced).lower()}."
+                )
+                self.coordinator_writers[replaced].close()
+            if self.active != coordinator:
+                continue  # Nothing is relayed for a standby
+            observe_frames(self.detector, COORDINATOR, frames, name)
+
+            # As in process mode, what came before an exit is relayed first
+            exited = False
+            outgoing = {}
+            for frame in frames:
+                if frame.frame_type == EXIT:
+                    exited = True
+                    break
+                if frame.frame_type not in RELAYED_FRAMES:
+                    continue
+                encoded = encode_frame(*frame)
+                for index in recipients(frame, participant_count):
+                    outgoing.setdefault(index, []).append(encoded)
+
+            for index, encoded_frames in outgoing.items():
+                participant_writer = self.participant_writers[index]
+                if not participant_writer.is_closing():
+                    participant_writer.write(b"".join(encoded_frames))
+            for index in outgoing:
+                participant_writer = self.participant_writers[index]
+                if not participant_writer.is_closing():
+                    await participant_writer.drain()
+            if exited:
+                print(f"{name} exited.")
+                self.finished.set()
+                break
+
+        self.coordinator_writers[coordinator].close()
+        self.open_coordinators -= 1
+        if not self.open_coordinators:
+            self.finished.set()
+        elif self.active == coordinator and not self.finished.is_set():
+            print("Waiting for a standby to take over.")
+
+    async def relay_participant_replies(
+        self, participant_reader, frame_buffer, participant_index
+    ):
+        """Forwards a participant's replies to the coordinator with its index."""
+        name = f"Participant {participant_index}"
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    participant_reader.read(65536),
+                    self.detector.suspicion_timeout(participant_index),
+                )
+            except asyncio.TimeoutError:
+                report_silence(self.detector, participant_index, name)
+                continue
+            except ConnectionError:
+                print(f"Participant {participant_index} connection reset by peer.")
+                return
+            if not data:
+                print(f"Participant {participant_index} closed the connection.")
+                return
+
+            frames = frame_buffer.feed(data)
+            observe_frames(self.detector, participant_index, frames, name)
+            replies = []
+            for frame in frames:
+                reply = encode_frame(*frame._replace(participant=participant_index))
+                if frame.frame_type not in PEER_FRAMES:
+                    replies.append(reply)
+                    continue
+                index = peer_index(frame, len(self.participant_writers))
+                if index is not None:
+                    peer_writer = self.participant_writers[index]
+                    if not peer_writer.is_closing():
+                        peer_writer.write(reply)
+            coordinator_writer = self.coordinator_writers[self.active]
+            if not replies or coordinator_writer.is_closing():
+                continue
+            coordinator_writer.write(b"".join(replies))
+            try:
+                await coordinator_writer.drain()
+            except ConnectionError:
+                pass  # A standby that takes over resends the decisions
 
 
 if __name__ == "__main__":
-    server = DistributedServer()
+    parser = argparse.ArgumentParser(description="2PC relay server")
+    parser.add_argument(
+        "--mode",
+        choices=["process", "asyncio"],
+        default="process",
+        help="one process per connection, or a single asyncio event loop",
+    )
+    parser.add_argument(
+        "--standbys",
+        type=int,
+        default=0,
+        help="standby coordinators to wait for, which can take over the relay",
+    )
+    parser.add_argument(
+        "--participants",
+        type=int,
+        help="number of participants to wait for, instead of asking for it",
+    )
+    args = parser.parse_args()
+
+    if args.mode == "asyncio":
+        server_class = AsyncDistributedServer
+    else:
+        server_class = DistributedServer
+    server = server_class(
+        standby_count=args.standbys, participant_count=args.participants
+    )
     server.start_server()
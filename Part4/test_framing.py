@@ -0,0 +1,43 @@
+import uuid
+
+from framing import (
+    DECISION,
+    PREPARE,
+    VOTE,
+    VOTE_BATCH,
+    Frame,
+    FrameBuffer,
+    encode_batch,
+    encode_frame,
+    expand_frame,
+)
+
+
+def test_frames_split_across_reads_are_reassembled():
+    transaction_id = uuid.uuid4().hex
+    data = encode_frame(PREPARE, transaction_id, b"prepare") + encode_frame(
+        VOTE, transaction_id, b"Yes", 2
+    )
+    frame_buffer = FrameBuffer()
+    frames = []
+    for i in range(0, len(data), 5):
+        frames.extend(frame_buffer.feed(data[i : i + 5]))
+    assert frames == [
+        Frame(PREPARE, transaction_id, b"prepare", 0),
+        Frame(VOTE, transaction_id, b"Yes", 2),
+    ]
+    assert frame_buffer.feed(encode_frame(DECISION)) == [Frame(DECISION, "", b"", 0)]
+
+
+def test_batch_frames_expand_into_single_frames():
+    entries = [(uuid.uuid4().hex, vote) for vote in ("Yes", "Abort", "ReadOnly")]
+    (frame,) = FrameBuffer().feed(encode_batch(VOTE, entries, participant=3))
+    assert frame.frame_type == VOTE_BATCH
+    assert expand_frame(frame) == [
+        Frame(VOTE, transaction_id, vote.encode(), 3)
+        for transaction_id, vote in entries
+    ]
+    # Frames that are not batches pass through
+    assert expand_frame(Frame(DECISION, "", b"Commit", 0)) == [
+        Frame(DECISION, "", b"Commit", 0)
+    ]
@@ -0,0 +1,40 @@
+from locks import DIED, GRANTED, WAITING, LockManager, LockRequest
+
+
+def test_shared_locks_are_shared_and_exclusive_ones_wait_in_order():
+    locks = LockManager()
+    assert locks.acquire(LockRequest("t1", reads=["k"], timestamp=1)) == (GRANTED, [])
+    assert locks.acquire(LockRequest("t2", reads=["k"], timestamp=2)) == (GRANTED, [])
+    assert locks.acquire(LockRequest("t3", writes=["k"], timestamp=3)) == (WAITING, [])
+    # A shared lock is compatible with the holders, but does not overtake the
+    # exclusive request waiting ahead of it
+    assert locks.acquire(LockRequest("t4", reads=["k"], timestamp=4)) == (WAITING, [])
+
+    assert locks.release("t1") == []
+    assert [request.transaction_id for request in locks.release("t2")] == ["t3"]
+    assert [request.transaction_id for request in locks.release("t3")] == ["t4"]
+    assert locks.stats()["held"] == 1
+    assert locks.stats()["waiting"] == 0
+
+
+def test_older_request_dies_against_a_younger_holder():
+    locks = LockManager()
+    locks.acquire(LockRequest("young", writes=["k"], timestamp=2))
+    assert locks.acquire(LockRequest("old", writes=["k"], timestamp=1)) == (DIED, [])
+    assert locks.stats()["waiting"] == 0
+    assert locks.stats()["died"] == 1
+
+
+def test_younger_waiter_is_wounded_by_an_older_request():
+    locks = LockManager()
+    locks.acquire(LockRequest("t1", writes=["k"], timestamp=1))
+    assert locks.acquire(LockRequest("t3", writes=["k"], timestamp=3)) == (WAITING, [])
+    # t2 waits for the older holder, and wounds the younger waiter ahead of it
+    assert locks.acquire(LockRequest("t2", writes=["k"], timestamp=2)) == (
+        WAITING,
+        ["t3"],
+    )
+
+    assert locks.release("t3") == []
+    assert [request.transaction_id for request in locks.release("t1")] == ["t2"]
+    assert locks.stats()["wounded"] == 1
@@ -0,0 +1,79 @@
+import json
+import socket
+import threading
+import time
+import uuid
+
+import pytest
+
+from failure_detector import HEARTBEAT_PAYLOAD
+from framing import DECISION, HEARTBEAT, REQUEST_DECISION, FrameReader, encode_frame
+from kvstore import KeyValueStore
+from participant import Participant
+from transport import ReplySender
+from wal import TransactionStore
+
+
+@pytest.mark.parametrize(
+    "protocol, decision, value",
+    [("presumed-abort", "Abort", None), ("presumed-commit", "Commit", "1")],
+)
+def test_restart_learns_presumed_outcome(tmp_path, protocol, decision, value):
+    """A Yes vote whose lazy outcome record was lost is resolved by asking."""
+    transaction_id = uuid.uuid4().hex
+    log_path = tmp_path / "participant_1_transactions.jsonl"
+    log_path.write_text(
+        json.dumps(
+            {
+                "transaction_id": transaction_id,
+                "reads": [],
+                "writes": {"x": "1"},
+                "timestamp": 1,
+                "participants": [1, 2],
+                "response": "Yes",
+                "status": "pending",
+            }
+        )
+        + "\n"
+    )
+    data_store = KeyValueStore(str(tmp_path / "participant_1.db"))
+    transaction_store = TransactionStore(str(log_path))
+    coordinator, participant_socket = socket.socketpair()
+    replies = ReplySender(participant_socket)
+    participant = Participant(
+        1, data_store, transaction_store, replies, protocol=protocol
+    )
+    assert participant.locks.stats()["held"] == 1
+
+    receiver = threading.Thread(
+        target=participant.handle_incoming_messages,
+        args=(participant_socket,),
+        daemon=True,
+    )
+    receiver.start()
+    coordinator.sendall(encode_frame(HEARTBEAT, payload=HEARTBEAT_PAYLOAD.pack(1)))
+    reader = FrameReader(coordinator)
+    # Well before the coordinator would be suspected, which asks as well
+    deadline = time.monotonic() + 1
+    requested = []
+    while not requested:
+        frames = reader.read_frames(max(deadline - time.monotonic(), 0))
+        requested = [frame for frame in frames if frame.frame_type == REQUEST_DECISION]
+    assert [frame.transaction_id for frame in requested] == [transaction_id]
+
+    # The coordinator has forgotten the transaction and answers with the
+    # presumed outcome
+    coordinator.sendall(encode_frame(DECISION, transaction_id, decision))
+    coordinator.shutdown(socket.SHUT_WR)
+    receiver.join(timeout=5)
+    replies.close()
+    coordinator.close()
+    participant_socket.close()
+
+    assert not receiver.is_alive()
+    assert transaction_store.get(transaction_id)["decision"] == decision
+    assert not transaction_store.is_pending(transaction_id)
+    assert participant.locks.stats()["held"] == 0
+    assert data_store.get("x") == value
+    transaction_store.close()
+    data_store.close()
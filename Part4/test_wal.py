@@ -0,0 +1,45 @@
+from wal import TransactionStore, read_records
+
+
+def test_checkpoint_keeps_only_unresolved_transactions(tmp_path):
+    log_path = str(tmp_path / "coordinator_transactions.jsonl")
+    store = TransactionStore(log_path, checkpoint_records=4)
+    store.write({"transaction_id": "a", "status": "pending"}).wait()
+    store.write({"transaction_id": "b", "status": "pending"}).wait()
+    store.write({"transaction_id": "b", "decision": "Commit"}).wait()
+    store.write({"transaction_id": "b", "status": "done"}).wait()
+    store.close()
+    assert store.stats()["checkpoints"] == 1
+
+    # The log is now a snapshot of the table, which replays to the same state
+    assert read_records(log_path) == [{"transaction_id": "a", "status": "pending"}]
+    store = TransactionStore(log_path)
+    assert store.pending_ids() == ["a"]
+    assert store.get("b") is None
+    store.close()
+
+
+def test_replay_ignores_a_torn_last_record(tmp_path):
+    log_path = str(tmp_path / "coordinator_transactions.jsonl")
+    store = TransactionStore(log_path)
+    store.write({"transaction_id": "a", "status": "pending"}).wait()
+    store.close()
+    with open(log_path, "a") as file:
+        file.write('{"transaction_id":"b","sta')
+
+    store = TransactionStore(log_path)
+    assert store.get("b") is None
+    # The torn tail is cut off, so the next record starts on a line of its own
+    store.write({"transaction_id": "a", "decision": "Abort"}).wait()
+    store.close()
+    assert read_records(log_path) == [
+        {"transaction_id": "a", "status": "pending"},
+        {"transaction_id": "a", "decision": "Abort"},
+    ]
+    store = TransactionStore(log_path)
+    assert store.get("a") == {
+        "transaction_id": "a",
+        "status": "pending",
+        "decision": "Abort",
+    }
+    store.close()
@@ -0,0 +1,143 @@
+import queue
+import socket
+import threading
+
+from framing import FrameReader
+
+
+class RelayTransport:
+    """Reaches every participant through the relay server on one connection.
+
+    The server fans frames out to the participants and tags their replies
+    with the participant index, so frames can be handed on as they are.
+    """
+
+    def __init__(self, server_socket, frame_reader):
+        self.server_socket = server_socket
+        self.frame_reader = frame_reader
+        self.send_lock = threading.Lock()
+
+    def send(self, data, participant=0):
+        """Sends encoded frames; the server routes them by their participant field."""
+        with self.send_lock:
+            self.server_socket.sendall(data)
+
+    def start(self, handle_frame):
+        """Starts delivering received frames to handle_frame on a reader thread."""
+        thread = threading.Thread(
+            target=receive_frames,
+            args=(self.frame_reader, 0, handle_frame),
+            daemon=True,
+        )
+        thread.start()
+
+    def close(self):
+        pass  # The server connection is owned by the caller
+
+
+class DirectTransport:
+    """Holds one connection per participant and bypasses the relay server.
+
+    The server is only used to learn the participants' addresses. Frames go
+    straight to the participant socket, and replies are tagged with the index
+    of the connection they arrived on.
+    """
+
+    def __init__(self, members):
+        self.sockets = {}
+        self.send_locks = {}
+        for participant_index, (host, port) in sorted(members.items()):
+            participant_socket = socket.create_connection((host, port))
+            participant_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sockets[participant_index] = participant_socket
+            self.send_locks[participant_index] = threading.Lock()
+
+    def send(self, data, participant=0):
+        """Sends encoded frames to one participant, or to all of them if 0."""
+        indexes = [participant] if participant else list(self.sockets)
+        for participant_index in indexes:
+            with self.send_locks[participant_index]:
+                self.sockets[participant_index].sendall(data)
+
+    def start(self, handle_frame):
+        """Starts one reader thread per participant connection."""
+        for participant_index, participant_socket in self.sockets.items():
+            thread = threading.Thread(
+                target=receive_frames,
+                args=(FrameReader(participant_socket), participant_index, handle_frame),
+                daemon=True,
+            )
+            thread.start()
+
+    def close(self):
+        for participant_socket in self.sockets.values():
+            participant_socket.close()
+
+
+class ReplySender:
+    """Sends replies once the log records they report are durable.
+
+    The reader hands a reply over together with the commit tickets it waits
+    for and goes on with the next frames, so transactions that do not
+    conflict are prepared and committed while earlier ones wait for their
+    fsync. Replies go out in the order they were handed over. Heartbeat
+    acks and decision requests wait for nothing and go out through ``send``.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, data):
+        with self.lock:
+            self.sock.sendall(data)
+
+    def send_after(self, tickets, data):
+        self.pending.put((tickets, data))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            tickets, data = item
+            try:
+                for ticket in tickets:
+                    ticket.wait()
+            except Exception as e:
+                # Whatever the log failed with, the records the reply reports
+                # are not durable, so it must not go out; later ones still may
+                print(f"Error logging the records of a reply: {e}")
+                continue
+            try:
+                self.send(data)
+            except OSError as e:
+                print(f"Error sending reply: {e}")
+
+    def close(self):
+        """Sends the replies still waiting for the log, then stops."""
+        self.pending.put(None)
+        self.thread.join()
+
+
+def receive_frames(frame_reader, participant_index, handle_frame):
+    """Reads frames until the connection closes, tagging them with participant_index."""
+    while True:
+        try:
+            frames = frame_reader.read_frames()
+        except OSError:
+            return
+        if frames is None:
+            if participant_index:
+                print(f"Participant {participant_index} closed the connection.")
+            else:
+                print("Server closed the connection.")
+            return
+
+        for frame in frames:
+            if participant_index:
+                frame = frame._replace(participant=participant_index)
+            handle_frame(frame)
@@ -0,0 +1,441 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+
+def encode_record(record):
+    """Encodes a log record as a single line of compact JSON."""
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def read_records(file_path):
+    """Reads log records in order, ignoring a torn record at the end of the file."""
+    records = []
+    if not os.path.exists(file_path):
+        return records
+
+    with open(file_path, "r") as file:
+        for line in file:
+            if not line.endswith("\n"):
+                break  # Partial write from a crash, the record never completed
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def truncate_torn_tail(file_path):
+    """Cuts off a partial last record so new appends start on a clean line."""
+    if not os.path.exists(file_path):
+        return
+
+    with open(file_path, "rb+") as file:
+        data = file.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def sync_directory(file_path):
+    """Makes the creation or rename of a file in its directory durable."""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TransactionLog:
+    """Append-only write-ahead log holding one JSON record per line.
+
+    A record carries a ``transaction_id`` plus the fields that changed, so a
+    prepare, a decision and a "done" are three small appends instead of three
+    rewrites of the whole file. Replaying the log merges the records of each
+    transaction back into the same dicts the JSON file used to hold.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        created = not os.path.exists(file_path)
+        truncate_torn_tail(file_path)
+        self.file = open(file_path, "a")
+        if created:
+            sync_directory(file_path)
+
+    def append(self, record):
+        """Appends a single record to the end of the log."""
+        self.file.write(encode_record(record))
+        self.file.flush()
+
+    def append_many(self, records):
+        """Appends several records with a single write."""
+        self.file.write("".join(encode_record(record) for record in records))
+        self.file.flush()
+
+    def sync(self):
+        """Forces everything appended so far to stable storage."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def size(self):
+        """Returns the current size of the log file in bytes."""
+        return self.file.tell()
+
+    def rewrite(self, records):
+        """Atomically replaces the whole log with the given records."""
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write("".join(encode_record(record) for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.file.close()
+        try:
+            os.replace(temp_path, self.file_path)
+            sync_directory(self.file_path)
+        finally:
+            # Appends go on to the old log if the replace failed
+            self.file = open(self.file_path, "a")
+
+    def close(self):
+        self.file.close()
+
+
+class CommitTicket:
+    """Handed back by the group commit writer, set once the record is on disk."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+    @classmethod
+    def completed(cls):
+        """A ticket for a change that needed no log record at all."""
+        ticket = cls()
+        ticket.event.set()
+        return ticket
+
+    def wait(self, timeout=None):
+        """Blocks until the record is durable and re-raises any write error."""
+        if not self.event.wait(timeout):
+            raise TimeoutError("Timed out waiting for the log to sync.")
+        if self.error is not None:
+            raise self.error
+
+
+class GroupCommitWriter:
+    """Makes records from many concurrent transactions durable with one fsync.
+
+    Appends are queued and a background thread drains the queue in batches:
+    it waits at most ``max_batch_delay`` seconds after the first record of a
+    batch for more to arrive, writes up to ``max_batch_size`` records in one
+    go, then fsyncs once and releases every waiter of the batch. The latency
+    of each batch, from the first append to the end of the fsync, is kept in
+    ``batch_latencies`` and summarised by ``stats()`` for tuning.
+
+    Records appended with ``force=False`` are written in the same way but do
+    not need an fsync of their own: a batch of only such records is left to
+    the next forced batch, or to ``close``, to reach the disk.
+
+    If a ``checkpoint`` callable is given, the writer compacts the log once
+    ``checkpoint_records`` records or ``checkpoint_bytes`` bytes have been
+    appended since the last checkpoint: the log is replaced by the records
+    the callable returns, which describe only the unresolved transactions.
+    """
+
+    def __init__(
+        self,
+        transaction_log,
+        max_batch_delay=0.002,
+        max_batch_size=128,
+        checkpoint=None,
+        checkpoint_records=10000,
+        checkpoint_bytes=4 * 1024 * 1024,
+    ):
+        self.transaction_log = transaction_log
+        self.max_batch_delay = max_batch_delay
+        self.max_batch_size = max_batch_size
+        self.checkpoint = checkpoint
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint_bytes = checkpoint_bytes
+        self.records_since_checkpoint = 0
+        self.size_after_checkpoint = transaction_log.size()
+        self.checkpoint_count = 0
+        self.last_checkpoint_ms = 0.0
+        self.batch_latencies = deque(maxlen=4096)
+        self.batch_count = 0
+        self.record_count = 0
+        self.sync_count = 0
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, record, force=True):
+        """Queues a record and returns a ticket to wait on for durability.
+
+        The ticket of a record that is not forced is set once the record is
+        written, which does not mean it survives a crash.
+        """
+        ticket = CommitTicket()
+        self.pending.put((record, ticket, time.perf_counter(), force))
+        return ticket
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.perf_counter() + self.max_batch_delay
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = (
+                        self.pending.get(timeout=remaining)
+                        if remaining > 0
+                        else self.pending.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.write_batch(batch)
+            self.maybe_checkpoint()
+            if stopping:
+                break
+
+    def write_batch(self, batch):
+        error = None
+        try:
+            self.transaction_log.append_many(record for record, _, _, _ in batch)
+            if any(force for _, _, _, force in batch):
+                self.transaction_log.sync()
+                self.sync_count += 1
+        except Exception as e:
+            # Whatever went wrong, e.g. a record that cannot be encoded, the
+            # waiters get the error and the writer goes on with the next batch
+            error = e
+
+        finished = time.perf_counter()
+        self.batch_count += 1
+        self.record_count += len(batch)
+        self.records_since_checkpoint += len(batch)
+        self.batch_latencies.append((len(batch), finished - batch[0][2]))
+
+        for _, ticket, _, _ in batch:
+            ticket.error = error
+            ticket.event.set()
+
+    def maybe_checkpoint(self):
+        """Compacts the log if enough has been appended since the last checkpoint."""
+        if self.checkpoint is None:
+            return
+
+        # Never compact again before the log has at least doubled, otherwise a
+        # large set of unresolved transactions would be rewritten on every batch
+        size_limit = max(self.checkpoint_bytes, 2 * self.size_after_checkpoint)
+        if (
+            self.records_since_checkpoint < self.checkpoint_records
+            and self.transaction_log.size() < size_limit
+        ):
+            return
+
+        started = time.perf_counter()
+        try:
+            self.transaction_log.rewrite(self.checkpoint())
+        except Exception as e:
+            print(f"Checkpoint of {self.transaction_log.file_path} failed: {e}")
+            return
+
+        self.records_since_checkpoint = 0
+        self.size_after_checkpoint = self.transaction_log.size()
+        self.checkpoint_count += 1
+        self.last_checkpoint_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self):
+        """Summarises batch sizes and latencies of the recent batches."""
+        latencies = sorted(latency for _, latency in self.batch_latencies)
+        if not latencies:
+            return {"batches": 0, "records": 0}
+        return {
+            "batches": self.batch_count,
+            "records": self.record_count,
+            "syncs": self.sync_count,
+            "checkpoints": self.checkpoint_count,
+            "last_checkpoint_ms": self.last_checkpoint_ms,
+            "avg_batch_size": self.record_count / self.batch_count,
+            "p50_batch_latency_ms": latencies[len(latencies) // 2] * 1000,
+            "p99_batch_latency_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+            "max_batch_latency_ms": latencies[-1] * 1000,
+        }
+
+    def close(self):
+        """Flushes the remaining records and stops the writer thread."""
+        self.pending.put(None)
+        self.thread.join()
+        self.transaction_log.sync()
+        self.transaction_log.close()
+
+
+class TransactionTable:
+    """In-memory index of transactions keyed by ``transaction_id``.
+
+    Besides the merged transaction dicts it keeps the IDs of transactions that
+    are not done yet (``pending``) and, among those, of the ones that have no
+    decision yet (``in_doubt``), so lookups and recovery scans are O(1) per
+    transaction and never go back to disk.
+    """
+
+    def __init__(self):
+        self.transactions = {}
+        self.pending = set()
+        self.in_doubt = set()
+        self.lock = threading.Lock()
+
+    def apply(self, record):
+        """Merges a log record into the table and updates the status sets."""
+        transaction_id = record["transaction_id"]
+        with self.lock:
+            transaction = self.transactions.get(transaction_id)
+            if transaction is None:
+                transaction = self.transactions[transaction_id] = dict(record)
+            else:
+                transaction.update(record)
+
+            if transaction.get("status") == "done":
+                self.pending.discard(transaction_id)
+                self.in_doubt.discard(transaction_id)
+                return
+
+            self.pending.add(transaction_id)
+            if "decision" in transaction or transaction.get("response") == "Abort":
+                self.in_doubt.discard(transaction_id)
+            else:
+                self.in_doubt.add(transaction_id)
+
+    def get(self, transaction_id):
+        """Returns a copy of a transaction, or None if it is unknown."""
+        with self.lock:
+            transaction = self.transactions.get(transaction_id)
+            return dict(transaction) if transaction is not None else None
+
+    def is_pending(self, transaction_id):
+        with self.lock:
+            return transaction_id in self.pending
+
+    def pending_ids(self):
+        with self.lock:
+            return list(self.pending)
+
+    def in_doubt_ids(self):
+        with self.lock:
+            return list(self.in_doubt)
+
+    def all(self):
+        with self.lock:
+            return [dict(transaction) for transaction in self.transactions.values()]
+
+    def finished_ids(self):
+        with self.lock:
+            return set(self.transactions) - self.pending
+
+    def snapshot(self, finished=None):
+        """Drops done transactions and returns the unresolved ones as log records.
+
+        If ``finished`` is given, only the transactions in it are dropped.
+        """
+        with self.lock:
+            self.transactions = {
+                transaction_id: self.transactions[transaction_id]
+                for transaction_id in self.transactions
+                if transaction_id in self.pending
+                or (finished is not None and transaction_id not in finished)
+            }
+            return [dict(transaction) for transaction in self.transactions.values()]
+
+
+class TransactionStore:
+    """Transaction state backed by the group-committed log and the in-memory table.
+
+    The table is rebuilt once at start-up by replaying the log and is updated
+    on every write, so the read path never touches the disk. Checkpoints keep
+    only the unresolved transactions, in the log and in the table, so recovery
+    time and disk use follow the number of in-flight transactions.
+
+    ``before_checkpoint`` is called before finished transactions are dropped,
+    e.g. to make the data they wrote durable elsewhere.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        max_batch_delay=0.002,
+        max_batch_size=128,
+        checkpoint_records=10000,
+        checkpoint_bytes=4 * 1024 * 1024,
+        before_checkpoint=None,
+    ):
+        transaction_log = TransactionLog(file_path)
+        self.before_checkpoint = before_checkpoint
+        self.table = TransactionTable()
+        for record in read_records(file_path):
+            self.table.apply(record)
+        self.writer = GroupCommitWriter(
+            transaction_log,
+            max_batch_delay=max_batch_delay,
+            max_batch_size=max_batch_size,
+            checkpoint=self.checkpoint,
+            checkpoint_records=checkpoint_records,
+            checkpoint_bytes=checkpoint_bytes,
+        )
+
+    def checkpoint(self):
+        if self.before_checkpoint is None:
+            return self.table.snapshot()
+        # Transactions that finish while the hook runs are kept until the next
+        # checkpoint, the hook may not have covered them
+        finished = self.table.finished_ids()
+        self.before_checkpoint()
+        return self.table.snapshot(finished)
+
+    def write(self, record, force=True):
+        """Records a change and returns the commit ticket of its log record."""
+        self.table.apply(record)
+        return self.writer.append(record, force)
+
+    def get(self, transaction_id):
+        return self.table.get(transaction_id)
+
+    def is_pending(self, transaction_id):
+        return self.table.is_pending(transaction_id)
+
+    def pending_ids(self):
+        return self.table.pending_ids()
+
+    def in_doubt_ids(self):
+        return self.table.in_doubt_ids()
+
+    def transactions(self):
+        """Copies of every transaction in the table, in log order."""
+        return self.table.all()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def close(self):
+        self.writer.close()